@@ -1,12 +1,14 @@
 # app.py - Versão Robusta com Respostas Assíncronas
-from flask import Flask, request, abort
+from flask import Flask, request, abort, Response, stream_with_context, g
 from twilio.twiml.messaging_response import MessagingResponse
 from twilio.rest import Client
 import os
 from dotenv import load_dotenv
 import re
-from datetime import datetime, date
+from datetime import datetime, date, time, timedelta
 import atexit
+from apscheduler.schedulers.background import BackgroundScheduler
+import hmac
 from werkzeug.middleware.proxy_fix import ProxyFix
 from twilio.request_validator import RequestValidator
 
@@ -19,10 +21,23 @@ from database import (init_db, get_or_create_user, add_food_entry, add_weight_en
                       deactivate_reminder, update_last_interaction_date, 
                       get_last_interaction_date, get_all_users, delete_all_food_entries_for_day, 
                       get_food_entries_for_day_indexed, delete_food_entry_by_id, 
-                      set_user_state, get_user_state)
+                      set_user_state, get_user_state, get_daily_rollups,
+                      get_weight_trend, get_daily_food_portions, begin_request_scope,
+                      end_request_scope, UserShardMoving, DatabasePoolExhausted,
+                      DatabaseUnavailable, add_food_entries, get_recent_foods, get_food_entries_between,
+                      get_food_entries_page, delete_food_entries_by_ids, claim_due_reminders,
+                      shard_for_number)
 from activity_api import calculate_calories_burned
-from wit_nlp import get_wit_ai_response, parse_wit_ai_response 
+from wit_nlp import (get_wit_ai_response, parse_wit_ai_response, parse_local_message, parse_relog_command,
+                     parse_history_command, is_recommendation_request, parse_weight_goal)
+from resilience import begin_deadline, end_deadline, increment, render_metrics
+from request_profiler import (start_profiling, finish_profiling, tag_profile, aggregate_profiles,
+                              PROFILE_ADMIN_TOKEN)
 from taco_api import search_taco_options
+from taco_nutrients import get_nutrient_matrix, format_micronutrient_summary
+from food_recommender import get_recommender, remaining_targets, format_recommendations
+from history_export import stream_user_export, CONTENT_TYPES as EXPORT_CONTENT_TYPES
+from outbound_sender import OutboundScheduler, make_token_bucket, PRIORITY_INTERACTIVE, PRIORITY_BULK
 
 print("2. Funções de suporte importadas.")
 
@@ -39,6 +54,11 @@ TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_WHATSAPP_NUMBER = os.getenv('TWILIO_WHATSAPP_NUMBER') 
 
+# Token dos operadores para o endpoint /export (sem token configurado, o endpoint fica desativado)
+EXPORT_API_TOKEN = os.getenv('EXPORT_API_TOKEN')
+# Token opcional para /metrics (sem token, o endpoint é aberto: só expõe contadores, nada de usuário)
+METRICS_API_TOKEN = os.getenv('METRICS_API_TOKEN')
+
 # Cliente Twilio para enviar mensagens
 twilio_client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
 
@@ -47,22 +67,331 @@ with app.app_context():
     init_db()
 print("3. Banco de dados inicializado.")
 
-# --- NOVA FUNÇÃO CENTRALIZADA PARA ENVIAR MENSAGENS ---
-def send_message(to_number, message_body):
+def _deliver_via_twilio(to_number, message_body):
+    """Envio efetivo pela Twilio; chamado apenas pela thread do OutboundScheduler."""
+    print(f"Enviando para {to_number}: '{message_body[:50]}...'")
+    twilio_client.messages.create(
+        from_=TWILIO_WHATSAPP_NUMBER,
+        to=to_number,
+        body=message_body
+    )
+
+# Fila de saída com limite de taxa compartilhado e agrupamento por destinatário
+outbound_scheduler = OutboundScheduler(_deliver_via_twilio, make_token_bucket(f"twilio:{TWILIO_WHATSAPP_NUMBER}"))
+outbound_scheduler.start()
+atexit.register(outbound_scheduler.stop)
+
+# Lembretes: a cada REMINDER_CHECK_SECONDS os que venceram vão para a fila BULK (respostas passam na frente).
+# Cada worker roda o job; claim_due_reminders garante que um lembrete só é pego por um deles.
+REMINDER_CHECK_SECONDS = float(os.getenv('REMINDER_CHECK_SECONDS', '60'))
+
+def send_due_reminders():
+    try:
+        reminders = claim_due_reminders()
+    except Exception as e:
+        print(f"ERRO ao buscar lembretes vencidos: {e}")
+        return 0
+    for reminder in reminders:
+        send_message(reminder['whatsapp_number'], f"⏰ Lembrete: {reminder['reminder_text']}", PRIORITY_BULK)
+    return len(reminders)
+
+reminder_scheduler = BackgroundScheduler(daemon=True)
+reminder_scheduler.add_job(send_due_reminders, 'interval', seconds=REMINDER_CHECK_SECONDS,
+                           id='send_due_reminders', coalesce=True, max_instances=1)
+reminder_scheduler.start()
+atexit.register(lambda: reminder_scheduler.shutdown(wait=False))
+
+# Profiling amostrado do webhook (request_profiler.py). Desligado por padrão; registrado antes dos outros
+# ganchos para cobrir a requisição inteira.
+@app.before_request
+def _maybe_start_profiling():
+    start_profiling(request.path, request.headers)
+
+@app.teardown_request
+def _finish_profiling(exc):
+    finish_profiling()
+
+# Escopo de banco por requisição: depois da primeira escrita, as leituras da mesma requisição vão para o primário.
+# O remetente (From) define o shard padrão da requisição.
+# Cada requisição também ganha um orçamento de tempo (REQUEST_BUDGET_SECONDS) que limita Wit.ai e o pool do banco.
+@app.before_request
+def _open_db_request_scope():
+    g.deadline_token = begin_deadline()
+    g.db_scope_token = begin_request_scope(request.values.get('From') or None)
+
+@app.teardown_request
+def _close_db_request_scope(exc):
+    token = g.pop('db_scope_token', None)
+    if token is not None:
+        end_request_scope(token)
+    deadline_token = g.pop('deadline_token', None)
+    if deadline_token is not None:
+        end_deadline(deadline_token)
+
+# --- FUNÇÃO CENTRALIZADA PARA ENVIAR MENSAGENS ---
+def send_message(to_number, message_body, priority=PRIORITY_INTERACTIVE):
     """
-    Função robusta para enviar mensagens via Twilio Client.
-    Esta será a ÚNICA maneira de enviar respostas ao usuário.
+    Coloca a mensagem na fila de saída. Esta será a ÚNICA maneira de enviar respostas ao usuário.
+    Respostas a mensagens recebidas usam PRIORITY_INTERACTIVE; lembretes e broadcasts usam PRIORITY_BULK.
     """
     try:
-        print(f"Enviando para {to_number}: '{message_body[:50]}...'")
-        twilio_client.messages.create(
-            from_=TWILIO_WHATSAPP_NUMBER,
-            to=to_number,
-            body=message_body
-        )
+        outbound_scheduler.enqueue(to_number, message_body, priority)
     except Exception as e:
         print(f"ERRO CRÍTICO AO ENVIAR MENSAGEM para {to_number}: {e}")
 
+def build_period_report(whatsapp_number, title, start_date):
+    """Monta o texto do relatório semanal/mensal a partir de daily_rollups (no máximo 31 linhas)."""
+    rollups = get_daily_rollups(whatsapp_number, start_date)
+    logged_days = [r for r in rollups if r['food_entries_count'] > 0]
+    if not rollups:
+        return f"📊 *{title}*\n\nAinda não há registros nesse período."
+
+    total_in = sum(r['kcal_in'] for r in rollups)
+    total_burned = sum(r['kcal_burned'] for r in rollups)
+    total_carbs = sum(r['carbohydrates'] for r in rollups)
+    total_proteins = sum(r['proteins'] for r in rollups)
+    total_fats = sum(r['fats'] for r in rollups)
+    avg_in = total_in / len(logged_days) if logged_days else 0
+
+    lines = [f"📊 *{title}* ({start_date.strftime('%d/%m')} a {date.today().strftime('%d/%m')})", ""]
+    lines.append(f"*Consumido:* {total_in:.0f} kcal ({len(logged_days)} dias com registro)")
+    lines.append(f"*Média diária:* {avg_in:.0f} kcal")
+    lines.append(f"*Gasto em exercícios:* {total_burned:.0f} kcal")
+    lines.append(f"*Macros:* C {total_carbs:.0f}g | P {total_proteins:.0f}g | G {total_fats:.0f}g")
+
+    weights = [r['last_weight'] for r in rollups if r['last_weight'] is not None]
+    if weights:
+        weight_line = f"*Peso:* {weights[-1]:.1f} kg"
+        if len(weights) > 1:
+            weight_line += f" ({weights[-1] - weights[0]:+.1f} kg no período)"
+        lines.append(weight_line)
+
+    calorie_goal = get_goal(whatsapp_number, 'calorie_intake')
+    if calorie_goal and logged_days:
+        days_within_goal = sum(1 for r in logged_days if r['kcal_in'] <= calorie_goal['target_value'])
+        lines.append(f"*Meta:* dentro da meta em {days_within_goal} de {len(logged_days)} dias.")
+    return "\n".join(lines)
+
+def build_daily_summary_reply(whatsapp_number):
+    """Resumo de hoje: alimentos, exercícios, último peso e quanto falta para a meta."""
+    summary = get_daily_summary(whatsapp_number)
+    if not summary['foods'] and not summary['exercises']:
+        return "📋 Nada registrado hoje ainda. Mande, por exemplo, 'comi 100g de arroz'."
+
+    total_in = sum(f['calories'] for f in summary['foods'])
+    total_burned = sum(e['calories_burned'] for e in summary['exercises'])
+    lines = ["📋 *Resumo de hoje*", ""]
+    for food in summary['foods']:
+        lines.append(f"• {food['foods_description']} ({food['calories']:.0f} kcal)")
+    for exercise in summary['exercises']:
+        lines.append(f"• {exercise['activity_name']}, {exercise['duration_minutes']} min (-{exercise['calories_burned']:.0f} kcal)")
+    lines.append("")
+    lines.append(f"*Consumido:* {total_in:.0f} kcal")
+    if total_burned:
+        lines.append(f"*Gasto em exercícios:* {total_burned:.0f} kcal")
+    if summary['last_weight'] is not None:
+        lines.append(f"*Último peso:* {summary['last_weight']:.1f} kg")
+    calorie_goal = get_goal(whatsapp_number, 'calorie_intake')
+    if calorie_goal:
+        lines.append(f"*Meta:* {calorie_goal['target_value'] - total_in:.0f} kcal restantes.")
+    return "\n".join(lines)
+
+def build_weight_trend_reply(whatsapp_number):
+    trend = get_weight_trend(whatsapp_number)
+    if not trend or trend['smoothed_weight'] is None:
+        return "⚖️ Ainda não tenho pesagens suficientes para calcular sua tendência. Registre seu peso alguns dias."
+
+    lines = ["⚖️ *Tendência de peso*", "", f"*Peso suavizado:* {trend['smoothed_weight']:.1f} kg"]
+    if trend['avg_7d'] is not None:
+        lines.append(f"*Média de 7 dias:* {trend['avg_7d']:.1f} kg")
+    if trend['weekly_change_kg'] is not None:
+        lines.append(f"*Ritmo:* {trend['weekly_change_kg']:+.2f} kg/semana")
+    if trend['projected_goal_date']:
+        lines.append(f"*Previsão para a meta:* {trend['projected_goal_date'].strftime('%d/%m/%Y')}")
+    elif not get_goal(whatsapp_number, 'weight'):
+        lines.append("Defina uma meta de peso ('meta de peso 70') para ver a previsão.")
+    return "\n".join(lines)
+
+def build_micronutrient_reply(whatsapp_number):
+    portions = get_daily_food_portions(whatsapp_number)
+    if not portions['taco_food_ids']:
+        return "🥦 Ainda não há alimentos da TACO registrados hoje para calcular os micronutrientes."
+    totals = get_nutrient_matrix().totals(portions['taco_food_ids'], portions['grams'])
+    return format_micronutrient_summary(totals, len(portions['taco_food_ids']), portions['unlinked_count'])
+
+def build_saved_reply(whatsapp_number, saved_label):
+    """Confirmação de refeição salva com o total do dia e o quanto falta para a meta."""
+    total_consumed_today = sum(f['calories'] for f in get_daily_summary(whatsapp_number)['foods'])
+    response_text = f"✅ Salvo! ({saved_label})\n\n*Total de hoje:* {total_consumed_today:.0f} kcal."
+    calorie_goal = get_goal(whatsapp_number, 'calorie_intake')
+    if calorie_goal:
+        remaining = calorie_goal['target_value'] - total_consumed_today
+        response_text += f"\n*Meta:* {remaining:.0f} kcal restantes."
+    return response_text
+
+def build_recommendation_reply(whatsapp_number):
+    """'O que ainda posso comer?': sugestões da TACO que cabem no que resta da meta de hoje."""
+    calorie_goal = get_goal(whatsapp_number, 'calorie_intake')
+    if not calorie_goal:
+        return "🎯 Para sugerir o que comer, defina antes sua meta diária. Ex: 'Definir meta 2000'."
+    remaining = remaining_targets(calorie_goal['target_value'], get_daily_summary(whatsapp_number)['foods'])
+    history = {f['taco_food_id']: f['times_logged'] for f in get_recent_foods(whatsapp_number) if f['taco_food_id']}
+    suggestions = get_recommender().recommend(remaining, history)
+    return format_recommendations(remaining, suggestions)
+
+# Faixas de horário usadas por "repetir almoço de ontem"
+MEAL_WINDOWS = {
+    'cafe_da_manha': ("café da manhã", time(4, 0), time(10, 59, 59)),
+    'almoco': ("almoço", time(11, 0), time(15, 29, 59)),
+    'lanche': ("lanche", time(15, 30), time(17, 59, 59)),
+    'jantar': ("jantar", time(18, 0), time(23, 59, 59)),
+}
+
+def handle_relog_command(whatsapp_number, command, context_data):
+    """Atalhos de re-registro: tudo vem do histórico do usuário, sem Wit.ai nem busca na TACO."""
+    if command['command'] == 'list':
+        recent_foods = get_recent_foods(whatsapp_number)
+        if not recent_foods:
+            send_message(whatsapp_number, "Você ainda não tem alimentos recentes. Registre uma refeição primeiro!")
+            return
+        response_lines = ["🍽️ Seus alimentos mais registrados:"]
+        for i, food in enumerate(recent_foods):
+            response_lines.append(f"*{i + 1}*. {food['foods_description']} ({food['calories']:.0f} kcal)")
+        response_lines.append("\nDigite o(s) número(s) para registrar de novo (ex.: 1 ou 1 3) ou 'cancela'.")
+        send_message(whatsapp_number, "\n".join(response_lines))
+        set_user_state(whatsapp_number, 'awaiting_recent_selection', context_data={'recent_foods': recent_foods})
+
+    elif command['command'] == 'usual':
+        recent_foods = get_recent_foods(whatsapp_number)
+        if not recent_foods:
+            send_message(whatsapp_number, "Ainda não sei qual é o de sempre. Registre algumas refeições primeiro!")
+            return
+        add_food_entries(whatsapp_number, recent_foods[:1])
+        send_message(whatsapp_number, build_saved_reply(whatsapp_number, recent_foods[0]['foods_description']))
+
+    elif command['command'] == 'repeat_meal':
+        meal_name, start_time, end_time = MEAL_WINDOWS[command['meal']]
+        day = date.today() - timedelta(days=command['days_ago'])
+        entries = get_food_entries_between(whatsapp_number, day, start_time, end_time)
+        if not entries:
+            send_message(whatsapp_number, f"Não encontrei registros de {meal_name} em {day.strftime('%d/%m')}.")
+            return
+        add_food_entries(whatsapp_number, entries)
+        send_message(whatsapp_number, build_saved_reply(whatsapp_number, ", ".join(e['foods_description'] for e in entries)))
+
+    elif command['command'] == 'pick':
+        recent_foods = context_data.get('recent_foods', [])
+        chosen = [recent_foods[int(n) - 1] for n in command['choices'] if 1 <= int(n) <= len(recent_foods)]
+        if not chosen:
+            send_message(whatsapp_number, "Número inválido. Escolha um número da lista ou digite 'cancela'.")
+            return
+        add_food_entries(whatsapp_number, chosen)
+        set_user_state(whatsapp_number, 'none')
+        send_message(whatsapp_number, build_saved_reply(whatsapp_number, ", ".join(f['foods_description'] for f in chosen)))
+
+    elif command['command'] == 'cancel':
+        send_message(whatsapp_number, "Ok, operação cancelada.")
+        set_user_state(whatsapp_number, 'none')
+
+def send_history_page(whatsapp_number, before=None, deleting=False):
+    """Mostra uma página do histórico e guarda no estado os ids listados e o cursor da próxima página."""
+    page = get_food_entries_page(whatsapp_number, before)
+    if not page['entries']:
+        if before is None:
+            send_message(whatsapp_number, "Você ainda não tem alimentos registrados.")
+        else:
+            send_message(whatsapp_number, "Não há registros mais antigos.")
+        set_user_state(whatsapp_number, 'none')
+        return
+
+    response_lines = ["🗂️ Seu histórico de alimentos:" if before is None else "🗂️ Registros mais antigos:"]
+    listed_entries = []
+    for i, entry in enumerate(page['entries']):
+        label = f"{entry['entry_date'].strftime('%d/%m/%Y')} · {entry['foods_description']} ({entry['calories']:.0f} kcal)"
+        response_lines.append(f"*{i + 1}*. {label}")
+        listed_entries.append({'id': entry['id'], 'label': label})
+    if deleting:
+        response_lines.append("\nDigite o(s) número(s) para apagar (ex.: 1 ou 1 3).")
+    else:
+        response_lines.append("\nPara apagar, mande 'apagar' e o(s) número(s) (ex.: apagar 1 3).")
+    if page['next_cursor']:
+        response_lines.append("Mande 'mais' para ver registros mais antigos.")
+    response_lines.append("Ou 'cancela' para sair.")
+    send_message(whatsapp_number, "\n".join(response_lines))
+
+    next_cursor = None
+    if page['next_cursor']:
+        next_cursor = [page['next_cursor'][0].isoformat(), page['next_cursor'][1]]
+    set_user_state(whatsapp_number, 'browsing_history',
+                   context_data={'entries': listed_entries, 'next_cursor': next_cursor})
+
+def handle_history_command(whatsapp_number, command, context_data):
+    """Histórico paginado ('histórico', 'mais') e exclusão em lote dos itens listados ('apagar 1 3')."""
+    if command['command'] == 'list':
+        send_history_page(whatsapp_number)
+
+    elif command['command'] == 'more':
+        next_cursor = context_data.get('next_cursor')
+        if not next_cursor:
+            send_message(whatsapp_number, "Esse é o fim do seu histórico. Digite 'cancela' para sair.")
+            return
+        send_history_page(whatsapp_number, before=(date.fromisoformat(next_cursor[0]), next_cursor[1]))
+
+    elif command['command'] == 'delete':
+        listed_entries = context_data.get('entries')
+        if not listed_entries:
+            # Os números só valem para uma lista aberta: mostra a primeira página para o usuário escolher
+            send_history_page(whatsapp_number, deleting=True)
+            return
+        if not command['choices']:
+            send_message(whatsapp_number, "Digite o(s) número(s) da lista para apagar (ex.: 1 ou 1 3) ou 'cancela'.")
+            return
+        chosen = []
+        for choice in dict.fromkeys(int(n) for n in command['choices']):
+            if 1 <= choice <= len(listed_entries):
+                chosen.append(listed_entries[choice - 1])
+        if not chosen:
+            send_message(whatsapp_number, "Número inválido. Escolha um número da lista ou digite 'cancela'.")
+            return
+        response_lines = ["🗑️ Vou apagar:"] + [f"• {entry['label']}" for entry in chosen]
+        response_lines.append("\nConfirma? (sim/não)")
+        send_message(whatsapp_number, "\n".join(response_lines))
+        set_user_state(whatsapp_number, 'awaiting_delete_confirmation',
+                       context_data={'entry_ids': [entry['id'] for entry in chosen]})
+
+    elif command['command'] == 'confirm':
+        entry_ids = context_data.get('entry_ids', [])
+        rows_deleted = delete_food_entries_by_ids(whatsapp_number, entry_ids)
+        set_user_state(whatsapp_number, 'none')
+        if rows_deleted == len(entry_ids):
+            send_message(whatsapp_number, f"✅ {rows_deleted} registro(s) apagado(s).")
+        else:
+            send_message(whatsapp_number, f"✅ {rows_deleted} registro(s) apagado(s). Os outros já não existiam.")
+
+    elif command['command'] == 'cancel':
+        send_message(whatsapp_number, "Ok, nada foi apagado.")
+        set_user_state(whatsapp_number, 'none')
+
+@app.errorhandler(UserShardMoving)
+def _user_shard_moving(e):
+    # Migração de shard leva poucos segundos; pede para o usuário repetir em vez de gravar no shard errado
+    print(f"AVISO: {e}")
+    from_number = request.values.get('From')
+    if from_number:
+        send_message(from_number, "⏳ Estamos organizando seus dados rapidinho. Tente de novo em alguns segundos!")
+    return str(MessagingResponse())
+
+@app.errorhandler(DatabasePoolExhausted)
+@app.errorhandler(DatabaseUnavailable)
+def _database_overloaded(e):
+    # Descarta a mensagem com uma resposta amigável e 200: um 500 faria a Twilio reenviar e aumentar a carga
+    print(f"AVISO: descartando requisição, banco sobrecarregado/indisponível: {e}")
+    increment('db_load_shed')
+    from_number = request.values.get('From')
+    if from_number:
+        send_message(from_number, "⏳ Estou com muito movimento agora. Tente novamente em instantes!")
+    return str(MessagingResponse())
+
 @app.route("/webhook", methods=['POST'])
 def webhook():
     # Validação da Twilio
@@ -81,13 +410,86 @@ def webhook():
     current_state = user_state['state']
     context_data = user_state.get('context_data') or {}
     
+    # Atalhos de re-registro ("o de sempre", "recentes", "repetir almoço de ontem", número da lista de recentes)
+    relog_command = parse_relog_command(incoming_msg)
+    if relog_command is None and current_state == 'awaiting_recent_selection':
+        answer = incoming_msg.lower().strip()
+        if answer in ['cancela', 'cancelar']:
+            relog_command = {'command': 'cancel'}
+        elif re.fullmatch(r'\d+(?:[\s,e]+\d+)*', answer):
+            relog_command = {'command': 'pick', 'choices': re.findall(r'\d+', answer)}
+    if relog_command:
+        tag_profile(intent=f"atalho_{relog_command['command']}", state=current_state)
+        if current_state not in ('none', 'awaiting_recent_selection'):
+            print(f"DEBUG: Interrompendo estado '{current_state}' com atalho '{relog_command['command']}'.")
+            set_user_state(from_number, 'none')
+        handle_relog_command(from_number, relog_command, context_data)
+        return str(MessagingResponse())
+
+    # Histórico ("histórico", "mais", "apagar 1 3", números e confirmação dentro do fluxo)
+    history_command = parse_history_command(incoming_msg)
+    answer = incoming_msg.lower().strip().rstrip('!.')
+    if history_command is None and current_state == 'browsing_history':
+        if answer in ['cancela', 'cancelar', 'sair']:
+            history_command = {'command': 'cancel'}
+        elif re.fullmatch(r'\d+(?:[\s,e]+\d+)*', answer):
+            history_command = {'command': 'delete', 'choices': re.findall(r'\d+', answer)}
+    elif history_command is None and current_state == 'awaiting_delete_confirmation':
+        if answer in ['sim', 's', 'ok', 'confirmo', 'pode apagar']:
+            history_command = {'command': 'confirm'}
+        elif answer in ['não', 'nao', 'n', 'cancela', 'cancelar']:
+            history_command = {'command': 'cancel'}
+    elif history_command and history_command['command'] == 'more' and current_state != 'browsing_history':
+        history_command = None  # "mais" fora do histórico segue para o NLP
+    if history_command:
+        tag_profile(intent=f"historico_{history_command['command']}", state=current_state)
+        if current_state not in ('none', 'browsing_history', 'awaiting_delete_confirmation'):
+            print(f"DEBUG: Interrompendo estado '{current_state}' com comando de histórico '{history_command['command']}'.")
+            set_user_state(from_number, 'none')
+            context_data = {}
+        handle_history_command(from_number, history_command, context_data)
+        return str(MessagingResponse())
+
+    # "O que ainda posso comer?": mesma lista de frases com ou sem Wit.ai
+    if is_recommendation_request(incoming_msg):
+        tag_profile(intent='recomendar_alimento', state=current_state)
+        if current_state != 'none':
+            print(f"DEBUG: Interrompendo estado '{current_state}' com pedido de sugestões.")
+            set_user_state(from_number, 'none')
+        send_message(from_number, build_recommendation_reply(from_number))
+        return str(MessagingResponse())
+
+    # "Meta de peso 70": usada na projeção da tendência de peso
+    weight_goal = parse_weight_goal(incoming_msg)
+    if weight_goal is not None:
+        tag_profile(intent='definir_meta_peso', state=current_state)
+        if current_state != 'none':
+            print(f"DEBUG: Interrompendo estado '{current_state}' com meta de peso.")
+            set_user_state(from_number, 'none')
+        if not 20 <= weight_goal <= 400:
+            send_message(from_number, "Valor inválido para a meta de peso.")
+        else:
+            set_goal(from_number, 'weight', weight_goal)
+            send_message(from_number, f"✅ Meta de peso de {weight_goal:.1f} kg definida! A previsão aparece em 'tendência'.")
+        return str(MessagingResponse())
+
     # Análise de NLP
     wit_response = get_wit_ai_response(incoming_msg)
-    parsed_data = parse_wit_ai_response(wit_response)
+    nlu_degraded = wit_response is None
+    if nlu_degraded:
+        # Wit.ai fora do ar ou lento: regras locais cobrem os comandos principais
+        increment('nlu_local_fallback')
+        parsed_data = parse_local_message(incoming_msg)
+        print(f"AVISO: Wit.ai indisponível, interpretação local: {parsed_data}")
+    else:
+        parsed_data = parse_wit_ai_response(wit_response)
     intent = parsed_data.get('intent')
+    tag_profile(intent=intent, state=current_state)
     
     # Lógica de Reset Inteligente
-    interrupting_intents = ['registrar_refeicao', 'registrar_peso', 'definir_meta', 'saudacao', 'obter_resumo_diario']
+    interrupting_intents = ['registrar_refeicao', 'registrar_peso', 'definir_meta', 'saudacao', 'obter_resumo_diario',
+                           'obter_resumo_semanal', 'obter_resumo_mensal', 'obter_tendencia_peso',
+                           'obter_micronutrientes', 'recomendar_alimento']
     if current_state != 'none' and intent in interrupting_intents:
         print(f"DEBUG: Interrompendo estado '{current_state}' com novo comando '{intent}'.")
         set_user_state(from_number, 'none')
@@ -102,14 +504,9 @@ def webhook():
         if answer in ['sim', 's', 'ok', 'correto', 'isso']:
             best_guess = meal_context.get('best_guess')
             if best_guess:
-                add_food_entry(from_number, best_guess['foods_listed'], best_guess['calories'], best_guess['carbohydrates'], best_guess['proteins'], best_guess['fats'])
-                total_consumed_today = sum(f['calories'] for f in get_daily_summary(from_number)['foods'])
-                response_text = f"✅ Salvo! ({best_guess['original_alimento']})\n\n*Total de hoje:* {total_consumed_today:.0f} kcal."
-                calorie_goal = get_goal(from_number, 'calorie_intake')
-                if calorie_goal:
-                    remaining = calorie_goal['target_value'] - total_consumed_today
-                    response_text += f"\n*Meta:* {remaining:.0f} kcal restantes."
-                send_message(from_number, response_text)
+                add_food_entry(from_number, best_guess['foods_listed'], best_guess['calories'], best_guess['carbohydrates'], best_guess['proteins'], best_guess['fats'],
+                               taco_food_id=best_guess.get('taco_food_id'), grams=best_guess.get('grams'))
+                send_message(from_number, build_saved_reply(from_number, best_guess['original_alimento']))
             else:
                 send_message(from_number, "🤔 Ocorreu um erro, tente de novo.")
             set_user_state(from_number, 'none')
@@ -140,20 +537,22 @@ def webhook():
             set_user_state(from_number, 'none')
         elif answer in alternatives_map:
             chosen_food = alternatives_map[answer]
-            add_food_entry(from_number, chosen_food['foods_listed'], chosen_food['calories'], chosen_food['carbohydrates'], chosen_food['proteins'], chosen_food['fats'])
-            
-            total_consumed_today = sum(f['calories'] for f in get_daily_summary(from_number)['foods'])
-            response_text = f"✅ Salvo! ({chosen_food['original_alimento']})\n\n*Total de hoje:* {total_consumed_today:.0f} kcal."
-            calorie_goal = get_goal(from_number, 'calorie_intake')
-            if calorie_goal:
-                remaining = calorie_goal['target_value'] - total_consumed_today
-                response_text += f"\n*Meta:* {remaining:.0f} kcal restantes."
-            
-            send_message(from_number, response_text)
+            add_food_entry(from_number, chosen_food['foods_listed'], chosen_food['calories'], chosen_food['carbohydrates'], chosen_food['proteins'], chosen_food['fats'],
+                           taco_food_id=chosen_food.get('taco_food_id'), grams=chosen_food.get('grams'))
+            send_message(from_number, build_saved_reply(from_number, chosen_food['original_alimento']))
             set_user_state(from_number, 'none')
         else:
             send_message(from_number, "Número inválido. Escolha um número da lista ou digite 'cancela'.")
 
+    elif current_state == 'awaiting_recent_selection':
+        send_message(from_number, "Número inválido. Escolha um número da lista de recentes ou digite 'cancela'.")
+
+    elif current_state == 'browsing_history':
+        send_message(from_number, "Não entendi. Mande 'apagar' e o(s) número(s), 'mais' ou 'cancela'.")
+
+    elif current_state == 'awaiting_delete_confirmation':
+        send_message(from_number, "Não entendi. Responda 'sim' para apagar ou 'não' para manter.")
+
     # --- ROTEAMENTO DE INTENÇÃO (só roda se não estivermos em um estado) ---
     elif current_state == 'none':
         entities = parsed_data.get('entities', {})
@@ -174,8 +573,31 @@ def webhook():
                     send_message(from_number, f"Encontrei: *{best_guess['original_alimento']}*.\n\nEstá correto? (sim/não)")
                     set_user_state(from_number, 'awaiting_meal_confirmation', context_data=meal_context)
         
+        elif intent == 'saudacao':
+            send_message(from_number, "Olá! 👋 Posso registrar refeições ('comi 100g de arroz'), peso ('peso 80'), "
+                                      "definir suas metas ('meta 2000', 'meta de peso 70') e mandar resumos ('resumo', 'resumo da semana').")
+
+        elif intent == 'registrar_peso':
+            weight_values = entities.get('weight') or [q['value'] for q in entities.get('quantity', []) if q.get('value')]
+            try:
+                weight = float(str(weight_values[0]).replace(',', '.')) if weight_values else None
+            except (ValueError, TypeError):
+                weight = None
+            if weight is None:
+                send_message(from_number, "Não entendi o peso. Diga, por exemplo, 'peso 80,5'.")
+            elif not 20 <= weight <= 400:
+                send_message(from_number, "Valor inválido para o peso.")
+            else:
+                add_weight_entry(from_number, weight)
+                send_message(from_number, f"✅ Peso de {weight:.1f} kg registrado!")
+
+        elif intent == 'obter_resumo_diario':
+            send_message(from_number, build_daily_summary_reply(from_number))
+
         elif intent == 'definir_meta':
             goal_value = entities.get('goal_value')
+            if isinstance(goal_value, list):
+                goal_value = goal_value[0] if goal_value else None
             if goal_value:
                  try:
                     set_goal(from_number, 'calorie_intake', float(goal_value))
@@ -185,12 +607,93 @@ def webhook():
             else:
                 send_message(from_number, "Não entendi o valor da meta. Diga, por exemplo, 'Definir meta 2000'.")
         
+        elif intent == 'obter_resumo_semanal':
+            start_date = date.today() - timedelta(days=6)
+            send_message(from_number, build_period_report(from_number, "Resumo da semana", start_date))
+
+        elif intent == 'obter_resumo_mensal':
+            start_date = date.today().replace(day=1)
+            send_message(from_number, build_period_report(from_number, "Resumo do mês", start_date))
+
+        elif intent == 'obter_tendencia_peso':
+            send_message(from_number, build_weight_trend_reply(from_number))
+
+        elif intent == 'obter_micronutrientes':
+            send_message(from_number, build_micronutrient_reply(from_number))
+
+        elif intent == 'recomendar_alimento':
+            send_message(from_number, build_recommendation_reply(from_number))
+
         else: # Fallback para qualquer outra intenção ou falta de intenção
             if intent != 'none': # Evita mandar msg de erro para msgs vazias ou que o wit.ai ignorou
                  send_message(from_number, "Desculpe, não entendi o que você quis dizer.")
+            elif nlu_degraded and incoming_msg:
+                 send_message(from_number, "⚠️ Estou com dificuldade para entender frases livres agora. "
+                                           "Tente algo como 'comi 100g de arroz', 'meta 2000' ou 'resumo da semana'.")
 
     # A CADA REQUISIÇÃO, SEMPRE RETORNA UMA RESPOSTA VAZIA IMEDIATAMENTE.
     return str(MessagingResponse())
 
+@app.route("/export", methods=['GET'])
+def export_history():
+    """
+    Exporta o histórico completo de um usuário em streaming.
+    Exige 'Authorization: Bearer <EXPORT_API_TOKEN>'. Parâmetros: number (obrigatório), format=csv|ndjson.
+    """
+    if not EXPORT_API_TOKEN:
+        return abort(404)
+    auth_header = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(auth_header.encode(), f"Bearer {EXPORT_API_TOKEN}".encode()):
+        return abort(403)
+
+    whatsapp_number = request.args.get('number', '').strip()
+    fmt = request.args.get('format', 'ndjson')
+    if not whatsapp_number or fmt not in EXPORT_CONTENT_TYPES:
+        return abort(400)
+
+    # O shard é resolvido antes do 200: uma migração começando no meio do stream cortaria o arquivo
+    try:
+        shard = shard_for_number(whatsapp_number)
+    except UserShardMoving as e:
+        print(f"AVISO: {e}")
+        return Response("Usuário em migração de shard; tente de novo em alguns segundos.\n", status=503,
+                        mimetype='text/plain', headers={'Retry-After': '30'})
+
+    filename = f"historico_{re.sub(r'[^0-9]', '', whatsapp_number)}.{fmt}"
+    return Response(
+        stream_with_context(stream_user_export(whatsapp_number, fmt, shard=shard)),
+        mimetype=EXPORT_CONTENT_TYPES[fmt],
+        headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+    )
+
+@app.route("/metrics", methods=['GET'])
+def metrics():
+    """Estado dos circuit breakers e contadores do modo degradado (formato texto do Prometheus)."""
+    if METRICS_API_TOKEN:
+        auth_header = request.headers.get('Authorization', '')
+        if not hmac.compare_digest(auth_header.encode(), f"Bearer {METRICS_API_TOKEN}".encode()):
+            return abort(403)
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
+@app.route("/admin/profiles", methods=['GET'])
+def admin_profiles():
+    """
+    Funções mais caras somando os perfis gravados pelo request_profiler.
+    Exige 'Authorization: Bearer <PROFILE_ADMIN_TOKEN>'. Parâmetros opcionais: intent, state, limit, sort
+    (cumulative|tottime|ncalls), files (só os N perfis mais recentes).
+    """
+    if not PROFILE_ADMIN_TOKEN:
+        return abort(404)
+    auth_header = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(auth_header.encode(), f"Bearer {PROFILE_ADMIN_TOKEN}".encode()):
+        return abort(403)
+    return aggregate_profiles(
+        intent=request.args.get('intent'),
+        state=request.args.get('state'),
+        limit=request.args.get('limit', 30, type=int),
+        sort=request.args.get('sort', 'cumulative'),
+        max_files=request.args.get('files', type=int),
+    )
+
 if __name__ == "__main__":
     app.run(debug=False, host='0.0.0.0', port=os.environ.get('PORT', 5000))
\ No newline at end of file
@@ -0,0 +1,25 @@
+# backfill_daily_rollups.py
+# Recalcula a tabela daily_rollups a partir do histórico de food_entries, exercise_entries e weight_entries.
+# Uso: python backfill_daily_rollups.py            (todo o histórico)
+#      python backfill_daily_rollups.py 2024-01-01 (só a partir da data informada)
+import sys
+from datetime import datetime
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import init_db, backfill_daily_rollups
+
+if __name__ == '__main__':
+    since_date = None
+    if len(sys.argv) > 1:
+        try:
+            since_date = datetime.strptime(sys.argv[1], '%Y-%m-%d').date()
+        except ValueError:
+            print(f"ERRO: data inválida '{sys.argv[1]}'. Use o formato AAAA-MM-DD.")
+            sys.exit(1)
+
+    init_db()
+    print(f"Recalculando resumos diários {'de todo o histórico' if since_date is None else f'desde {since_date}'}...")
+    rows_written = backfill_daily_rollups(since_date)
+    print(f"Backfill concluído: {rows_written} resumos diários gravados.")
@@ -0,0 +1,15 @@
+# backfill_recent_foods.py
+# Preenche user_recent_foods (atalhos "recentes" / "o de sempre") a partir de todo o histórico de food_entries.
+# Rode uma vez depois do deploy que cria a tabela; as refeições novas já mantêm a tabela em dia.
+# Uso: python backfill_recent_foods.py
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import init_db, backfill_recent_foods
+
+if __name__ == '__main__':
+    init_db()
+    print("Recalculando alimentos recentes de todos os usuários...")
+    rows_written = backfill_recent_foods()
+    print(f"Backfill concluído: {rows_written} alimentos recentes gravados.")
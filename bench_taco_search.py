@@ -0,0 +1,239 @@
+# bench_taco_search.py
+"""
+Benchmark e avaliação de relevância da busca na TACO.
+
+Mede duas coisas ao mesmo tempo:
+  * qualidade: acurácia top-1 e top-5 sobre um corpus de frases reais de refeições;
+  * velocidade: latência por consulta ao rodar 1, 100 e 10.000 consultas.
+
+Uso:
+    python bench_taco_search.py                 # usa o PostgreSQL (DATABASE_URL)
+    python bench_taco_search.py --engine csv    # emula a busca do DB sobre o taco_data.csv, sem rede
+    python bench_taco_search.py --engine snapshot  # busca no snapshot mmap (taco_snapshot.py)
+    python bench_taco_search.py --runs 1,100    # escolhe os tamanhos das rodadas
+"""
+import argparse
+import contextlib
+import csv
+import os
+import statistics
+import time
+
+from taco_api import parse_food_query, build_food_option, search_taco_options
+
+TACO_CSV_FILE = 'taco_data.csv'
+DEFAULT_RUNS = (1, 100, 10000)
+
+# Corpus de regressão: (texto que chega em search_taco_options, alimentos TACO aceitos como corretos).
+# O primeiro item aceito é o que a maioria das pessoas quer dizer; os demais também contam como acerto.
+RELEVANCE_CORPUS = [
+    ("arroz", ["Arroz, tipo 1, cozido", "Arroz, tipo 2, cozido"]),
+    ("150g de arroz", ["Arroz, tipo 1, cozido", "Arroz, tipo 2, cozido"]),
+    ("arroz integral", ["Arroz, integral, cozido"]),
+    ("feijão", ["Feijão, carioca, cozido", "Feijão, preto, cozido"]),
+    ("feijao", ["Feijão, carioca, cozido", "Feijão, preto, cozido"]),
+    ("100g de feijão preto", ["Feijão, preto, cozido"]),
+    ("feijoada", ["Feijoada"]),
+    ("frango", ["Frango, peito, sem pele, grelhado", "Frango, peito, sem pele, cozido"]),
+    ("200g de peito de frango", ["Frango, peito, sem pele, grelhado", "Frango, peito, sem pele, cozido"]),
+    ("frango grelhado", ["Frango, peito, sem pele, grelhado"]),
+    ("ovo", ["Ovo, de galinha, inteiro, cozido/10minutos", "Ovo, de galinha, inteiro, frito"]),
+    ("ovo frito", ["Ovo, de galinha, inteiro, frito"]),
+    ("banana", ["Banana, prata, crua", "Banana, nanica, crua"]),
+    ("banana prata", ["Banana, prata, crua"]),
+    ("maçã", ["Maçã, Fuji, com casca, crua", "Maçã, Argentina, com casca, crua"]),
+    ("maca", ["Maçã, Fuji, com casca, crua", "Maçã, Argentina, com casca, crua"]),
+    ("pão francês", ["Pão, trigo, francês"]),
+    ("pao frances", ["Pão, trigo, francês"]),
+    ("pão", ["Pão, trigo, francês", "Pão, trigo, forma, integral"]),
+    ("pão de queijo", ["Pão, de queijo, assado"]),
+    ("leite", ["Leite, de vaca, integral", "Leite, de vaca, desnatado, UHT"]),
+    ("200ml de leite", ["Leite, de vaca, integral", "Leite, de vaca, desnatado, UHT"]),
+    ("café", ["Café, infusão 10%"]),
+    ("cafe", ["Café, infusão 10%"]),
+    ("queijo", ["Queijo, minas, frescal", "Queijo, mozarela", "Queijo, prato"]),
+    ("queijo minas", ["Queijo, minas, frescal"]),
+    ("iogurte", ["Iogurte, natural"]),
+    ("batata", ["Batata, inglesa, cozida"]),
+    ("batata doce", ["Batata, doce, cozida"]),
+    ("batata frita", ["Batata, inglesa, frita"]),
+    ("mandioca", ["Mandioca, cozida"]),
+    ("macarrão", ["Macarrão, trigo, cru", "Macarrão, molho bolognesa"]),
+    ("tapioca", ["Tapioca, com manteiga"]),
+    ("cuscuz", ["Cuscuz, de milho, cozido com sal"]),
+    ("patinho", ["Carne, bovina, patinho, sem gordura, grelhado"]),
+    ("picanha", ["Carne, bovina, picanha, com gordura, grelhada", "Carne, bovina, picanha, sem gordura, grelhada"]),
+    ("carne moída", ["Carne, bovina, acém, moído, cozido"]),
+    ("alface", ["Alface, crespa, crua", "Alface, lisa, crua", "Alface, americana, crua"]),
+    ("tomate", ["Tomate, com semente, cru"]),
+    ("brócolis", ["Brócolis, cozido"]),
+    ("cenoura", ["Cenoura, crua", "Cenoura, cozida"]),
+    ("mamão", ["Mamão, Papaia, cru", "Mamão, Formosa, cru"]),
+    ("melancia", ["Melancia, crua"]),
+    ("abacate", ["Abacate, cru"]),
+    ("aveia", ["Aveia, flocos, crua"]),
+    ("suco de laranja", ["Laranja, pêra, suco", "Laranja, baía, suco", "Laranja, valência, suco"]),
+    ("açúcar", ["Açúcar, refinado", "Açúcar, cristal"]),
+    ("manteiga", ["Manteiga, com sal", "Manteiga, sem sal"]),
+    ("chocolate", ["Chocolate, ao leite", "Chocolate, meio amargo"]),
+    ("30g de amendoim", ["Amendoim, torrado, salgado", "Amendoim, grão, cru"]),
+]
+
+
+class CsvTacoEngine:
+    """
+    Emula em memória a consulta atual do DB (ILIKE '%termo%' ORDER BY LENGTH(alimento) LIMIT 5)
+    sobre o taco_data.csv, para avaliar relevância sem depender de rede.
+    """
+
+    def __init__(self, csv_path=TACO_CSV_FILE):
+        self.foods = []
+        with open(csv_path, mode='r', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                alimento = row.get('Descrição dos alimentos', '').strip()
+                if not alimento:
+                    continue
+                self.foods.append({
+                    'alimento': alimento,
+                    'energia_kcal': _safe_float(row.get('Energia..kcal.')),
+                    'proteina_g': _safe_float(row.get('Proteína..g.')),
+                    'lipidios_g': _safe_float(row.get('Lipídeos..g.')),
+                    'carboidrato_g': _safe_float(row.get('Carboidrato..g.')),
+                })
+
+    def search(self, query):
+        alimento_base, quantidade_g = parse_food_query(query)
+        if not alimento_base:
+            return []
+        term = alimento_base.lower()
+        matches = [food for food in self.foods if term in food['alimento'].lower()]
+        matches.sort(key=lambda food: len(food['alimento']))
+        return [build_food_option(food, quantidade_g) for food in matches[:5]]
+
+
+def _safe_float(value_str):
+    if not value_str:
+        return 0.0
+    value_str = value_str.strip().replace(',', '.')
+    if value_str.lower() in ('na', 'nd', 'tr'):
+        return 0.0
+    try:
+        return float(value_str)
+    except ValueError:
+        return 0.0
+
+
+def snapshot_search(query):
+    """Busca direto no snapshot mmap (taco_snapshot.py), gerando-o a partir do CSV se ainda não existir."""
+    from taco_snapshot import get_snapshot
+
+    alimento_base, quantidade_g = parse_food_query(query)
+    if not alimento_base:
+        return []
+    return [build_food_option(food, quantidade_g) for food in get_snapshot().search(alimento_base)]
+
+
+def _prepare_snapshot():
+    from taco_snapshot import ensure_snapshot
+
+    ensure_snapshot()
+
+
+def get_search_function(engine):
+    if engine == 'csv':
+        return CsvTacoEngine().search
+    if engine == 'snapshot':
+        _prepare_snapshot()
+        return snapshot_search
+    return search_taco_options
+
+
+def evaluate_relevance(search_fn, corpus=RELEVANCE_CORPUS):
+    """Roda o corpus uma vez e retorna acurácia top-1/top-5 e a lista de erros."""
+    top1_hits = 0
+    top5_hits = 0
+    misses = []
+    for query, accepted in corpus:
+        options = search_fn(query)
+        names = [option['original_alimento'] for option in options]
+        if names and names[0] in accepted:
+            top1_hits += 1
+        if any(name in accepted for name in names[:5]):
+            top5_hits += 1
+        else:
+            misses.append((query, accepted[0], names[0] if names else None))
+    total = len(corpus)
+    return {
+        'total': total,
+        'top1': top1_hits / total if total else 0.0,
+        'top5': top5_hits / total if total else 0.0,
+        'misses': misses,
+    }
+
+
+def measure_latency(search_fn, n_queries, corpus=RELEVANCE_CORPUS):
+    """Executa n_queries consultas (percorrendo o corpus em ciclo) e retorna as latências em ms."""
+    latencies_ms = []
+    started = time.perf_counter()
+    for i in range(n_queries):
+        query = corpus[i % len(corpus)][0]
+        t0 = time.perf_counter()
+        search_fn(query)
+        latencies_ms.append((time.perf_counter() - t0) * 1000.0)
+    elapsed = time.perf_counter() - started
+    return latencies_ms, elapsed
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    idx = min(len(sorted_values) - 1, int(round(pct / 100.0 * (len(sorted_values) - 1))))
+    return sorted_values[idx]
+
+
+def summarize_latencies(latencies_ms, elapsed):
+    ordered = sorted(latencies_ms)
+    return {
+        'n': len(ordered),
+        'mean': statistics.fmean(ordered) if ordered else 0.0,
+        'p50': _percentile(ordered, 50),
+        'p95': _percentile(ordered, 95),
+        'p99': _percentile(ordered, 99),
+        'max': ordered[-1] if ordered else 0.0,
+        'qps': len(ordered) / elapsed if elapsed > 0 else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de velocidade e relevância da busca TACO.")
+    parser.add_argument('--engine', choices=['db', 'csv', 'snapshot'], default='db',
+                        help="'db' usa search_taco_options real; 'csv' emula a consulta ILIKE em memória; "
+                             "'snapshot' usa o índice do snapshot mmap.")
+    parser.add_argument('--runs', default=",".join(str(n) for n in DEFAULT_RUNS),
+                        help="Tamanhos das rodadas de latência, separados por vírgula (padrão: 1,100,10000).")
+    parser.add_argument('--show-misses', action='store_true', help="Lista as consultas que erraram o top-5.")
+    args = parser.parse_args()
+
+    search_fn = get_search_function(args.engine)
+
+    print(f"--- Relevância ({args.engine}) ---")
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        quality = evaluate_relevance(search_fn)
+    print(f"Consultas: {quality['total']} | top-1: {quality['top1']:.1%} | top-5: {quality['top5']:.1%}")
+    if args.show_misses:
+        for query, expected, got in quality['misses']:
+            print(f"  ERRO top-5: '{query}' -> esperado '{expected}', obtido '{got}'")
+
+    print(f"\n--- Latência ({args.engine}) ---")
+    print(f"{'consultas':>10} {'média ms':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'máx ms':>9} {'consultas/s':>12}")
+    for n_queries in (int(n) for n in args.runs.split(',') if n.strip()):
+        # search_taco_options imprime uma linha de DEBUG por consulta; descarta para não poluir a saída
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            latencies_ms, elapsed = measure_latency(search_fn, n_queries)
+        stats = summarize_latencies(latencies_ms, elapsed)
+        print(f"{stats['n']:>10} {stats['mean']:>10.3f} {stats['p50']:>9.3f} {stats['p95']:>9.3f} "
+              f"{stats['p99']:>9.3f} {stats['max']:>9.3f} {stats['qps']:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,17 +4,534 @@ import psycopg2
 from psycopg2 import sql 
 from datetime import datetime, date, time
 import json 
+import bisect
+import contextvars
+import functools
+import hashlib
+import inspect
+import threading
+import time as time_module
+from concurrent.futures import ThreadPoolExecutor
+from partitions import (PARTITIONED_TABLES, prepare_legacy_table, finish_legacy_migration, ensure_partitions,
+                        lock_partition_maintenance, archived_before)
+from interaction_touches import InteractionTouchTracker
+from resilience import get_breaker, time_remaining
+import sqlite_backend
 
 DATABASE_URL = os.getenv('DATABASE_URL')
+# Backend de armazenamento: PostgreSQL (padrão) ou SQLite embutido com DATABASE_URL=sqlite:///caminho.db
+DATABASE_BACKEND = 'sqlite' if DATABASE_URL and DATABASE_URL.startswith('sqlite:') else 'postgres'
+SQLITE_PATH = DATABASE_URL[len('sqlite:///'):] if DATABASE_BACKEND == 'sqlite' else None
+# Réplica de leitura opcional. Sem ela, tudo vai para DATABASE_URL como antes.
+DATABASE_REPLICA_URL = os.getenv('DATABASE_REPLICA_URL')
+REPLICA_MAX_LAG_SECONDS = float(os.getenv('REPLICA_MAX_LAG_SECONDS', '5'))
+REPLICA_LAG_CHECK_INTERVAL = 2.0
+# Pool de conexões por processo (uma fila por DSN). Conexões são reaproveitadas entre chamadas.
+DB_POOL_MAX_SIZE = int(os.getenv('DB_POOL_MAX_SIZE', '10'))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '5'))
+DB_CONNECT_TIMEOUT = float(os.getenv('DB_CONNECT_TIMEOUT', '5'))
+# Desligue (0) se houver um PgBouncer em modo transação na frente do banco: PREPARE é por sessão.
+DB_PREPARED_STATEMENTS = os.getenv('DB_PREPARED_STATEMENTS', '1') != '0'
+# Shards de dados de usuário (lista separada por vírgula, a ordem define o índice do shard e não deve mudar).
+# Sem SHARD_DATABASE_URLS há um shard só: o próprio DATABASE_URL. DATABASE_URL continua sendo o banco
+# "diretório" (shard_overrides, outbound_rate_limit), normalmente o mesmo banco do shard 0.
+SHARD_DATABASE_URLS = [url.strip() for url in os.getenv('SHARD_DATABASE_URLS', '').split(',') if url.strip()] or [DATABASE_URL]
+if DATABASE_BACKEND == 'sqlite':
+    SHARD_DATABASE_URLS = [DATABASE_URL]  # SQLite é sempre um nó só
+# Réplicas por shard, na mesma ordem (vazio = sem réplica). Sem sharding vale DATABASE_REPLICA_URL.
+SHARD_REPLICA_URLS = ([url.strip() or None for url in os.getenv('SHARD_REPLICA_URLS', '').split(',')]
+                      if os.getenv('SHARD_REPLICA_URLS') else [])
+if not SHARD_REPLICA_URLS:
+    SHARD_REPLICA_URLS = [DATABASE_REPLICA_URL] if len(SHARD_DATABASE_URLS) == 1 else []
+SHARD_REPLICA_URLS = (SHARD_REPLICA_URLS + [None] * len(SHARD_DATABASE_URLS))[:len(SHARD_DATABASE_URLS)]
+SHARD_VIRTUAL_NODES = 128
+# Alimentos recentes por usuário (atalhos "o de sempre" / lista de recentes): quantos mostrar e por quanto
+# tempo a lista fica em cache no processo (outro worker pode ter registrado algo nesse meio tempo)
+RECENT_FOODS_LIMIT = int(os.getenv('RECENT_FOODS_LIMIT', '5'))
+RECENT_FOODS_CACHE_SECONDS = float(os.getenv('RECENT_FOODS_CACHE_SECONDS', '300'))
+RECENT_FOODS_CACHE_MAX_USERS = 10000
+HISTORY_PAGE_SIZE = int(os.getenv('HISTORY_PAGE_SIZE', '10'))
+SHARD_OVERRIDE_REFRESH_SECONDS = float(os.getenv('SHARD_OVERRIDE_REFRESH_SECONDS', '10'))
 
-def get_db_connection():
+# --- ROTEAMENTO LEITURA/ESCRITA ---
+# Cada função pública é marcada com @db_read ou @db_write. Leituras vão para a réplica quando ela existe,
+# está com atraso aceitável e a requisição atual ainda não escreveu nada (read-your-writes).
+# Funções não marcadas (ex.: get_or_create_user, get_user_state) sempre usam o primário.
+# Os mesmos decoradores escolhem o shard: se o primeiro parâmetro da função é whatsapp_number, ele vira a
+# chave de shard de todas as conexões abertas durante a chamada.
+_route_role = contextvars.ContextVar('db_route_role', default='write')
+_request_scope = contextvars.ContextVar('db_request_scope', default=None)
+_shard_key = contextvars.ContextVar('db_shard_key', default=None)
+_replica_health = {}
+_replica_health_lock = threading.Lock()
+
+def begin_request_scope(whatsapp_number=None):
+    """
+    Abre o escopo de uma requisição do webhook. whatsapp_number (se informado) é a chave de shard padrão
+    da requisição. Retorna o token para end_request_scope().
+    """
+    return (_request_scope.set({'wrote': False}), _shard_key.set(whatsapp_number))
+
+def end_request_scope(token):
+    scope_token, shard_token = token
+    _shard_key.reset(shard_token)
+    _request_scope.reset(scope_token)
+
+def _takes_whatsapp_number(func):
+    params = list(inspect.signature(func).parameters)
+    return bool(params) and params[0] == 'whatsapp_number'
+
+def _mark_request_write():
+    scope = _request_scope.get()
+    if scope is not None:
+        scope['wrote'] = True
+
+def db_read(func):
+    keyed = _takes_whatsapp_number(func)
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _route_role.set('read')
+        key_token = _shard_key.set(args[0]) if keyed and args else None
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if key_token is not None:
+                _shard_key.reset(key_token)
+            _route_role.reset(token)
+    return wrapper
+
+def db_write(func):
+    keyed = _takes_whatsapp_number(func)
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        token = _route_role.set('write')
+        key_token = _shard_key.set(args[0]) if keyed and args else None
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if key_token is not None:
+                _shard_key.reset(key_token)
+            _route_role.reset(token)
+            # Mesmo se a escrita falhar no meio, leituras seguintes da requisição vão para o primário
+            _mark_request_write()
+    return wrapper
+
+def _replica_is_usable(replica_dsn):
+    """Verifica (com cache de REPLICA_LAG_CHECK_INTERVAL) se a réplica responde e está em dia."""
+    now = time_module.monotonic()
+    health = _replica_health.get(replica_dsn)
+    if health and now - health['checked_at'] < REPLICA_LAG_CHECK_INTERVAL:
+        return health['healthy']
+    with _replica_health_lock:
+        health = _replica_health.setdefault(replica_dsn, {'checked_at': 0.0, 'healthy': False})
+        if now - health['checked_at'] < REPLICA_LAG_CHECK_INTERVAL:
+            return health['healthy']
+        healthy = False
+        try:
+            conn = _connect(replica_dsn)
+            try:
+                cursor = conn.cursor()
+                # Réplica sem nada pendente para aplicar tem atraso zero, mesmo se o primário estiver ocioso
+                cursor.execute(
+                    "SELECT CASE WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0 "
+                    "ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) END"
+                )
+                lag_seconds = float(cursor.fetchone()[0])
+                cursor.close()
+                healthy = lag_seconds <= REPLICA_MAX_LAG_SECONDS
+                if not healthy:
+                    print(f"AVISO DB: réplica com {lag_seconds:.1f}s de atraso; leituras vão para o primário.")
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            print(f"AVISO DB: réplica indisponível ({e}); leituras vão para o primário.")
+        health['healthy'] = healthy
+        health['checked_at'] = time_module.monotonic()
+        return healthy
+
+class _TrackedConnection(psycopg2.extensions.connection):
+    """Conexão psycopg2 que lembra quais statements já foram preparados nela (ver _execute_statement)."""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared_statements = set()
+
+def _connect(dsn):
+    # connect_timeout do libpq é em segundos inteiros (mínimo útil: 1)
+    connect_timeout = max(1, int(min(DB_CONNECT_TIMEOUT, time_remaining(DB_CONNECT_TIMEOUT))))
+    return psycopg2.connect(dsn + "?sslmode=require", connection_factory=_TrackedConnection,
+                            connect_timeout=connect_timeout)
+
+class DatabasePoolExhausted(Exception):
+    """Todas as conexões do pool estão em uso e nenhuma foi liberada dentro de DB_POOL_TIMEOUT."""
+
+class DatabaseUnavailable(Exception):
+    """O breaker do banco está aberto: as últimas tentativas de conexão falharam e nem tentamos de novo."""
+
+def _breaker_name(dsn):
+    # Nome legível e sem senha para o breaker / métricas
+    params = psycopg2.extensions.parse_dsn(dsn)
+    return f"postgres:{params.get('host', 'localhost')}:{params.get('port', '5432')}/{params.get('dbname', '')}"
+
+class _ConnectionPool:
+    def __init__(self, dsn, max_size):
+        self.dsn = dsn
+        self.max_size = max_size
+        self.pid = os.getpid()
+        self._idle = []
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self.breaker = get_breaker(_breaker_name(dsn))
+
+    def _reset_after_fork(self):
+        # Conexões herdadas de outro processo não podem ser usadas (o socket é compartilhado); só esquecemos
+        self.pid = os.getpid()
+        self._idle = []
+        self._in_use = 0
+
+    def getconn(self):
+        with self._cond:
+            if self.pid != os.getpid():
+                self._reset_after_fork()
+            # Dentro de uma requisição não esperamos mais do que o orçamento que ainda resta
+            deadline = time_module.monotonic() + min(DB_POOL_TIMEOUT, time_remaining(DB_POOL_TIMEOUT))
+            while not self._idle and self._in_use >= self.max_size:
+                remaining = deadline - time_module.monotonic()
+                if remaining <= 0:
+                    raise DatabasePoolExhausted(f"Pool de conexões esgotado ({self.max_size} em uso).")
+                self._cond.wait(remaining)
+            raw = None
+            while self._idle:
+                candidate = self._idle.pop()
+                if not candidate.closed:
+                    raw = candidate
+                    break
+            self._in_use += 1
+        if raw is None:
+            try:
+                if not self.breaker.allow():
+                    raise DatabaseUnavailable(f"Banco indisponível ({self.breaker.name}), breaker aberto.")
+                try:
+                    raw = _connect(self.dsn)
+                except psycopg2.OperationalError:
+                    self.breaker.record_failure()
+                    raise
+                self.breaker.record_success()
+            except Exception:
+                with self._cond:
+                    self._in_use -= 1
+                    self._cond.notify()
+                raise
+        return PooledConnection(self, raw)
+
+    def putconn(self, raw):
+        if self.pid != os.getpid():
+            return
+        reusable = not raw.closed
+        if reusable and raw.status != psycopg2.extensions.STATUS_READY:
+            try:
+                raw.rollback()
+            except psycopg2.Error:
+                reusable = False
+        if not reusable and not raw.closed:
+            raw.close()
+        with self._cond:
+            self._in_use -= 1
+            if reusable:
+                self._idle.append(raw)
+            self._cond.notify()
+
+class PooledConnection:
+    """
+    Conexão emprestada do pool. close() devolve a conexão (desfazendo transação aberta) em vez de fechá-la.
+    O resto (cursor, commit, rollback...) é repassado para a conexão psycopg2 real.
+    """
+    def __init__(self, pool, raw):
+        self._pool = pool
+        self._raw = raw
+
+    def close(self):
+        if self._raw is not None:
+            raw, self._raw = self._raw, None
+            self._pool.putconn(raw)
+
+    def __getattr__(self, name):
+        if self._raw is None:
+            raise psycopg2.InterfaceError("Conexão já devolvida ao pool.")
+        return getattr(self._raw, name)
+
+    def __del__(self):
+        self.close()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def _get_pool(dsn):
+    pool = _pools.get(dsn)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.setdefault(dsn, _ConnectionPool(dsn, DB_POOL_MAX_SIZE))
+    return pool
+
+# --- SHARDING POR NÚMERO DE WHATSAPP ---
+# Cada usuário (e tudo que pendura em users.id) vive em um único shard, escolhido por hashing consistente
+# do whatsapp_number. Usuários movidos com move_user_shard.py ficam registrados em shard_overrides, no banco
+# diretório; cada processo mantém uma cópia dessa tabela em memória (recarregada a cada
+# SHARD_OVERRIDE_REFRESH_SECONDS). Os dados da TACO são replicados em todos os shards.
+
+class UserShardMoving(Exception):
+    """O usuário está sendo movido de shard; a operação deve ser repetida em instantes."""
+
+def _hash_key(key):
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+class ShardRing:
+    """Anel de hashing consistente com SHARD_VIRTUAL_NODES pontos por shard."""
+    def __init__(self, shard_count, virtual_nodes=SHARD_VIRTUAL_NODES):
+        points = sorted(
+            (_hash_key(f"shard-{shard}#{vnode}"), shard)
+            for shard in range(shard_count) for vnode in range(virtual_nodes)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard_for(self, key):
+        idx = bisect.bisect(self._hashes, _hash_key(key)) % len(self._hashes)
+        return self._shards[idx]
+
+_shard_ring = ShardRing(len(SHARD_DATABASE_URLS))
+_shard_overrides = {'loaded_at': None, 'by_number': {}}
+_shard_overrides_lock = threading.Lock()
+
+def _load_shard_overrides():
+    now = time_module.monotonic()
+    loaded_at = _shard_overrides['loaded_at']
+    if loaded_at is not None and now - loaded_at < SHARD_OVERRIDE_REFRESH_SECONDS:
+        return _shard_overrides['by_number']
+    with _shard_overrides_lock:
+        loaded_at = _shard_overrides['loaded_at']
+        if loaded_at is not None and now - loaded_at < SHARD_OVERRIDE_REFRESH_SECONDS:
+            return _shard_overrides['by_number']
+        conn = _get_pool(DATABASE_URL).getconn()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT whatsapp_number, shard_index, moving_to FROM shard_overrides")
+            by_number = {number: (shard, moving_to) for number, shard, moving_to in cursor.fetchall()}
+            cursor.close()
+        except psycopg2.errors.UndefinedTable:
+            by_number = {}  # init_db ainda não rodou no diretório
+        finally:
+            conn.close()
+        _shard_overrides['by_number'] = by_number
+        _shard_overrides['loaded_at'] = time_module.monotonic()
+        return by_number
+
+def locate_user_shard(whatsapp_number):
+    """Retorna (shard atual, shard de destino se o usuário estiver sendo movido, senão None)."""
+    if len(SHARD_DATABASE_URLS) == 1:
+        return 0, None
+    override = _load_shard_overrides().get(whatsapp_number)
+    if override:
+        return override
+    return _shard_ring.shard_for(whatsapp_number), None
+
+def ring_shard_for(whatsapp_number):
+    """Shard natural do número pelo anel, ignorando overrides."""
+    return _shard_ring.shard_for(whatsapp_number)
+
+def shard_for_number(whatsapp_number):
+    shard, moving_to = locate_user_shard(whatsapp_number)
+    if moving_to is not None:
+        raise UserShardMoving(f"Usuário {whatsapp_number} em migração do shard {shard} para o {moving_to}.")
+    return shard
+
+def shard_indices():
+    return range(len(SHARD_DATABASE_URLS))
+
+def schema_database_urls():
+    """Todos os bancos que recebem o schema (e a TACO): o diretório e cada shard, sem repetição."""
+    return list(dict.fromkeys([DATABASE_URL] + SHARD_DATABASE_URLS))
+
+def _fan_out(per_shard):
+    """Roda per_shard(shard) em todos os shards em paralelo e concatena as listas retornadas."""
+    if len(SHARD_DATABASE_URLS) == 1:
+        return per_shard(0)
+    with ThreadPoolExecutor(max_workers=len(SHARD_DATABASE_URLS), thread_name_prefix='shard-fanout') as executor:
+        return [item for part in executor.map(per_shard, shard_indices()) for item in part]
+
+def is_sqlite():
+    return DATABASE_BACKEND == 'sqlite'
+
+def get_db_connection(role=None, shard=None, shard_key=None):
+    """
+    Conexão (do pool) para o shard indicado, para o shard do whatsapp_number em shard_key / no contexto atual,
+    ou para o banco diretório quando não há chave nenhuma. No SQLite é sempre a conexão da thread atual.
+    """
     if not DATABASE_URL:
         raise ValueError("DATABASE_URL não está configurada! Não é possível conectar ao PostgreSQL.")
-    return psycopg2.connect(DATABASE_URL + "?sslmode=require") 
+    if DATABASE_BACKEND == 'sqlite':
+        return sqlite_backend.connect(SQLITE_PATH)
+    role = role or _route_role.get()
+    if shard is None:
+        key = shard_key or _shard_key.get()
+        shard = shard_for_number(key) if key else None
+    if shard is None:
+        primary_dsn, replica_dsn = DATABASE_URL, DATABASE_REPLICA_URL
+    else:
+        primary_dsn, replica_dsn = SHARD_DATABASE_URLS[shard], SHARD_REPLICA_URLS[shard]
+    if role == 'read' and replica_dsn:
+        scope = _request_scope.get()
+        if (scope is None or not scope['wrote']) and _replica_is_usable(replica_dsn):
+            return _get_pool(replica_dsn).getconn()
+    return _get_pool(primary_dsn).getconn()
+
+# --- REGISTRO DE PREPARED STATEMENTS ---
+# As consultas mais quentes são preparadas (PREPARE) uma vez por conexão física e depois só executadas (EXECUTE),
+# poupando o parse/plan no servidor. Uma conexão nova (ex.: após reconexão) começa com o conjunto
+# 'prepared_statements' vazio, então tudo é preparado de novo automaticamente.
+_STATEMENTS = {}
+_statement_stats = {}
+_statement_stats_lock = threading.Lock()
+
+def _register_statement(name, sql_text):
+    n_params = sql_text.count('%s')
+    pg_sql = sql_text
+    for idx in range(1, n_params + 1):
+        pg_sql = pg_sql.replace('%s', f'${idx}', 1)
+    _STATEMENTS[name] = (sql_text, pg_sql, n_params)
+    _statement_stats[name] = {'calls': 0, 'prepares': 0, 'total_ms': 0.0}
+
+def _execute_statement(cursor, name, params):
+    """Executa uma consulta registrada, preparando-a nesta conexão na primeira vez."""
+    sql_text, pg_sql, n_params = _STATEMENTS[name]
+    started = time_module.perf_counter()
+    prepared_now = False
+    if DB_PREPARED_STATEMENTS and DATABASE_BACKEND == 'postgres':
+        prepared = cursor.connection.prepared_statements
+        if name not in prepared:
+            cursor.execute(f"PREPARE {name} AS {pg_sql}")
+            prepared.add(name)
+            prepared_now = True
+        try:
+            if n_params:
+                cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * n_params)})", params)
+            else:
+                cursor.execute(f"EXECUTE {name}")
+        except psycopg2.errors.InvalidSqlStatementName:
+            # Alguém descartou os prepares da sessão (ex.: DISCARD ALL); esquece e prepara de novo na próxima
+            prepared.clear()
+            raise
+    else:
+        cursor.execute(sql_text, params)
+    elapsed_ms = (time_module.perf_counter() - started) * 1000.0
+    with _statement_stats_lock:
+        stats = _statement_stats[name]
+        stats['calls'] += 1
+        stats['total_ms'] += elapsed_ms
+        if prepared_now:
+            stats['prepares'] += 1
+
+def get_statement_stats():
+    """Contagem de chamadas, prepares e tempo (total e médio, em ms) por consulta registrada neste processo."""
+    with _statement_stats_lock:
+        return {
+            name: {
+                'calls': stats['calls'],
+                'prepares': stats['prepares'],
+                'total_ms': round(stats['total_ms'], 3),
+                'avg_ms': round(stats['total_ms'] / stats['calls'], 3) if stats['calls'] else 0.0,
+            }
+            for name, stats in _statement_stats.items()
+        }
+
+_register_statement('user_id_by_number', "SELECT id FROM users WHERE whatsapp_number = %s")
+_register_statement('user_insert', "INSERT INTO users (whatsapp_number) VALUES (%s) RETURNING id")
+_register_statement(
+    'food_entry_insert',
+    "INSERT INTO food_entries (user_id, foods_description, calories, carbohydrates, proteins, fats, taco_food_id, grams, entry_date, entry_time) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, CURRENT_DATE, CURRENT_TIME)"
+)
+_register_statement(
+    'daily_rollup_upsert',
+    "INSERT INTO daily_rollups (user_id, rollup_date, kcal_in, kcal_burned, carbohydrates, proteins, fats, "
+    "food_entries_count, exercise_entries_count, last_weight) "
+    "VALUES (%s, COALESCE(%s::date, CURRENT_DATE), %s, %s, %s, %s, %s, %s, %s, %s) "
+    "ON CONFLICT (user_id, rollup_date) DO UPDATE SET "
+    "kcal_in = daily_rollups.kcal_in + EXCLUDED.kcal_in, "
+    "kcal_burned = daily_rollups.kcal_burned + EXCLUDED.kcal_burned, "
+    "carbohydrates = daily_rollups.carbohydrates + EXCLUDED.carbohydrates, "
+    "proteins = daily_rollups.proteins + EXCLUDED.proteins, "
+    "fats = daily_rollups.fats + EXCLUDED.fats, "
+    "food_entries_count = daily_rollups.food_entries_count + EXCLUDED.food_entries_count, "
+    "exercise_entries_count = daily_rollups.exercise_entries_count + EXCLUDED.exercise_entries_count, "
+    "last_weight = COALESCE(EXCLUDED.last_weight, daily_rollups.last_weight)"
+)
+# Histórico paginado por chave (entry_date, id), do mais recente para o mais antigo. O 'entry_date <= %s' repete
+# o limite do cursor para o PostgreSQL descartar as partições mais novas; a comparação de linha fica no índice
+# food_entries_user_date_id_idx, então cada página lê só as linhas que mostra, sem OFFSET.
+_register_statement(
+    'history_page_first',
+    "SELECT id, entry_date, entry_time, foods_description, calories FROM food_entries "
+    "WHERE user_id = %s ORDER BY entry_date DESC, id DESC LIMIT %s"
+)
+_register_statement(
+    'history_page_before',
+    "SELECT id, entry_date, entry_time, foods_description, calories FROM food_entries "
+    "WHERE user_id = %s AND entry_date <= %s AND (entry_date, id) < (%s, %s) "
+    "ORDER BY entry_date DESC, id DESC LIMIT %s"
+)
+_register_statement(
+    'summary_foods_today',
+    "SELECT foods_description, calories, carbohydrates, proteins, fats FROM food_entries WHERE user_id = %s AND entry_date = CURRENT_DATE"
+)
+_register_statement(
+    'summary_exercises_today',
+    "SELECT activity_name, duration_minutes, calories_burned FROM exercise_entries WHERE user_id = %s AND entry_date = CURRENT_DATE"
+)
+_register_statement(
+    'summary_last_weight',
+    "SELECT weight FROM weight_entries WHERE user_id = %s ORDER BY entry_date DESC, entry_time DESC LIMIT 1"
+)
+_register_statement(
+    'user_state_upsert',
+    "INSERT INTO user_state (user_id, state, context_data) VALUES (%s, %s, %s) ON CONFLICT (user_id) DO UPDATE SET state = EXCLUDED.state, context_data = EXCLUDED.context_data"
+)
+_register_statement(
+    'recent_food_upsert',
+    "INSERT INTO user_recent_foods (user_id, foods_description, taco_food_id, grams, calories, carbohydrates, "
+    "proteins, fats, times_logged, last_logged_on) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, 1, CURRENT_DATE) "
+    "ON CONFLICT (user_id, foods_description) DO UPDATE SET "
+    "taco_food_id = EXCLUDED.taco_food_id, grams = EXCLUDED.grams, calories = EXCLUDED.calories, "
+    "carbohydrates = EXCLUDED.carbohydrates, proteins = EXCLUDED.proteins, fats = EXCLUDED.fats, "
+    "times_logged = user_recent_foods.times_logged + 1, last_logged_on = EXCLUDED.last_logged_on"
+)
+_register_statement(
+    'recent_foods_select',
+    "SELECT foods_description, taco_food_id, grams, calories, carbohydrates, proteins, fats, times_logged "
+    "FROM user_recent_foods WHERE user_id = %s ORDER BY times_logged DESC, last_logged_on DESC LIMIT %s"
+)
+_register_statement('user_state_select', "SELECT state, context_data FROM user_state WHERE user_id = %s")
+_register_statement(
+    'goal_select',
+    "SELECT target_value, start_date, end_date FROM goals WHERE user_id = %s AND goal_type = %s"
+)
 
 def init_db():
-    conn = get_db_connection()
+    if DATABASE_BACKEND == 'sqlite':
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        sqlite_backend.init_schema(conn)
+        cursor.close()
+        conn.close()
+        return
+    # O schema completo vai para o diretório e para cada shard (TACO e token bucket incluídos)
+    for dsn in schema_database_urls():
+        _init_schema(dsn)
+
+def _init_schema(dsn):
+    conn = _get_pool(dsn).getconn()
     cursor = conn.cursor()
+    # Todo o init roda numa transação só; o advisory lock faz os workers que sobem juntos esperarem um ao outro
+    # em vez de disputarem a migração das tabelas antigas e a criação das partições
+    lock_partition_maintenance(cursor)
 
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -24,42 +541,64 @@ def init_db():
         );
     ''')
 
+    # food_entries, weight_entries e exercise_entries são particionadas por mês em entry_date (ver partitions.py).
+    # A chave primária inclui entry_date porque o Postgres exige a chave de partição em índices únicos.
+    for table in PARTITIONED_TABLES:
+        cursor.execute(f"CREATE SEQUENCE IF NOT EXISTS {table}_id_seq")
+        prepare_legacy_table(cursor, table)
+
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS food_entries (
-            id SERIAL PRIMARY KEY,
+            id INTEGER NOT NULL DEFAULT nextval('food_entries_id_seq'),
             user_id INTEGER NOT NULL REFERENCES users(id),
             foods_description TEXT NOT NULL,
             calories REAL NOT NULL,
             carbohydrates REAL DEFAULT 0,
             proteins REAL DEFAULT 0,
             fats REAL DEFAULT 0,
-            entry_date DATE DEFAULT CURRENT_DATE,
-            entry_time TIME DEFAULT CURRENT_TIME
-        );
+            entry_date DATE NOT NULL DEFAULT CURRENT_DATE,
+            entry_time TIME DEFAULT CURRENT_TIME,
+            taco_food_id INTEGER,
+            grams REAL,
+            PRIMARY KEY (id, entry_date)
+        ) PARTITION BY RANGE (entry_date);
     ''')
+    # taco_food_id é o "Número do Alimento" da TACO; junto com grams alimenta a matriz de nutrientes (taco_nutrients.py)
+    cursor.execute("ALTER TABLE food_entries ADD COLUMN IF NOT EXISTS taco_food_id INTEGER")
+    cursor.execute("ALTER TABLE food_entries ADD COLUMN IF NOT EXISTS grams REAL")
 
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS weight_entries (
-            id SERIAL PRIMARY KEY,
+            id INTEGER NOT NULL DEFAULT nextval('weight_entries_id_seq'),
             user_id INTEGER NOT NULL REFERENCES users(id),
             weight REAL NOT NULL,
-            entry_date DATE DEFAULT CURRENT_DATE,
-            entry_time TIME DEFAULT CURRENT_TIME
-        );
+            entry_date DATE NOT NULL DEFAULT CURRENT_DATE,
+            entry_time TIME DEFAULT CURRENT_TIME,
+            PRIMARY KEY (id, entry_date)
+        ) PARTITION BY RANGE (entry_date);
     ''')
 
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS exercise_entries (
-            id SERIAL PRIMARY KEY,
+            id INTEGER NOT NULL DEFAULT nextval('exercise_entries_id_seq'),
             user_id INTEGER NOT NULL REFERENCES users(id),
             activity_name TEXT NOT NULL,
             duration_minutes INTEGER NOT NULL,
             calories_burned REAL NOT NULL,
-            entry_date DATE DEFAULT CURRENT_DATE,
-            entry_time TIME DEFAULT CURRENT_TIME
-        );
+            entry_date DATE NOT NULL DEFAULT CURRENT_DATE,
+            entry_time TIME DEFAULT CURRENT_TIME,
+            PRIMARY KEY (id, entry_date)
+        ) PARTITION BY RANGE (entry_date);
     ''')
 
+    for table in PARTITIONED_TABLES:
+        cursor.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_user_date_idx ON {table} (user_id, entry_date)")
+        finish_legacy_migration(cursor, table)
+        ensure_partitions(cursor, table)
+    # Paginação do histórico por (entry_date, id)
+    cursor.execute("CREATE INDEX IF NOT EXISTS food_entries_user_date_id_idx ON food_entries (user_id, entry_date, id)")
+
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS goals (
             id SERIAL PRIMARY KEY,
@@ -81,6 +620,8 @@ def init_db():
             is_active BOOLEAN DEFAULT TRUE 
         );
     ''')
+    # Dia do último envio: claim_due_reminders marca antes de enviar, então cada lembrete sai uma vez por dia
+    cursor.execute("ALTER TABLE reminders ADD COLUMN IF NOT EXISTS last_sent_on DATE")
 
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS taco_foods (
@@ -92,6 +633,59 @@ def init_db():
             carboidrato_g REAL
         );
     ''')
+    cursor.execute("ALTER TABLE taco_foods ADD COLUMN IF NOT EXISTS taco_number INTEGER")
+
+    # Resumo diário por usuário, mantido na mesma transação de cada inserção/remoção.
+    # Os relatórios de semana/mês leem no máximo 31 linhas daqui em vez de varrer as tabelas de entradas.
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS daily_rollups (
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            rollup_date DATE NOT NULL,
+            kcal_in REAL NOT NULL DEFAULT 0,
+            kcal_burned REAL NOT NULL DEFAULT 0,
+            carbohydrates REAL NOT NULL DEFAULT 0,
+            proteins REAL NOT NULL DEFAULT 0,
+            fats REAL NOT NULL DEFAULT 0,
+            food_entries_count INTEGER NOT NULL DEFAULT 0,
+            exercise_entries_count INTEGER NOT NULL DEFAULT 0,
+            last_weight REAL,
+            PRIMARY KEY (user_id, rollup_date)
+        );
+    ''')
+
+    # Meses arquivados por partitions.py archive: o backfill de daily_rollups não recalcula dias antes deles
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS archived_partitions (
+            table_name TEXT NOT NULL,
+            month_start DATE NOT NULL,
+            archive_path TEXT NOT NULL,
+            archived_at TIMESTAMP NOT NULL DEFAULT NOW(),
+            PRIMARY KEY (table_name, month_start)
+        );
+    ''')
+
+    # Tendência de peso por usuário, recalculada em lote pelo weight_trends.py
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS weight_trends (
+            user_id INTEGER PRIMARY KEY REFERENCES users(id),
+            samples INTEGER NOT NULL DEFAULT 0,
+            latest_weight REAL,
+            smoothed_weight REAL,
+            avg_7d REAL,
+            weekly_change_kg REAL,
+            projected_goal_date DATE,
+            computed_at TIMESTAMP DEFAULT NOW()
+        );
+    ''')
+
+    # Token bucket compartilhado entre workers para limitar o envio de mensagens (outbound_sender.py)
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS outbound_rate_limit (
+            bucket_name TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        );
+    ''')
 
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS user_state (
@@ -101,6 +695,36 @@ def init_db():
         );
     ''')
 
+    # Índice de alimentos recentes/favoritos por usuário, mantido na mesma transação de cada refeição registrada.
+    # Guarda a última porção e os macros gravados para re-registrar sem Wit.ai nem busca na TACO.
+    # O histórico anterior à tabela é preenchido uma vez com backfill_recent_foods.py (não no boot dos workers).
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS user_recent_foods (
+            user_id INTEGER NOT NULL REFERENCES users(id),
+            foods_description TEXT NOT NULL,
+            taco_food_id INTEGER,
+            grams REAL,
+            calories REAL NOT NULL,
+            carbohydrates REAL DEFAULT 0,
+            proteins REAL DEFAULT 0,
+            fats REAL DEFAULT 0,
+            times_logged INTEGER NOT NULL DEFAULT 0,
+            last_logged_on DATE NOT NULL DEFAULT CURRENT_DATE,
+            PRIMARY KEY (user_id, foods_description)
+        );
+    ''')
+
+    if dsn == DATABASE_URL:
+        # Usuários fora do shard indicado pelo anel (movidos com move_user_shard.py). Só existe no diretório.
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS shard_overrides (
+                whatsapp_number TEXT PRIMARY KEY,
+                shard_index INTEGER NOT NULL,
+                moving_to INTEGER,
+                updated_at TIMESTAMP NOT NULL DEFAULT NOW()
+            );
+        ''')
+
     conn.commit()
     cursor.close()
     conn.close()
@@ -119,12 +743,94 @@ def _fetch_all_as_dict(cursor):
     desc = cursor.description
     return [{col[0]: row[idx] for idx, col in enumerate(desc)} for row in rows]
 
+def _apply_daily_rollup(cursor, user_id, rollup_date=None, kcal_in=0, kcal_burned=0, carbohydrates=0,
+                        proteins=0, fats=0, food_entries_count=0, exercise_entries_count=0, last_weight=None):
+    """
+    Soma um delta no resumo diário do usuário (rollup_date=None significa hoje).
+    Deve ser chamada com o MESMO cursor da inserção/remoção, antes do commit, para manter o resumo consistente.
+    """
+    _execute_statement(
+        cursor, 'daily_rollup_upsert',
+        (user_id, rollup_date, kcal_in or 0, kcal_burned or 0, carbohydrates or 0, proteins or 0, fats or 0,
+         food_entries_count, exercise_entries_count, last_weight)
+    )
+
+def _subtract_deleted_food_from_rollups(cursor, deleted_rows):
+    """
+    Recebe as linhas de um DELETE ... RETURNING user_id, entry_date, calories, carbohydrates, proteins, fats,
+    foods_description. Desconta dos resumos diários e da contagem de alimentos recentes.
+    """
+    per_day = {}
+    for user_id, entry_date, calories, carbohydrates, proteins, fats, _ in deleted_rows:
+        totals = per_day.setdefault((user_id, entry_date), [0.0, 0.0, 0.0, 0.0, 0])
+        totals[0] += calories or 0
+        totals[1] += carbohydrates or 0
+        totals[2] += proteins or 0
+        totals[3] += fats or 0
+        totals[4] += 1
+    for (user_id, entry_date), (calories, carbohydrates, proteins, fats, count) in per_day.items():
+        _apply_daily_rollup(cursor, user_id, entry_date, kcal_in=-calories, carbohydrates=-carbohydrates,
+                            proteins=-proteins, fats=-fats, food_entries_count=-count)
+    per_food = {}
+    for row in deleted_rows:
+        per_food[(row[0], row[6])] = per_food.get((row[0], row[6]), 0) + 1
+    for (user_id, foods_description), count in per_food.items():
+        cursor.execute(
+            "UPDATE user_recent_foods SET times_logged = times_logged - %s WHERE user_id = %s AND foods_description = %s",
+            (count, user_id, foods_description)
+        )
+        cursor.execute(
+            "DELETE FROM user_recent_foods WHERE user_id = %s AND foods_description = %s AND times_logged <= 0",
+            (user_id, foods_description)
+        )
+
+def backfill_recent_foods():
+    """Recalcula user_recent_foods de todos os usuários, uma transação por shard. Retorna o total de linhas."""
+    total = 0
+    for shard in shard_indices():
+        conn = get_db_connection('write', shard=shard)
+        cursor = conn.cursor()
+        cursor.execute("DELETE FROM user_recent_foods")
+        rebuild_recent_foods(cursor)
+        total += cursor.rowcount
+        conn.commit()
+        cursor.close()
+        conn.close()
+    with _recent_foods_cache_lock:
+        _recent_foods_cache.clear()
+    return total
+
+def rebuild_recent_foods(cursor, user_ids=None):
+    """
+    Recalcula user_recent_foods a partir de food_entries: de todos os usuários (backfill_recent_foods) ou só de
+    user_ids (ex.: depois de uma importação de histórico). A porção e os macros são os da entrada mais recente.
+    """
+    where, params = "", ()
+    if user_ids is not None:
+        where, params = "WHERE user_id = ANY(%s)", (list(user_ids),)
+        cursor.execute(f"DELETE FROM user_recent_foods {where}", params)
+    cursor.execute(
+        "INSERT INTO user_recent_foods (user_id, foods_description, taco_food_id, grams, calories, carbohydrates, "
+        "proteins, fats, times_logged, last_logged_on) "
+        "SELECT user_id, foods_description, taco_food_id, grams, calories, carbohydrates, proteins, fats, "
+        "times_logged, entry_date FROM ("
+        "  SELECT f.*, COUNT(*) OVER (PARTITION BY user_id, foods_description) AS times_logged, "
+        "  ROW_NUMBER() OVER (PARTITION BY user_id, foods_description "
+        "                     ORDER BY entry_date DESC, entry_time DESC, id DESC) AS rn "
+        f"  FROM food_entries f {where}"
+        ") ranked WHERE rn = 1 "
+        # Uma refeição registrada durante o rebuild já gravou a linha com os dados mais novos
+        "ON CONFLICT (user_id, foods_description) DO NOTHING",
+        params
+    )
+    print(f"DEBUG DB: user_recent_foods recalculada ({cursor.rowcount} alimento(s)).")
 
 def get_or_create_user(whatsapp_number):
-    conn = get_db_connection()
+    # Sempre no primário: um usuário recém-criado pode ainda não ter chegado à réplica
+    conn = get_db_connection('write', shard_key=whatsapp_number)
     cursor = conn.cursor()
     
-    cursor.execute("SELECT id FROM users WHERE whatsapp_number = %s", (whatsapp_number,))
+    _execute_statement(cursor, 'user_id_by_number', (whatsapp_number,))
     user = _fetch_one_as_dict(cursor)
     
     if user:
@@ -132,26 +838,34 @@ def get_or_create_user(whatsapp_number):
         conn.close()
         return user['id']
     else:
-        cursor.execute("INSERT INTO users (whatsapp_number) VALUES (%s) RETURNING id", (whatsapp_number,))
+        _execute_statement(cursor, 'user_insert', (whatsapp_number,))
         user_id = cursor.fetchone()[0]
         conn.commit()
+        _mark_request_write()
         cursor.close()
         conn.close()
         return user_id
 
+# Write-behind: só o primeiro toque do dia de cada usuário vai para a fila, gravada em lote por uma thread
+_touch_tracker = InteractionTouchTracker()
+
 def update_last_interaction_date(whatsapp_number):
-    user_id = get_or_create_user(whatsapp_number)
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    today_date_str = date.today().strftime('%Y-%m-%d')
-    cursor.execute(
-        "UPDATE users SET last_interaction_date = %s WHERE id = %s",
-        (today_date_str, user_id)
-    )
-    conn.commit()
-    cursor.close()
-    conn.close()
+    # Sem @db_write: nada é gravado dentro da requisição, então as leituras seguintes podem ir para a réplica
+    # user_id só é único dentro do shard, por isso a chave do toque é o par (shard, user_id). O tracker guarda
+    # whatsapp_number -> chave junto com os toques do dia (e zera tudo na virada), para não consultar users a
+    # cada mensagem sem acumular números para sempre
+    shard = shard_for_number(whatsapp_number)
+    touch_key = _touch_tracker.key_for_today(whatsapp_number)
+    if touch_key is not None and touch_key[0] == shard:
+        return
+    touch_key = (shard, get_or_create_user(whatsapp_number))
+    _touch_tracker.touch(touch_key, alias=whatsapp_number)
 
+def flush_interaction_touches():
+    """Grava agora os toques de last_interaction_date pendentes deste processo."""
+    return _touch_tracker.flush()
+
+@db_read
 def get_last_interaction_date(whatsapp_number):
     user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
@@ -163,31 +877,116 @@ def get_last_interaction_date(whatsapp_number):
     result = _fetch_one_as_dict(cursor)
     cursor.close()
     conn.close()
+    pending = _touch_tracker.pending_date((shard_for_number(whatsapp_number), user_id))
+    if pending and (not result or not result['last_interaction_date'] or result['last_interaction_date'] < pending):
+        return pending
     if result and result['last_interaction_date']:
         return result['last_interaction_date'] 
     return None
 
+def _owned_by_shard(whatsapp_number, shard):
+    # Durante/depois de uma migração o usuário pode aparecer em dois shards; vale o shard atual dele
+    return len(SHARD_DATABASE_URLS) == 1 or locate_user_shard(whatsapp_number)[0] == shard
+
+@db_read
 def get_all_users():
+    def per_shard(shard):
+        conn = get_db_connection('read', shard=shard)
+        cursor = conn.cursor()
+        cursor.execute("SELECT whatsapp_number FROM users")
+        users = [row[0] for row in cursor.fetchall() if _owned_by_shard(row[0], shard)]
+        cursor.close()
+        conn.close()
+        return users
+    return _fan_out(per_shard)
+
+@db_write
+def add_food_entry(whatsapp_number, foods_description, calories, carbohydrates, proteins, fats, taco_food_id=None, grams=None):
+    user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT whatsapp_number FROM users")
-    users = [row[0] for row in cursor.fetchall()]
+    _insert_food_entry(cursor, user_id, foods_description, calories, carbohydrates, proteins, fats, taco_food_id, grams)
+    conn.commit()
+    cursor.close()
+    conn.close()
+    _forget_recent_foods(whatsapp_number)
+
+@db_write
+def add_food_entries(whatsapp_number, entries):
+    """Registra várias refeições de uma vez (ex.: repetir o almoço de ontem), numa única transação."""
+    user_id = get_or_create_user(whatsapp_number)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    for entry in entries:
+        _insert_food_entry(cursor, user_id, entry['foods_description'], entry['calories'], entry['carbohydrates'],
+                           entry['proteins'], entry['fats'], entry.get('taco_food_id'), entry.get('grams'))
+    conn.commit()
+    cursor.close()
+    conn.close()
+    _forget_recent_foods(whatsapp_number)
+
+def _insert_food_entry(cursor, user_id, foods_description, calories, carbohydrates, proteins, fats, taco_food_id, grams):
+    # Entrada, resumo diário e índice de recentes andam juntos na mesma transação
+    _execute_statement(
+        cursor, 'food_entry_insert',
+        (user_id, foods_description, calories, carbohydrates, proteins, fats, taco_food_id, grams)
+    )
+    _apply_daily_rollup(cursor, user_id, kcal_in=calories, carbohydrates=carbohydrates, proteins=proteins,
+                        fats=fats, food_entries_count=1)
+    _execute_statement(
+        cursor, 'recent_food_upsert',
+        (user_id, foods_description, taco_food_id, grams, calories, carbohydrates or 0, proteins or 0, fats or 0)
+    )
+
+# --- ALIMENTOS RECENTES ---
+# Cache por processo da lista de recentes de cada usuário. Registros e remoções feitos neste processo limpam a
+# entrada na hora; os feitos por outros workers aparecem em até RECENT_FOODS_CACHE_SECONDS.
+_recent_foods_cache = {}
+_recent_foods_cache_lock = threading.Lock()
+
+def _forget_recent_foods(whatsapp_number):
+    with _recent_foods_cache_lock:
+        _recent_foods_cache.pop(whatsapp_number, None)
+
+@db_read
+def get_recent_foods(whatsapp_number):
+    """Os RECENT_FOODS_LIMIT alimentos mais registrados pelo usuário, com a última porção e os macros gravados."""
+    now = time_module.monotonic()
+    cached = _recent_foods_cache.get(whatsapp_number)
+    if cached and now - cached[0] < RECENT_FOODS_CACHE_SECONDS:
+        return cached[1]
+
+    user_id = get_or_create_user(whatsapp_number)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    _execute_statement(cursor, 'recent_foods_select', (user_id, RECENT_FOODS_LIMIT))
+    recent_foods = _fetch_all_as_dict(cursor)
     cursor.close()
     conn.close()
-    return users
 
-def add_food_entry(whatsapp_number, foods_description, calories, carbohydrates, proteins, fats):
+    with _recent_foods_cache_lock:
+        if len(_recent_foods_cache) >= RECENT_FOODS_CACHE_MAX_USERS:
+            _recent_foods_cache.pop(next(iter(_recent_foods_cache)))  # descarta a entrada mais antiga
+        _recent_foods_cache[whatsapp_number] = (now, recent_foods)
+    return recent_foods
+
+@db_read
+def get_food_entries_between(whatsapp_number, entry_date, start_time, end_time):
+    """Refeições do usuário num dia dentro de uma faixa de horário (ex.: o almoço de ontem), em ordem de registro."""
     user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
-        "INSERT INTO food_entries (user_id, foods_description, calories, carbohydrates, proteins, fats, entry_date, entry_time) VALUES (%s, %s, %s, %s, %s, %s, CURRENT_DATE, CURRENT_TIME)",
-        (user_id, foods_description, calories, carbohydrates, proteins, fats)
+        "SELECT foods_description, calories, carbohydrates, proteins, fats, taco_food_id, grams FROM food_entries "
+        "WHERE user_id = %s AND entry_date = %s AND entry_time BETWEEN %s AND %s ORDER BY entry_time, id",
+        (user_id, entry_date, start_time, end_time)
     )
-    conn.commit()
+    entries = _fetch_all_as_dict(cursor)
     cursor.close()
     conn.close()
+    return entries
 
+@db_write
 def add_weight_entry(whatsapp_number, weight):
     user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
@@ -196,10 +995,12 @@ def add_weight_entry(whatsapp_number, weight):
         "INSERT INTO weight_entries (user_id, weight, entry_date, entry_time) VALUES (%s, %s, CURRENT_DATE, CURRENT_TIME)",
         (user_id, weight)
     )
+    _apply_daily_rollup(cursor, user_id, last_weight=weight)
     conn.commit()
     cursor.close()
     conn.close()
 
+@db_write
 def add_exercise_entry(whatsapp_number, activity_name, duration_minutes, calories_burned):
     user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
@@ -208,31 +1009,24 @@ def add_exercise_entry(whatsapp_number, activity_name, duration_minutes, calorie
         "INSERT INTO exercise_entries (user_id, activity_name, duration_minutes, calories_burned, entry_date, entry_time) VALUES (%s, %s, %s, %s, CURRENT_DATE, CURRENT_TIME)",
         (user_id, activity_name, duration_minutes, calories_burned)
     )
+    _apply_daily_rollup(cursor, user_id, kcal_burned=calories_burned, exercise_entries_count=1)
     conn.commit()
     cursor.close()
     conn.close()
 
+@db_read
 def get_daily_summary(whatsapp_number):
     user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
     cursor = conn.cursor()
     
-    cursor.execute(
-        "SELECT foods_description, calories, carbohydrates, proteins, fats FROM food_entries WHERE user_id = %s AND entry_date = CURRENT_DATE",
-        (user_id,)
-    )
+    _execute_statement(cursor, 'summary_foods_today', (user_id,))
     summary_foods = _fetch_all_as_dict(cursor)
 
-    cursor.execute(
-        "SELECT activity_name, duration_minutes, calories_burned FROM exercise_entries WHERE user_id = %s AND entry_date = CURRENT_DATE",
-        (user_id,)
-    )
+    _execute_statement(cursor, 'summary_exercises_today', (user_id,))
     summary_exercises = _fetch_all_as_dict(cursor)
 
-    cursor.execute(
-        "SELECT weight FROM weight_entries WHERE user_id = %s ORDER BY entry_date DESC, entry_time DESC LIMIT 1",
-        (user_id,)
-    )
+    _execute_statement(cursor, 'summary_last_weight', (user_id,))
     last_weight_row = _fetch_one_as_dict(cursor)
     
     cursor.close()
@@ -245,6 +1039,127 @@ def get_daily_summary(whatsapp_number):
     }
     return summary
 
+@db_read
+def get_daily_food_portions(whatsapp_number):
+    """
+    Retorna as porções de hoje como duas listas alinhadas (taco_food_ids, grams), prontas para a matriz de
+    nutrientes, e quantos registros de hoje não têm alimento TACO associado.
+    """
+    user_id = get_or_create_user(whatsapp_number)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT taco_food_id, grams FROM food_entries WHERE user_id = %s AND entry_date = CURRENT_DATE",
+        (user_id,)
+    )
+    rows = cursor.fetchall()
+    cursor.close()
+    conn.close()
+    linked = [(food_id, grams) for food_id, grams in rows if food_id is not None and grams is not None]
+    return {
+        'taco_food_ids': [food_id for food_id, _ in linked],
+        'grams': [grams for _, grams in linked],
+        'unlinked_count': len(rows) - len(linked)
+    }
+
+@db_read
+def get_daily_rollups(whatsapp_number, start_date, end_date=None):
+    """
+    Retorna os resumos diários do usuário entre start_date e end_date (padrão: hoje), em ordem de data.
+    Limitado a 31 linhas: é a base dos relatórios semanal e mensal.
+    """
+    user_id = get_or_create_user(whatsapp_number)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT rollup_date, kcal_in, kcal_burned, carbohydrates, proteins, fats, "
+        "food_entries_count, exercise_entries_count, last_weight "
+        "FROM daily_rollups WHERE user_id = %s AND rollup_date BETWEEN %s AND COALESCE(%s, CURRENT_DATE) "
+        "ORDER BY rollup_date ASC LIMIT 31",
+        (user_id, start_date, end_date)
+    )
+    rollups = _fetch_all_as_dict(cursor)
+    cursor.close()
+    conn.close()
+    return rollups
+
+@db_write
+def backfill_daily_rollups(since_date=None):
+    """
+    Recalcula daily_rollups a partir das tabelas de entradas (todo o histórico, ou a partir de since_date).
+    Roda numa única transação por shard, então os relatórios nunca veem um resumo pela metade.
+    Dias de meses já arquivados (partitions.py archive) nunca são recalculados: as entradas deles não existem
+    mais no banco e daily_rollups é o único histórico que sobrou.
+    """
+    return sum(_backfill_daily_rollups_shard(shard, since_date) for shard in shard_indices())
+
+# Última pesagem de cada dia: DISTINCT ON no PostgreSQL, janela ROW_NUMBER() no SQLite (que não tem DISTINCT ON)
+_LAST_WEIGHT_PER_DAY_SQL = {
+    'postgres': "  SELECT DISTINCT ON (user_id, entry_date) user_id, entry_date, weight "
+                "  FROM weight_entries WHERE %s IS NULL OR entry_date >= %s "
+                "  ORDER BY user_id, entry_date, entry_time DESC",
+    'sqlite': "  SELECT user_id, entry_date, weight FROM ("
+              "    SELECT user_id, entry_date, weight, "
+              "    ROW_NUMBER() OVER (PARTITION BY user_id, entry_date ORDER BY entry_time DESC, id DESC) AS position "
+              "    FROM weight_entries WHERE %s IS NULL OR entry_date >= %s"
+              "  ) WHERE position = 1",
+}
+
+def _backfill_daily_rollups_shard(shard, since_date):
+    conn = get_db_connection('write', shard=shard)
+    cursor = conn.cursor()
+    if DATABASE_BACKEND == 'postgres':
+        floor_date = archived_before(cursor)
+        if floor_date and (since_date is None or since_date < floor_date):
+            print(f"AVISO: shard {shard} tem meses arquivados; recalculando só a partir de {floor_date}.")
+            since_date = floor_date
+    cursor.execute(
+        "DELETE FROM daily_rollups WHERE %s IS NULL OR rollup_date >= %s",
+        (since_date, since_date)
+    )
+    cursor.execute(
+        "INSERT INTO daily_rollups (user_id, rollup_date, kcal_in, carbohydrates, proteins, fats, "
+        "food_entries_count, kcal_burned, exercise_entries_count, last_weight) "
+        "SELECT COALESCE(f.user_id, e.user_id, w.user_id), COALESCE(f.entry_date, e.entry_date, w.entry_date), "
+        "COALESCE(f.kcal_in, 0), COALESCE(f.carbohydrates, 0), COALESCE(f.proteins, 0), COALESCE(f.fats, 0), "
+        "COALESCE(f.entries, 0), COALESCE(e.kcal_burned, 0), COALESCE(e.entries, 0), w.weight "
+        "FROM ("
+        "  SELECT user_id, entry_date, SUM(calories) AS kcal_in, SUM(carbohydrates) AS carbohydrates, "
+        "  SUM(proteins) AS proteins, SUM(fats) AS fats, COUNT(*) AS entries "
+        "  FROM food_entries WHERE %s IS NULL OR entry_date >= %s GROUP BY user_id, entry_date"
+        ") f "
+        "FULL OUTER JOIN ("
+        "  SELECT user_id, entry_date, SUM(calories_burned) AS kcal_burned, COUNT(*) AS entries "
+        "  FROM exercise_entries WHERE %s IS NULL OR entry_date >= %s GROUP BY user_id, entry_date"
+        ") e ON e.user_id = f.user_id AND e.entry_date = f.entry_date "
+        "FULL OUTER JOIN ("
+        + _LAST_WEIGHT_PER_DAY_SQL[DATABASE_BACKEND] +
+        ") w ON w.user_id = COALESCE(f.user_id, e.user_id) AND w.entry_date = COALESCE(f.entry_date, e.entry_date)",
+        (since_date, since_date, since_date, since_date, since_date, since_date)
+    )
+    rows_written = cursor.rowcount
+    conn.commit()
+    cursor.close()
+    conn.close()
+    return rows_written
+
+@db_read
+def get_weight_trend(whatsapp_number):
+    """Lê a tendência de peso pré-calculada pelo job weight_trends.py (None se ainda não houver)."""
+    user_id = get_or_create_user(whatsapp_number)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT samples, latest_weight, smoothed_weight, avg_7d, weekly_change_kg, projected_goal_date, computed_at "
+        "FROM weight_trends WHERE user_id = %s",
+        (user_id,)
+    )
+    trend = _fetch_one_as_dict(cursor)
+    cursor.close()
+    conn.close()
+    return trend
+
+@db_write
 def set_goal(whatsapp_number, goal_type, target_value):
     user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
@@ -258,19 +1173,18 @@ def set_goal(whatsapp_number, goal_type, target_value):
     cursor.close()
     conn.close()
 
+@db_read
 def get_goal(whatsapp_number, goal_type):
     user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute(
-        "SELECT target_value, start_date, end_date FROM goals WHERE user_id = %s AND goal_type = %s",
-        (user_id, goal_type)
-    )
+    _execute_statement(cursor, 'goal_select', (user_id, goal_type))
     goal = _fetch_one_as_dict(cursor)
     cursor.close()
     conn.close()
     return goal
 
+@db_write
 def add_reminder(whatsapp_number, reminder_text, reminder_time_str):
     user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
@@ -281,28 +1195,69 @@ def add_reminder(whatsapp_number, reminder_text, reminder_time_str):
     except ValueError:
         return False
 
+    # Horário que já passou hoje só dispara a partir de amanhã
+    now = datetime.now()
     cursor.execute(
-        "INSERT INTO reminders (user_id, reminder_text, reminder_time, is_active) VALUES (%s, %s, %s, TRUE)",
-        (user_id, reminder_text, reminder_time_str)
+        "INSERT INTO reminders (user_id, reminder_text, reminder_time, is_active, last_sent_on) VALUES (%s, %s, %s, TRUE, %s)",
+        (user_id, reminder_text, reminder_time_str, now.date() if time_obj <= now.time() else None)
     )
     conn.commit()
     cursor.close()
     conn.close()
     return True
 
+@db_read
 def get_active_reminders():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT r.reminder_text, r.reminder_time, u.whatsapp_number "
-        "FROM reminders r JOIN users u ON r.user_id = u.id "
-        "WHERE r.is_active = TRUE"
-    )
-    reminders = _fetch_all_as_dict(cursor)
-    cursor.close()
-    conn.close()
-    return reminders
+    def per_shard(shard):
+        conn = get_db_connection('read', shard=shard)
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT r.reminder_text, r.reminder_time, u.whatsapp_number "
+            "FROM reminders r JOIN users u ON r.user_id = u.id "
+            "WHERE r.is_active = TRUE"
+        )
+        reminders = [row for row in _fetch_all_as_dict(cursor) if _owned_by_shard(row['whatsapp_number'], shard)]
+        cursor.close()
+        conn.close()
+        return reminders
+    return _fan_out(per_shard)
+
+@db_write
+def claim_due_reminders(now=None):
+    """
+    Marca como enviados hoje os lembretes ativos cujo horário já chegou e retorna [{'whatsapp_number',
+    'reminder_text'}]. O UPDATE é atômico por linha, então com vários workers cada lembrete sai por um só.
+    """
+    now = now or datetime.now()
+    today, current_time = now.date(), now.strftime('%H:%M')
+
+    def per_shard(shard):
+        conn = get_db_connection('write', shard=shard)
+        cursor = conn.cursor()
+        cursor.execute(
+            "UPDATE reminders SET last_sent_on = %s "
+            "WHERE is_active = TRUE AND reminder_time <= %s AND (last_sent_on IS NULL OR last_sent_on < %s) "
+            "RETURNING user_id, reminder_text",
+            (today, current_time, today)
+        )
+        claimed = cursor.fetchall()
+        numbers = {}
+        if claimed:
+            user_ids = sorted({user_id for user_id, _ in claimed})
+            if DATABASE_BACKEND == 'sqlite':
+                id_filter, id_params = f"id IN ({', '.join(['%s'] * len(user_ids))})", tuple(user_ids)
+            else:
+                id_filter, id_params = "id = ANY(%s)", (user_ids,)
+            cursor.execute(f"SELECT id, whatsapp_number FROM users WHERE {id_filter}", id_params)
+            numbers = dict(cursor.fetchall())
+        conn.commit()
+        cursor.close()
+        conn.close()
+        return [{'whatsapp_number': numbers[user_id], 'reminder_text': text} for user_id, text in claimed
+                if _owned_by_shard(numbers[user_id], shard)]
+    return _fan_out(per_shard)
 
+@db_read
 def get_user_reminders(whatsapp_number):
     user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
@@ -316,6 +1271,7 @@ def get_user_reminders(whatsapp_number):
     conn.close()
     return reminders
 
+@db_write
 def deactivate_reminder(whatsapp_number, reminder_text, reminder_time_str):
     user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
@@ -330,20 +1286,26 @@ def deactivate_reminder(whatsapp_number, reminder_text, reminder_time_str):
     conn.close()
     return rows_affected > 0
 
+@db_write
 def delete_all_food_entries_for_day(whatsapp_number):
     user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute(
-        "DELETE FROM food_entries WHERE user_id = %s AND entry_date = CURRENT_DATE",
+        "DELETE FROM food_entries WHERE user_id = %s AND entry_date = CURRENT_DATE "
+        "RETURNING user_id, entry_date, calories, carbohydrates, proteins, fats, foods_description",
         (user_id,)
     )
+    deleted_rows = cursor.fetchall()
+    _subtract_deleted_food_from_rollups(cursor, deleted_rows)
     conn.commit()
-    rows_deleted = cursor.rowcount
+    rows_deleted = len(deleted_rows)
     cursor.close()
     conn.close()
+    _forget_recent_foods(whatsapp_number)
     return rows_deleted
 
+@db_read
 def get_food_entries_for_day_indexed(whatsapp_number):
     user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
@@ -357,18 +1319,67 @@ def get_food_entries_for_day_indexed(whatsapp_number):
     conn.close()
     return entries
 
-def delete_food_entry_by_id(entry_id):
+@db_read
+def get_food_entries_page(whatsapp_number, before=None, limit=HISTORY_PAGE_SIZE):
+    """
+    Uma página do histórico de alimentos, do mais recente para o mais antigo. 'before' é o cursor
+    (entry_date, id) devolvido pela página anterior. Retorna {'entries': [...], 'next_cursor': (entry_date, id)},
+    com next_cursor None na última página.
+    """
+    user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("DELETE FROM food_entries WHERE id = %s", (entry_id,))
+    if before is None:
+        _execute_statement(cursor, 'history_page_first', (user_id, limit + 1))
+    else:
+        before_date, before_id = before
+        _execute_statement(cursor, 'history_page_before', (user_id, before_date, before_date, before_id, limit + 1))
+    entries = _fetch_all_as_dict(cursor)
+    cursor.close()
+    conn.close()
+    next_cursor = None
+    if len(entries) > limit:
+        entries = entries[:limit]
+        next_cursor = (entries[-1]['entry_date'], entries[-1]['id'])
+    return {'entries': entries, 'next_cursor': next_cursor}
+
+@db_write
+def delete_food_entries_by_ids(whatsapp_number, entry_ids):
+    """
+    Apaga de uma vez as entradas 'entry_ids' que pertencem ao usuário (ids de outro usuário são ignorados) e
+    desconta dos resumos diários e dos alimentos recentes. Retorna quantas foram apagadas.
+    """
+    entry_ids = sorted({int(entry_id) for entry_id in entry_ids})
+    if not entry_ids:
+        return 0
+    user_id = get_or_create_user(whatsapp_number)
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if DATABASE_BACKEND == 'sqlite':
+        id_filter, id_params = f"id IN ({', '.join(['%s'] * len(entry_ids))})", tuple(entry_ids)
+    else:
+        id_filter, id_params = "id = ANY(%s)", (entry_ids,)
+    cursor.execute(
+        f"DELETE FROM food_entries WHERE {id_filter} AND user_id = %s "
+        "RETURNING user_id, entry_date, calories, carbohydrates, proteins, fats, foods_description",
+        id_params + (user_id,)
+    )
+    deleted_rows = cursor.fetchall()
+    _subtract_deleted_food_from_rollups(cursor, deleted_rows)
     conn.commit()
-    rows_deleted = cursor.rowcount
+    rows_deleted = len(deleted_rows)
     cursor.close()
     conn.close()
+    if rows_deleted:
+        _forget_recent_foods(whatsapp_number)
     return rows_deleted
 
+def delete_food_entry_by_id(whatsapp_number, entry_id):
+    return delete_food_entries_by_ids(whatsapp_number, [entry_id])
+
 # --- NOVAS FUNÇÕES PARA GERENCIAMENTO DE ESTADO ---
 
+@db_write
 def set_user_state(whatsapp_number, state, context_data=None):
     user_id = get_or_create_user(whatsapp_number)
     conn = get_db_connection()
@@ -376,10 +1387,7 @@ def set_user_state(whatsapp_number, state, context_data=None):
     
     context_json = json.dumps(context_data) if context_data else None
 
-    cursor.execute(
-        "INSERT INTO user_state (user_id, state, context_data) VALUES (%s, %s, %s) ON CONFLICT (user_id) DO UPDATE SET state = EXCLUDED.state, context_data = EXCLUDED.context_data",
-        (user_id, state, context_json)
-    )
+    _execute_statement(cursor, 'user_state_upsert', (user_id, state, context_json))
     conn.commit()
     cursor.close()
     conn.close()
@@ -387,12 +1395,10 @@ def set_user_state(whatsapp_number, state, context_data=None):
 
 def get_user_state(whatsapp_number):
     user_id = get_or_create_user(whatsapp_number)
-    conn = get_db_connection()
+    # Estado da conversa sempre no primário: a resposta seguinte do usuário pode chegar antes da réplica
+    conn = get_db_connection('write', shard_key=whatsapp_number)
     cursor = conn.cursor()
-    cursor.execute(
-        "SELECT state, context_data FROM user_state WHERE user_id = %s",
-        (user_id,)
-    )
+    _execute_statement(cursor, 'user_state_select', (user_id,))
     result = _fetch_one_as_dict(cursor)
     cursor.close()
     conn.close()
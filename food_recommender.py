@@ -0,0 +1,250 @@
+# food_recommender.py
+"""
+"O que ainda posso comer?": sugestões de alimentos da TACO (sozinhos ou em dupla) que cabem no que resta da
+meta de calorias do dia e aproximam os macronutrientes que faltam.
+
+Tudo é vetorizado sobre a matriz de nutrientes (taco_nutrients / snapshot mmap):
+  * na montagem, as razões por grama (kcal, carboidratos, proteínas, gorduras) de cada alimento elegível são
+    multiplicadas pelas porções candidatas (PORTION_GRAMS), formando todas as opções alimento × porção;
+  * cada consulta pontua todas as opções de uma vez contra o alvo restante e, para as duplas, cruza as
+    RECOMMENDER_PAIR_POOL opções que melhor cabem em meio alvo (matriz K × K).
+O ranking base depende só do alvo, então é guardado em cache por faixa de orçamento (kcal em passos de 50,
+macros em passos de 10g/5g, sempre arredondados para baixo). Por cima dele entra o bônus do histórico do usuário (alimentos mais registrados).
+"""
+import functools
+import math
+import os
+import threading
+
+import numpy as np
+
+from taco_nutrients import get_nutrient_matrix, load_taco_categories
+
+PORTION_GRAMS = [30, 50, 100, 150, 200, 250, 300]
+# Divisão da meta de calorias entre carboidratos / proteínas / gorduras (fração das kcal) e kcal por grama
+MACRO_SPLIT = [('carbohydrates', 0.50, 4.0), ('proteins', 0.20, 4.0), ('fats', 0.30, 9.0)]
+MACRO_KCAL_PER_GRAM = np.array([kcal for _, _, kcal in MACRO_SPLIT], dtype=np.float32)
+# Passos de quantização do alvo (kcal, carboidratos, proteínas, gorduras) para o cache por faixa
+BUDGET_BUCKET_STEPS = np.array([50.0, 10.0, 10.0, 5.0], dtype=np.float32)
+MACRO_WEIGHT = 0.5          # peso do erro de macros em relação ao erro de kcal
+MAX_OVERSHOOT = 0.05        # opções acima do orçamento em mais de 5% ficam de fora
+HISTORY_WEIGHT = 0.15       # bônus máximo (na escala do score) para o alimento mais registrado pelo usuário
+MIN_REMAINING_KCAL = 80     # abaixo disso não há o que sugerir
+RECOMMENDER_PAIR_POOL = int(os.getenv('RECOMMENDER_PAIR_POOL', '120'))
+RECOMMENDER_CACHE_SIZE = int(os.getenv('RECOMMENDER_CACHE_SIZE', '2048'))
+RANKED_PER_BUCKET = 40
+
+# Categorias da TACO que não viram sugestão: bebidas (inclusive cachaça e cerveja), óleos/gorduras e
+# temperos/ingredientes (sal, fermento, café em pó...)
+EXCLUDED_CATEGORIES = {'Bebidas (alcoólicas e não alcoólicas)', 'Gorduras e óleos', 'Miscelâneas'}
+# Categorias em que a forma crua nunca é sugerida (carnes, peixes, ovos, grãos e massas se comem preparados)
+NEVER_RAW_CATEGORIES = {'Carnes e derivados', 'Pescados e frutos do mar', 'Ovos e derivados',
+                        'Cereais e derivados', 'Leguminosas e derivados'}
+# Ingredientes avulsos de outras categorias
+EXCLUDED_PREFIXES = ('açúcar', 'amido', 'farinha', 'fubá', 'milho, amido', 'milho, fubá', 'soja, farinha',
+                     'fécula', 'polvilho', 'creme de leite', 'glicose', 'vinagre', 'mostarda', 'ketchup',
+                     'maionese', 'banha', 'toucinho', 'bolo, mistura para', 'cereais, mistura para',
+                     'cereais, mingau')
+RAW_WORDS = {'cru', 'crua', 'crus', 'cruas'}
+
+
+def _name_parts(name):
+    return [part.strip() for part in name.lower().split(',')]
+
+
+def eligible_foods(names, kcal_per_100g, categories):
+    """
+    Máscara dos alimentos que fazem sentido como sugestão: com calorias, fora de EXCLUDED_CATEGORIES, sem
+    ingredientes avulsos, molhos e produtos em pó, sem carnes/peixes/grãos crus e, nas demais categorias, sem a
+    versão crua quando a TACO tem outra preparação do mesmo alimento (ex.: "Mandioca, crua" x "Mandioca, cozida").
+    """
+    parts = [_name_parts(name) for name in names]
+    # Quantos nomes começam com cada prefixo ("mandioca" -> "Mandioca, crua", "Mandioca, cozida", ...)
+    prefix_counts = {}
+    for name_parts in parts:
+        for size in range(1, len(name_parts) + 1):
+            prefix = tuple(name_parts[:size])
+            prefix_counts[prefix] = prefix_counts.get(prefix, 0) + 1
+    mask = np.asarray(kcal_per_100g, dtype=np.float32) >= 10
+    for idx, name_parts in enumerate(parts):
+        category = categories[idx]
+        raw_at = next((i for i, part in enumerate(name_parts) if part in RAW_WORDS), None)
+        if category in EXCLUDED_CATEGORIES or ', '.join(name_parts).startswith(EXCLUDED_PREFIXES):
+            mask[idx] = False
+        elif any(part in ('pó', 'molho') or part.endswith(' pó') for part in name_parts):
+            mask[idx] = False
+        elif raw_at is not None and (category in NEVER_RAW_CATEGORIES or
+                                     prefix_counts.get(tuple(name_parts[:raw_at]), 0) > 1):
+            mask[idx] = False
+    return mask
+
+
+class FoodRecommender:
+    def __init__(self, matrix):
+        self.matrix = matrix
+        column = matrix.column
+        per_100g = matrix.values[:, [column['energia_kcal'], column['carboidrato_g'],
+                                     column['proteina_g'], column['lipidios_g']]]
+        categories = load_taco_categories()
+        eligible = eligible_foods(matrix.names, per_100g[:, 0],
+                                  [categories.get(int(food_id), '') for food_id in matrix.food_ids])
+        self.rows = np.flatnonzero(eligible)                       # índice elegível -> linha da matriz
+        self.per_gram = (per_100g[self.rows] / np.float32(100.0)).astype(np.float32)
+        self.portions = np.array(PORTION_GRAMS, dtype=np.float32)
+        n_foods, n_portions = len(self.rows), len(self.portions)
+        # Todas as opções alimento × porção: (n_foods * n_portions, 4) com kcal, carboidratos, proteínas, gorduras
+        self.options = (self.per_gram[:, None, :] * self.portions[None, :, None]).reshape(-1, 4)
+        self.option_food = np.repeat(np.arange(n_foods), n_portions)
+        self.option_portion = np.tile(np.arange(n_portions), n_foods)
+        self._eligible_index = np.full(len(matrix.food_ids), -1, dtype=np.int32)
+        self._eligible_index[self.rows] = np.arange(n_foods, dtype=np.int32)
+        self._ranked = functools.lru_cache(maxsize=RECOMMENDER_CACHE_SIZE)(self._rank_bucket)
+
+    @staticmethod
+    def _score(nutrients, target):
+        """Score (menor = melhor) de cada linha de 'nutrients' (..., 4) contra o alvo (4,). Inf = estoura o orçamento."""
+        kcal_error = np.abs(nutrients[..., 0] - target[0]) / target[0]
+        macro_error = (np.abs(nutrients[..., 1:] - target[1:]) * MACRO_KCAL_PER_GRAM).sum(axis=-1) / target[0]
+        score = kcal_error + MACRO_WEIGHT * macro_error
+        return np.where(nutrients[..., 0] > target[0] * (1 + MAX_OVERSHOOT), np.inf, score)
+
+    @staticmethod
+    def _top(scores, count):
+        count = min(count, scores.size)
+        top = np.argpartition(scores, count - 1)[:count]
+        top = top[np.isfinite(scores[top])]
+        return top[np.argsort(scores[top], kind='stable')]
+
+    def _rank_bucket(self, bucket):
+        """Ranking base (sem histórico) para uma faixa de orçamento: ([(score, (opção,))], [(score, (opção, opção))])."""
+        target = np.array(bucket, dtype=np.float32) * BUDGET_BUCKET_STEPS
+        single_scores = self._score(self.options, target)
+        singles = [(float(single_scores[i]), (int(i),)) for i in self._top(single_scores, RANKED_PER_BUCKET)]
+
+        # Duplas: cruza as opções que melhor cabem em meio alvo
+        pool = self._top(self._score(self.options, target / 2), RECOMMENDER_PAIR_POOL)
+        pairs = []
+        if len(pool) > 1:
+            combined = self.options[pool][:, None, :] + self.options[pool][None, :, :]
+            pair_scores = self._score(combined, target)
+            foods = self.option_food[pool]
+            # Cada dupla uma vez só (i < j) e com dois alimentos diferentes
+            invalid = (np.arange(len(pool))[:, None] >= np.arange(len(pool))[None, :]) | (foods[:, None] == foods[None, :])
+            pair_scores[invalid] = np.inf
+            for flat in self._top(pair_scores.ravel(), RANKED_PER_BUCKET):
+                i, j = divmod(int(flat), len(pool))
+                pairs.append((float(pair_scores[i, j]), (int(pool[i]), int(pool[j]))))
+        return singles, pairs
+
+    def _history_bonus(self, history):
+        """{índice elegível: bônus} a partir de {taco_food_id: vezes registrado}."""
+        if not history:
+            return {}
+        food_ids = list(history)
+        rows = self.matrix.rows_for(food_ids)
+        max_times = max(history.values())
+        bonus = {}
+        for food_id, row in zip(food_ids, rows):
+            if row >= 0 and self._eligible_index[row] >= 0:
+                bonus[int(self._eligible_index[row])] = HISTORY_WEIGHT * math.log1p(history[food_id]) / math.log1p(max_times)
+        return bonus
+
+    def recommend(self, remaining, history=None, limit=3):
+        """
+        remaining: {'calories', 'carbohydrates', 'proteins', 'fats'} que ainda cabem hoje.
+        history: {taco_food_id: vezes registrado} do usuário (os favoritos sobem no ranking).
+        Retorna até 'limit' sugestões sem alimentos repetidos entre elas.
+        """
+        target = np.array([max(remaining.get(key) or 0.0, 0.0)
+                           for key in ('calories', 'carbohydrates', 'proteins', 'fats')], dtype=np.float32)
+        if target[0] < MIN_REMAINING_KCAL:
+            return []
+        # Faixa arredondada para baixo: o alvo da faixa nunca passa do que realmente resta
+        bucket = tuple(int(v) for v in np.maximum(np.floor(target / BUDGET_BUCKET_STEPS), 0))
+        bucket = (max(bucket[0], 1),) + bucket[1:]
+        max_calories = target[0] * (1 + MAX_OVERSHOOT)
+        singles, pairs = self._ranked(bucket)
+        bonus = self._history_bonus(history)
+
+        candidates = []
+        for score, option_ids in singles + pairs:
+            foods = [int(self.option_food[o]) for o in option_ids]
+            candidates.append((score - sum(bonus.get(f, 0.0) for f in foods) / len(foods), option_ids))
+        if bonus:
+            # Os favoritos do usuário entram mesmo fora do ranking base da faixa (melhor porção de cada um)
+            quantized = np.array(bucket, dtype=np.float32) * BUDGET_BUCKET_STEPS
+            favorite_foods = np.array(sorted(bonus), dtype=np.int64)
+            option_ids = (favorite_foods[:, None] * len(self.portions) + np.arange(len(self.portions))[None, :]).ravel()
+            scores = self._score(self.options[option_ids], quantized).reshape(len(favorite_foods), -1)
+            for food, food_scores in zip(favorite_foods, scores):
+                best = int(np.argmin(food_scores))
+                if np.isfinite(food_scores[best]):
+                    candidates.append((float(food_scores[best]) - bonus[int(food)],
+                                       (int(food) * len(self.portions) + best,)))
+
+        suggestions, used_foods, seen = [], set(), set()
+        for score, option_ids in sorted(candidates, key=lambda c: c[0]):
+            foods = {int(self.option_food[o]) for o in option_ids}
+            if option_ids in seen or foods & used_foods:
+                continue
+            if sum(float(self.options[o][0]) for o in option_ids) > max_calories:
+                continue
+            seen.add(option_ids)
+            used_foods |= foods
+            suggestions.append(self._describe(option_ids, score))
+            if len(suggestions) >= limit:
+                break
+        return suggestions
+
+    def _describe(self, option_ids, score):
+        items, totals = [], np.zeros(4, dtype=np.float64)
+        for option in option_ids:
+            row = int(self.rows[self.option_food[option]])
+            items.append({
+                'alimento': self.matrix.names[row],
+                'taco_food_id': int(self.matrix.food_ids[row]),
+                'grams': float(self.portions[self.option_portion[option]]),
+            })
+            totals += self.options[option]
+        return {'items': items, 'calories': float(totals[0]), 'carbohydrates': float(totals[1]),
+                'proteins': float(totals[2]), 'fats': float(totals[3]), 'score': score}
+
+
+_recommender = None
+_recommender_lock = threading.Lock()
+
+
+def get_recommender():
+    """Recomendador do processo; é refeito quando a matriz muda (snapshot novo da TACO)."""
+    global _recommender
+    matrix = get_nutrient_matrix()
+    if _recommender is None or _recommender.matrix is not matrix:
+        with _recommender_lock:
+            if _recommender is None or _recommender.matrix is not matrix:
+                _recommender = FoodRecommender(matrix)
+                print(f"DEBUG RECOMENDADOR: {len(_recommender.rows)} alimentos elegíveis × {len(PORTION_GRAMS)} porções.")
+    return _recommender
+
+
+def remaining_targets(calorie_goal, foods_today):
+    """O que ainda cabe hoje: meta de kcal menos o consumido, e os macros pela divisão MACRO_SPLIT da meta."""
+    remaining = {'calories': calorie_goal - sum(f['calories'] or 0 for f in foods_today)}
+    for key, share, kcal_per_gram in MACRO_SPLIT:
+        remaining[key] = calorie_goal * share / kcal_per_gram - sum(f[key] or 0 for f in foods_today)
+    return remaining
+
+
+def format_recommendations(remaining, suggestions):
+    """Texto da resposta "o que posso comer"."""
+    if remaining['calories'] < MIN_REMAINING_KCAL:
+        return "🎯 Você já está no limite da sua meta de hoje. Se bater fome, prefira vegetais e água!"
+    if not suggestions:
+        return f"🤔 Não encontrei boas opções para as {remaining['calories']:.0f} kcal restantes."
+    lines = [f"🍽️ *Você ainda tem {remaining['calories']:.0f} kcal hoje.* Algumas opções:", ""]
+    for i, suggestion in enumerate(suggestions):
+        foods = " + ".join(f"{item['grams']:.0f}g de {item['alimento']}" for item in suggestion['items'])
+        lines.append(f"*{i + 1}*. {foods}")
+        lines.append(f"    {suggestion['calories']:.0f} kcal · C {suggestion['carbohydrates']:.0f}g · "
+                     f"P {suggestion['proteins']:.0f}g · G {suggestion['fats']:.0f}g")
+    lines.append("\n_Para registrar, mande por exemplo 'comi 150g de arroz'._")
+    return "\n".join(lines)
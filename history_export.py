@@ -0,0 +1,214 @@
+# history_export.py
+"""
+Exportação do histórico completo de um usuário (ou de todos) em CSV ou NDJSON, em streaming.
+
+Cada tabela é lida com um cursor nomeado (server-side cursor): o PostgreSQL entrega as linhas em lotes de
+EXPORT_FETCH_SIZE e o gerador devolve pedaços de texto conforme lê, então a memória fica constante
+independente de quantos anos de dados o usuário tenha.
+
+Formato: uma linha por registro, com a coluna/campo 'record_type' indicando a origem
+(food_entries, exercise_entries, weight_entries ou goals). O CSV usa um cabeçalho único (EXPORT_COLUMNS).
+
+Todas as leituras usam a réplica (DATABASE_REPLICA_URL) quando ela estiver configurada e em dia.
+Com sharding, o modo --all exporta cada shard separadamente (user_id só é único dentro do shard).
+
+Uso (CLI):
+    python history_export.py --number whatsapp:+5511999999999 --format csv > historico.csv
+    python history_export.py --all --output-dir exports/ --workers 4 --format ndjson
+"""
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import date, time, datetime
+
+EXPORT_FETCH_SIZE = 2000   # Linhas por ida ao servidor no cursor nomeado
+FLUSH_EVERY_ROWS = 500     # Quantas linhas acumular antes de devolver um pedaço do stream
+BULK_CHUNK_USERS = 1000    # Faixa de user_id por arquivo no modo --all
+
+# (tabela, colunas exportadas, ordenação)
+EXPORT_TABLES = [
+    ('food_entries', ['entry_date', 'entry_time', 'foods_description', 'calories', 'carbohydrates', 'proteins',
+                      'fats', 'taco_food_id', 'grams'], 'entry_date, entry_time, id'),
+    ('exercise_entries', ['entry_date', 'entry_time', 'activity_name', 'duration_minutes', 'calories_burned'],
+     'entry_date, entry_time, id'),
+    ('weight_entries', ['entry_date', 'entry_time', 'weight'], 'entry_date, entry_time, id'),
+    ('goals', ['goal_type', 'target_value', 'start_date', 'end_date'], 'goal_type'),
+]
+
+EXPORT_COLUMNS = ['whatsapp_number', 'record_type']
+for _, _columns, _ in EXPORT_TABLES:
+    EXPORT_COLUMNS.extend(col for col in _columns if col not in EXPORT_COLUMNS)
+
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'ndjson': 'application/x-ndjson'}
+
+
+def _serialize(value):
+    if isinstance(value, (date, time, datetime)):
+        return value.isoformat()
+    return value
+
+
+def iter_history_records(conn, first_user_id, last_user_id=None):
+    """
+    Gera dicionários (um por registro) de todas as tabelas de histórico para os usuários com id entre
+    first_user_id e last_user_id (inclusive; last_user_id=None exporta só first_user_id).
+    """
+    last_user_id = first_user_id if last_user_id is None else last_user_id
+    for table, columns, order_by in EXPORT_TABLES:
+        cursor = conn.cursor(name=f"export_{table}")
+        cursor.itersize = EXPORT_FETCH_SIZE
+        cursor.execute(
+            f"SELECT u.whatsapp_number, {', '.join('t.' + col for col in columns)} "
+            f"FROM {table} t JOIN users u ON u.id = t.user_id "
+            f"WHERE t.user_id BETWEEN %s AND %s ORDER BY t.user_id, {', '.join('t.' + col.strip() for col in order_by.split(','))}",
+            (first_user_id, last_user_id)
+        )
+        for row in cursor:
+            record = {'whatsapp_number': row[0], 'record_type': table}
+            for idx, col in enumerate(columns):
+                record[col] = _serialize(row[idx + 1])
+            yield record
+        cursor.close()
+
+
+def encode_records(records, fmt):
+    """Transforma um iterável de registros em pedaços de texto CSV ou NDJSON, sem acumular o arquivo todo."""
+    if fmt not in CONTENT_TYPES:
+        raise ValueError(f"Formato de exportação inválido: {fmt}")
+
+    buffer = io.StringIO()
+    writer = None
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS, extrasaction='ignore')
+        writer.writeheader()
+
+    pending = 0
+    for record in records:
+        if writer:
+            writer.writerow(record)
+        else:
+            buffer.write(json.dumps(record, ensure_ascii=False))
+            buffer.write("\n")
+        pending += 1
+        if pending >= FLUSH_EVERY_ROWS:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    if buffer.tell():
+        yield buffer.getvalue()
+
+
+def stream_user_export(whatsapp_number, fmt='ndjson', shard=None):
+    """
+    Gerador com o histórico completo de um usuário, pronto para uma resposta HTTP em streaming.
+    A conexão fica aberta enquanto o gerador é consumido e é fechada no final (ou se o cliente desconectar).
+    Quem já resolveu o shard antes de começar a resposta passa 'shard', e nada aqui consulta os overrides de novo.
+    """
+    from database import get_db_connection
+
+    if shard is None:
+        conn = get_db_connection('read', shard_key=whatsapp_number)
+    else:
+        conn = get_db_connection('read', shard=shard)
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id FROM users WHERE whatsapp_number = %s", (whatsapp_number,))
+        row = cursor.fetchone()
+        cursor.close()
+        if not row:
+            return
+        yield from encode_records(iter_history_records(conn, row[0]), fmt)
+    finally:
+        conn.rollback()
+        conn.close()
+
+
+def export_user_range(first_user_id, last_user_id, output_path, fmt, shard=0):
+    """Exporta uma faixa de usuários de um shard para um arquivo. Roda em processo separado no modo --all."""
+    from database import get_db_connection
+
+    conn = get_db_connection('read', shard=shard)
+    try:
+        with open(output_path, 'w', encoding='utf-8', newline='') as output:
+            for chunk in encode_records(iter_history_records(conn, first_user_id, last_user_id), fmt):
+                output.write(chunk)
+    finally:
+        conn.rollback()
+        conn.close()
+    return output_path
+
+
+def export_all_users(output_dir, fmt='ndjson', workers=4, chunk_users=BULK_CHUNK_USERS):
+    """Divide os usuários de cada shard em faixas de id e exporta cada faixa em paralelo para um arquivo próprio."""
+    from database import get_db_connection, shard_indices
+
+    shards = shard_indices()
+    ranges = []
+    for shard in shards:
+        conn = get_db_connection('read', shard=shard)
+        cursor = conn.cursor()
+        cursor.execute("SELECT MIN(id), MAX(id) FROM users")
+        min_id, max_id = cursor.fetchone()
+        cursor.close()
+        conn.close()
+        if min_id is not None:
+            ranges.extend((shard, start, min(start + chunk_users - 1, max_id))
+                          for start in range(min_id, max_id + 1, chunk_users))
+    if not ranges:
+        print("Nenhum usuário para exportar.")
+        return []
+
+    os.makedirs(output_dir, exist_ok=True)
+    written = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {}
+        for shard, first, last in ranges:
+            prefix = "history_users" if len(shards) == 1 else f"history_shard{shard:02d}_users"
+            output_path = os.path.join(output_dir, f"{prefix}_{first:09d}_{last:09d}.{fmt}")
+            futures[executor.submit(export_user_range, first, last, output_path, fmt, shard)] = (shard, first, last)
+        for future in as_completed(futures):
+            shard, first, last = futures[future]
+            try:
+                written.append(future.result())
+                print(f"Faixa de usuários {first}-{last} (shard {shard}) exportada.")
+            except Exception as e:
+                print(f"ERRO ao exportar usuários {first}-{last} (shard {shard}): {e}")
+    return sorted(written)
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Exporta o histórico de usuários em CSV ou NDJSON.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--number', help="Número do WhatsApp do usuário (ex.: whatsapp:+5511999999999).")
+    target.add_argument('--all', action='store_true', help="Exporta todos os usuários em arquivos por faixa.")
+    parser.add_argument('--format', choices=sorted(CONTENT_TYPES), default='ndjson')
+    parser.add_argument('--output', help="Arquivo de saída (padrão: stdout). Só para --number.")
+    parser.add_argument('--output-dir', default='exports', help="Diretório de saída para --all.")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--chunk-users', type=int, default=BULK_CHUNK_USERS)
+    args = parser.parse_args()
+
+    if args.all:
+        files = export_all_users(args.output_dir, args.format, args.workers, args.chunk_users)
+        print(f"{len(files)} arquivos gerados em '{args.output_dir}'.", file=sys.stderr)
+        return
+
+    output = open(args.output, 'w', encoding='utf-8', newline='') if args.output else sys.stdout
+    try:
+        for chunk in stream_user_export(args.number, args.format):
+            output.write(chunk)
+    finally:
+        if args.output:
+            output.close()
+
+
+if __name__ == '__main__':
+    main()
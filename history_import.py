@@ -0,0 +1,384 @@
+# history_import.py
+"""
+Importação em massa de histórico (CSV ou NDJSON) para usuários vindos de outros apps.
+
+Fluxo:
+  1. Uma única passada em streaming lê, valida e normaliza cada linha, gravando o resultado em arquivos
+     temporários no formato do COPY (um para refeições, outro para pesagens).
+  2. COPY para tabelas de staging temporárias.
+  3. Numa ÚNICA transação: descarta (e conta como rejeitadas) as linhas de meses já arquivados pelo
+     partitions.py archive, cria usuários que faltam, garante as partições dos meses importados, insere em
+     food_entries/weight_entries só o que ainda não existe (dedup) e atualiza daily_rollups com o que entrou
+     (e recalcula os alimentos recentes dos usuários afetados).
+     Com sharding, as linhas são separadas por shard na passada 1 e cada shard tem a sua transação.
+
+Aceita o formato gerado pelo history_export.py e também nomes de colunas comuns de outros apps
+(data, hora, alimento, kcal, peso...). Datas em AAAA-MM-DD ou DD/MM/AAAA.
+
+Uso:
+    python history_import.py historico.csv --number whatsapp:+5511999999999
+    python history_import.py export.ndjson            (usa a coluna whatsapp_number de cada linha)
+"""
+import argparse
+import csv
+import json
+import os
+import tempfile
+from datetime import datetime
+
+MAX_REPORTED_ERRORS = 20
+SPOOL_MAX_BYTES = 8 * 1024 * 1024  # Acima disso os arquivos temporários vão para o disco
+
+# Nomes alternativos de colunas -> nome canônico
+COLUMN_ALIASES = {
+    'data': 'entry_date', 'date': 'entry_date', 'dia': 'entry_date',
+    'hora': 'entry_time', 'time': 'entry_time', 'horario': 'entry_time', 'horário': 'entry_time',
+    'alimento': 'foods_description', 'alimentos': 'foods_description', 'food': 'foods_description',
+    'description': 'foods_description', 'descricao': 'foods_description', 'descrição': 'foods_description',
+    'kcal': 'calories', 'calorias': 'calories', 'energia_kcal': 'calories',
+    'carboidratos': 'carbohydrates', 'carbs': 'carbohydrates', 'carboidrato_g': 'carbohydrates',
+    'proteinas': 'proteins', 'proteínas': 'proteins', 'protein': 'proteins', 'proteina_g': 'proteins',
+    'gorduras': 'fats', 'fat': 'fats', 'lipidios_g': 'fats',
+    'peso': 'weight', 'weight_kg': 'weight',
+    'gramas': 'grams', 'numero': 'whatsapp_number', 'número': 'whatsapp_number', 'phone': 'whatsapp_number',
+    'tipo': 'record_type', 'type': 'record_type',
+}
+
+FOOD_STAGING_COLUMNS = ['whatsapp_number', 'entry_date', 'entry_time', 'foods_description', 'calories',
+                        'carbohydrates', 'proteins', 'fats', 'taco_food_id', 'grams']
+WEIGHT_STAGING_COLUMNS = ['whatsapp_number', 'entry_date', 'entry_time', 'weight']
+
+
+class ImportRowError(ValueError):
+    pass
+
+
+def _normalize_keys(raw):
+    record = {}
+    for key, value in raw.items():
+        if key is None:
+            continue
+        canonical = key.strip().lower()
+        canonical = COLUMN_ALIASES.get(canonical, canonical)
+        if isinstance(value, str):
+            value = value.strip()
+        if value in ('', None):
+            continue
+        record[canonical] = value
+    return record
+
+
+def _parse_number(value, field, minimum, maximum, required=True):
+    if value is None:
+        if required:
+            raise ImportRowError(f"campo '{field}' ausente")
+        return None
+    try:
+        number = float(str(value).replace(',', '.'))
+    except ValueError:
+        raise ImportRowError(f"valor inválido em '{field}': {value!r}")
+    if not (minimum <= number <= maximum):
+        raise ImportRowError(f"valor fora da faixa em '{field}': {number}")
+    return number
+
+
+def _parse_date(value):
+    if value is None:
+        raise ImportRowError("campo 'entry_date' ausente")
+    value = str(value)[:10]
+    for fmt in ('%Y-%m-%d', '%d/%m/%Y', '%d-%m-%Y'):
+        try:
+            parsed = datetime.strptime(value, fmt).date()
+            break
+        except ValueError:
+            continue
+    else:
+        raise ImportRowError(f"data inválida: {value!r}")
+    if parsed > datetime.now().date():
+        raise ImportRowError(f"data no futuro: {parsed}")
+    return parsed
+
+
+def _parse_time(value):
+    if value is None:
+        return None
+    value = str(value)
+    for fmt in ('%H:%M:%S.%f', '%H:%M:%S', '%H:%M'):
+        try:
+            return datetime.strptime(value, fmt).time()
+        except ValueError:
+            continue
+    raise ImportRowError(f"hora inválida: {value!r}")
+
+
+def normalize_record(raw, default_number=None):
+    """
+    Valida e normaliza uma linha de entrada. Retorna ('food_entries' | 'weight_entries', tupla para o COPY),
+    ou None para tipos de registro que não são importados (ex.: goals, exercise_entries).
+    """
+    record = _normalize_keys(raw)
+    record_type = record.get('record_type')
+    if record_type is None:
+        record_type = 'weight_entries' if 'weight' in record and 'foods_description' not in record else 'food_entries'
+    if record_type not in ('food_entries', 'weight_entries'):
+        return None
+
+    whatsapp_number = default_number or record.get('whatsapp_number')
+    if not whatsapp_number:
+        raise ImportRowError("número do WhatsApp ausente (use --number ou a coluna whatsapp_number)")
+    entry_date = _parse_date(record.get('entry_date'))
+    entry_time = _parse_time(record.get('entry_time'))
+
+    if record_type == 'weight_entries':
+        weight = _parse_number(record.get('weight'), 'weight', 20, 400)
+        return record_type, (whatsapp_number, entry_date, entry_time, weight)
+
+    description = record.get('foods_description')
+    if not description:
+        raise ImportRowError("campo 'foods_description' ausente")
+    calories = _parse_number(record.get('calories'), 'calories', 0, 10000)
+    carbohydrates = _parse_number(record.get('carbohydrates'), 'carbohydrates', 0, 2000, required=False) or 0.0
+    proteins = _parse_number(record.get('proteins'), 'proteins', 0, 2000, required=False) or 0.0
+    fats = _parse_number(record.get('fats'), 'fats', 0, 2000, required=False) or 0.0
+    grams = _parse_number(record.get('grams'), 'grams', 0, 10000, required=False)
+    taco_food_id = record.get('taco_food_id')
+    taco_food_id = int(taco_food_id) if taco_food_id is not None and str(taco_food_id).isdigit() else None
+    return record_type, (whatsapp_number, entry_date, entry_time, description[:500], calories,
+                         carbohydrates, proteins, fats, taco_food_id, grams)
+
+
+def iter_input_rows(path, fmt=None):
+    """Lê o arquivo linha a linha (CSV com cabeçalho ou NDJSON), sem carregá-lo inteiro na memória."""
+    fmt = fmt or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+    with open(path, mode='r', encoding='utf-8-sig', newline='') as file:
+        if fmt == 'csv':
+            sample = file.read(4096)
+            file.seek(0)
+            delimiter = ';' if sample.count(';') > sample.count(',') else ','
+            yield from csv.DictReader(file, delimiter=delimiter)
+        else:
+            for line in file:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+
+def _copy_value(value):
+    if value is None:
+        return '\\N'
+    text = value.isoformat() if hasattr(value, 'isoformat') else str(value)
+    return text.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def _new_staging_files():
+    return {
+        'food_entries': tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode='w+', encoding='utf-8'),
+        'weight_entries': tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_BYTES, mode='w+', encoding='utf-8'),
+    }
+
+
+def stage_input(rows, default_number=None, shard_for=None):
+    """
+    Passada única de validação/normalização. Retorna ({shard: (arquivo_refeições, arquivo_pesagens)}, estatísticas),
+    com os arquivos já no formato texto do COPY e posicionados no início. shard_for(número) escolhe o shard
+    de cada linha (sem ele tudo vai para o shard 0).
+    """
+    staged_by_shard = {}
+    stats = {'read': 0, 'food_entries': 0, 'weight_entries': 0, 'skipped': 0, 'invalid': 0, 'errors': []}
+    for line_number, raw in enumerate(rows, start=1):
+        stats['read'] += 1
+        try:
+            normalized = normalize_record(raw, default_number)
+            shard = shard_for(normalized[1][0]) if normalized and shard_for else 0
+        except (ImportRowError, AttributeError, TypeError) as e:
+            stats['invalid'] += 1
+            if len(stats['errors']) < MAX_REPORTED_ERRORS:
+                stats['errors'].append(f"linha {line_number}: {e}")
+            continue
+        if normalized is None:
+            stats['skipped'] += 1
+            continue
+        table, values = normalized
+        staged = staged_by_shard.get(shard)
+        if staged is None:
+            staged = staged_by_shard[shard] = _new_staging_files()
+        staged[table].write("\t".join(_copy_value(v) for v in values) + "\n")
+        stats[table] += 1
+    for staged in staged_by_shard.values():
+        for file in staged.values():
+            file.seek(0)
+    return {shard: (staged['food_entries'], staged['weight_entries']) for shard, staged in staged_by_shard.items()}, stats
+
+
+def merge_staged(conn, food_file, weight_file):
+    """
+    COPY para staging e merge com dedup nas tabelas reais, tudo numa transação.
+    Retorna quantas refeições e pesagens foram de fato inseridas e quantas linhas foram rejeitadas por serem de
+    meses já arquivados (recriar essas partições faria o próximo arquivamento colidir com o arquivo, e os
+    resumos desses dias deixariam de bater com ele).
+    """
+    from partitions import archived_before, ensure_partitions, lock_partition_maintenance
+    from database import rebuild_recent_foods
+
+    cursor = conn.cursor()
+    try:
+        cursor.execute(
+            "CREATE TEMP TABLE staging_food_entries ("
+            "whatsapp_number TEXT, entry_date DATE, entry_time TIME, foods_description TEXT, calories REAL, "
+            "carbohydrates REAL, proteins REAL, fats REAL, taco_food_id INTEGER, grams REAL) ON COMMIT DROP"
+        )
+        cursor.execute(
+            "CREATE TEMP TABLE staging_weight_entries ("
+            "whatsapp_number TEXT, entry_date DATE, entry_time TIME, weight REAL) ON COMMIT DROP"
+        )
+        cursor.copy_expert(f"COPY staging_food_entries ({', '.join(FOOD_STAGING_COLUMNS)}) FROM STDIN", food_file)
+        cursor.copy_expert(f"COPY staging_weight_entries ({', '.join(WEIGHT_STAGING_COLUMNS)}) FROM STDIN", weight_file)
+
+        # Com o lock, nenhum arquivamento acontece entre a checagem e o insert
+        lock_partition_maintenance(cursor)
+        archived_rejected = 0
+        floor_date = archived_before(cursor)
+        if floor_date:
+            for table in ('food_entries', 'weight_entries'):
+                cursor.execute(f"DELETE FROM staging_{table} WHERE entry_date < %s", (floor_date,))
+                archived_rejected += cursor.rowcount
+
+        cursor.execute(
+            "INSERT INTO users (whatsapp_number) "
+            "SELECT whatsapp_number FROM staging_food_entries UNION SELECT whatsapp_number FROM staging_weight_entries "
+            "ON CONFLICT (whatsapp_number) DO NOTHING"
+        )
+
+        # Datas antigas precisam das partições mensais correspondentes (senão cairiam na DEFAULT)
+        for table in ('food_entries', 'weight_entries'):
+            cursor.execute(f"SELECT MIN(entry_date) FROM staging_{table}")
+            oldest = cursor.fetchone()[0]
+            if oldest:
+                ensure_partitions(cursor, table, start=oldest)
+
+        # Refeições: insere só as que não existem (mesmo usuário, data, hora e descrição) e soma nos resumos
+        cursor.execute(
+            "WITH candidates AS ("
+            "  SELECT DISTINCT ON (u.id, s.entry_date, s.entry_time, s.foods_description) u.id AS user_id, s.* "
+            "  FROM staging_food_entries s JOIN users u ON u.whatsapp_number = s.whatsapp_number "
+            "  ORDER BY u.id, s.entry_date, s.entry_time, s.foods_description"
+            "), inserted AS ("
+            "  INSERT INTO food_entries (user_id, foods_description, calories, carbohydrates, proteins, fats, "
+            "  taco_food_id, grams, entry_date, entry_time) "
+            "  SELECT c.user_id, c.foods_description, c.calories, c.carbohydrates, c.proteins, c.fats, "
+            "  c.taco_food_id, c.grams, c.entry_date, c.entry_time FROM candidates c "
+            "  WHERE NOT EXISTS (SELECT 1 FROM food_entries f WHERE f.user_id = c.user_id "
+            "    AND f.entry_date = c.entry_date AND f.entry_time IS NOT DISTINCT FROM c.entry_time "
+            "    AND f.foods_description = c.foods_description) "
+            "  RETURNING user_id, entry_date, calories, carbohydrates, proteins, fats"
+            "), rolled AS ("
+            "  INSERT INTO daily_rollups (user_id, rollup_date, kcal_in, carbohydrates, proteins, fats, food_entries_count) "
+            "  SELECT user_id, entry_date, SUM(calories), SUM(carbohydrates), SUM(proteins), SUM(fats), COUNT(*) "
+            "  FROM inserted GROUP BY user_id, entry_date "
+            "  ON CONFLICT (user_id, rollup_date) DO UPDATE SET "
+            "  kcal_in = daily_rollups.kcal_in + EXCLUDED.kcal_in, "
+            "  carbohydrates = daily_rollups.carbohydrates + EXCLUDED.carbohydrates, "
+            "  proteins = daily_rollups.proteins + EXCLUDED.proteins, "
+            "  fats = daily_rollups.fats + EXCLUDED.fats, "
+            "  food_entries_count = daily_rollups.food_entries_count + EXCLUDED.food_entries_count"
+            ") SELECT COUNT(*), array_agg(DISTINCT user_id) FROM inserted"
+        )
+        foods_inserted, food_user_ids = cursor.fetchone()
+        if food_user_ids:
+            # Contagens e porções dos recentes passam a incluir o histórico importado
+            rebuild_recent_foods(cursor, food_user_ids)
+
+        # Pesagens: mesmo dedup; o last_weight de cada dia afetado é recalculado com a pesagem mais tardia do dia
+        cursor.execute(
+            "WITH candidates AS ("
+            "  SELECT DISTINCT ON (u.id, s.entry_date, s.entry_time, s.weight) u.id AS user_id, s.* "
+            "  FROM staging_weight_entries s JOIN users u ON u.whatsapp_number = s.whatsapp_number "
+            "  ORDER BY u.id, s.entry_date, s.entry_time, s.weight"
+            "), inserted AS ("
+            "  INSERT INTO weight_entries (user_id, weight, entry_date, entry_time) "
+            "  SELECT c.user_id, c.weight, c.entry_date, c.entry_time FROM candidates c "
+            "  WHERE NOT EXISTS (SELECT 1 FROM weight_entries w WHERE w.user_id = c.user_id "
+            "    AND w.entry_date = c.entry_date AND w.entry_time IS NOT DISTINCT FROM c.entry_time "
+            "    AND w.weight = c.weight) "
+            "  RETURNING user_id, entry_date"
+            ") SELECT user_id, entry_date, COUNT(*) FROM inserted GROUP BY user_id, entry_date"
+        )
+        affected_days = cursor.fetchall()
+        weights_inserted = sum(count for _, _, count in affected_days)
+        if affected_days:
+            cursor.execute(
+                "INSERT INTO daily_rollups (user_id, rollup_date, last_weight) "
+                "SELECT DISTINCT ON (w.user_id, w.entry_date) w.user_id, w.entry_date, w.weight "
+                "FROM weight_entries w JOIN unnest(%s::int[], %s::date[]) AS a(user_id, entry_date) "
+                "ON a.user_id = w.user_id AND a.entry_date = w.entry_date "
+                "ORDER BY w.user_id, w.entry_date, w.entry_time DESC NULLS LAST "
+                "ON CONFLICT (user_id, rollup_date) DO UPDATE SET last_weight = EXCLUDED.last_weight",
+                ([user_id for user_id, _, _ in affected_days], [day for _, day, _ in affected_days])
+            )
+        conn.commit()
+        return foods_inserted, weights_inserted, archived_rejected
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+
+
+def import_history_file(path, default_number=None, fmt=None):
+    from database import get_db_connection, shard_for_number, UserShardMoving, is_sqlite
+
+    if is_sqlite():
+        raise RuntimeError("A importação em massa usa COPY e tabelas temporárias do PostgreSQL; não está disponível no SQLite.")
+
+    def shard_for(whatsapp_number):
+        try:
+            return shard_for_number(whatsapp_number)
+        except UserShardMoving as e:
+            raise ImportRowError(str(e))
+
+    staged_by_shard, stats = stage_input(iter_input_rows(path, fmt), default_number, shard_for)
+    stats['foods_inserted'] = stats['weights_inserted'] = stats['archived_rejected'] = 0
+    try:
+        for shard, (food_file, weight_file) in sorted(staged_by_shard.items()):
+            conn = get_db_connection('write', shard=shard)
+            try:
+                foods_inserted, weights_inserted, archived_rejected = merge_staged(conn, food_file, weight_file)
+            finally:
+                conn.close()
+            stats['foods_inserted'] += foods_inserted
+            stats['weights_inserted'] += weights_inserted
+            stats['archived_rejected'] += archived_rejected
+    finally:
+        for food_file, weight_file in staged_by_shard.values():
+            food_file.close()
+            weight_file.close()
+    return stats
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Importa histórico de refeições e pesagens (CSV/NDJSON).")
+    parser.add_argument('path', help="Arquivo de entrada (.csv, .ndjson ou .jsonl).")
+    parser.add_argument('--number', help="Número do WhatsApp a usar em todas as linhas.")
+    parser.add_argument('--format', choices=['csv', 'ndjson'], help="Força o formato (padrão: pela extensão).")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"ERRO: arquivo '{args.path}' não encontrado.")
+        return
+
+    stats = import_history_file(args.path, args.number, args.format)
+    print(f"Linhas lidas: {stats['read']} | válidas: refeições {stats['food_entries']}, pesagens {stats['weight_entries']} "
+          f"| ignoradas: {stats['skipped']} | inválidas: {stats['invalid']}")
+    print(f"Inseridas: {stats['foods_inserted']} refeições, {stats['weights_inserted']} pesagens (duplicatas descartadas).")
+    if stats['archived_rejected']:
+        print(f"  Aviso: {stats['archived_rejected']} linha(s) rejeitada(s) por serem de meses já arquivados; "
+              f"restaure o arquivo do mês antes de importá-las.")
+    for error in stats['errors']:
+        print(f"  Aviso: {error}")
+
+
+if __name__ == '__main__':
+    main()
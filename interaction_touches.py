@@ -0,0 +1,153 @@
+# interaction_touches.py
+"""
+Write-behind para users.last_interaction_date.
+
+Toda mensagem recebida "toca" o usuário, mas a data só muda uma vez por dia. O tracker guarda em memória quais
+usuários já foram tocados hoje neste processo: toques repetidos não fazem nada, e os toques novos são gravados
+em lote por uma thread, com um único UPDATE ... FROM (VALUES ...) a cada TOUCH_FLUSH_INTERVAL segundos.
+Na saída do processo (atexit) o que estiver pendente é gravado.
+
+Com vários workers cada processo tem o seu conjunto; no pior caso cada worker grava o usuário uma vez por dia,
+e o UPDATE ignora linhas que já estão com a data certa (não gera versões novas da linha).
+"""
+import atexit
+import os
+import threading
+from datetime import date
+
+from psycopg2.extras import execute_values
+
+TOUCH_FLUSH_INTERVAL = float(os.getenv('TOUCH_FLUSH_INTERVAL_SECONDS', '5'))
+TOUCH_FLUSH_PAGE_SIZE = 500
+
+
+def flush_touches(touches):
+    """
+    Grava [((shard, user_id), data), ...] com um único UPDATE em lote por shard.
+    Só avança a data, nunca volta.
+    """
+    from database import get_db_connection, is_sqlite
+
+    by_shard = {}
+    for (shard, user_id), day in touches:
+        by_shard.setdefault(shard, []).append((user_id, day))
+    for shard, rows in by_shard.items():
+        conn = get_db_connection('write', shard=shard)
+        try:
+            cursor = conn.cursor()
+            if is_sqlite():
+                cursor.executemany(
+                    "UPDATE users SET last_interaction_date = %s "
+                    "WHERE id = %s AND (last_interaction_date IS NULL OR last_interaction_date < %s)",
+                    [(day, user_id, day) for user_id, day in rows]
+                )
+                conn.commit()
+                cursor.close()
+                continue
+            execute_values(
+                cursor,
+                "UPDATE users AS u SET last_interaction_date = v.day "
+                "FROM (VALUES %s) AS v(id, day) "
+                "WHERE u.id = v.id AND (u.last_interaction_date IS NULL OR u.last_interaction_date < v.day)",
+                rows,
+                template="(%s, %s::date)",
+                page_size=TOUCH_FLUSH_PAGE_SIZE,
+            )
+            conn.commit()
+            cursor.close()
+        finally:
+            conn.close()
+
+
+class InteractionTouchTracker:
+    """Conjunto de usuários já tocados hoje + fila de toques ainda não gravados, com thread de flush periódico."""
+
+    def __init__(self, flush_fn=flush_touches, interval=TOUCH_FLUSH_INTERVAL):
+        self.flush_fn = flush_fn
+        self.interval = interval
+        self._day = None
+        self._touched = set()  # chaves (shard, user_id) já gravadas ou na fila para self._day
+        self._aliases = {}     # apelido (ex.: whatsapp_number) -> chave, também só de self._day
+        self._pending = {}     # (shard, user_id) -> data a gravar
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+        self._pid = None
+
+    def key_for_today(self, alias):
+        """Chave registrada hoje para o apelido (ver touch), ou None. Zera junto com o conjunto do dia."""
+        with self._cond:
+            return self._aliases.get(alias) if self._day == date.today() else None
+
+    def touch(self, key, alias=None):
+        """
+        Marca o usuário como ativo hoje. Retorna True se o toque é novo (e foi para a fila).
+        Com alias, guarda também alias -> key para quem chama não precisar descobrir a chave de novo hoje.
+        """
+        today = date.today()
+        with self._cond:
+            if self._day != today:
+                self._day = today
+                self._touched = set()
+                self._aliases = {}
+            if alias is not None:
+                self._aliases[alias] = key
+            if key in self._touched:
+                return False
+            self._touched.add(key)
+            self._pending[key] = today
+            self._ensure_thread()
+        return True
+
+    def pending_date(self, key):
+        """Data ainda não gravada no banco para o usuário (ou None)."""
+        with self._cond:
+            return self._pending.get(key)
+
+    def _ensure_thread(self):
+        # Chamado com o lock. Depois de um fork a thread do processo pai não existe aqui: sobe outra.
+        if self._thread is not None and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._stopping = False
+        self._thread = threading.Thread(target=self._run, name='interaction-touches', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def flush(self):
+        """Grava os toques pendentes. Em caso de erro eles voltam para a fila e entram no próximo flush."""
+        with self._cond:
+            if not self._pending:
+                return 0
+            batch, self._pending = self._pending, {}
+        try:
+            self.flush_fn(list(batch.items()))
+        except Exception as e:
+            print(f"ERRO ao gravar {len(batch)} toque(s) de last_interaction_date, tentando de novo depois: {e}")
+            with self._cond:
+                for key, day in batch.items():
+                    if key not in self._pending or self._pending[key] < day:
+                        self._pending[key] = day
+            return 0
+        print(f"DEBUG DB: {len(batch)} toque(s) de last_interaction_date gravados em lote.")
+        return len(batch)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopping:
+                    self._cond.wait(self.interval)
+                stopping = self._stopping
+            self.flush()
+            if stopping:
+                return
+
+    def stop(self, timeout=10.0):
+        """Encerra a thread garantindo um último flush."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None and thread.is_alive() and thread is not threading.current_thread():
+            thread.join(timeout)
+        self.flush()
@@ -0,0 +1,256 @@
+# move_user_shard.py
+"""
+Move um usuário (e todo o histórico dele) para outro shard sem parar o bot.
+
+Passos:
+  1. Marca o usuário como "em migração" em shard_overrides (banco diretório) e espera os workers recarregarem
+     o cache de overrides (SHARD_OVERRIDE_REFRESH_SECONDS) e as requisições que já tinham resolvido o shard
+     antigo terminarem (REQUEST_BUDGET_SECONDS). A partir daí as requisições desse usuário recebem
+     UserShardMoving e o bot pede para ele repetir em alguns segundos; os demais usuários seguem normalmente.
+  2. Lê tudo do shard de origem num snapshot (REPEATABLE READ) e grava no destino numa única transação.
+     Os ids mudam (cada shard tem as suas sequências); user_id é remapeado.
+     Se o destino já arquivou algum mês em que o usuário tem entradas, a migração é recusada
+     (ArchivedMonthConflict): recriar a partição desse mês destruiria o arquivo no próximo arquivamento.
+  3. Trava a linha do usuário na origem e confere que o conteúdo de cada tabela ainda é o do snapshot (um hash
+     das linhas, então atualizações como set_goal ou set_user_state também contam). Se uma gravação atrasada
+     entrou na origem depois da cópia, a migração é desfeita (a cópia no destino é apagada e
+     o usuário volta para a origem) em vez de perder essa gravação.
+  4. Ainda com a trava, aponta o override para o destino (ou apaga o override, se o destino é o shard natural
+     do anel) e apaga os dados do shard de origem.
+
+Se algo falhar antes do passo 4, a marcação é desfeita e o usuário continua no shard de origem.
+
+Uso:
+    python move_user_shard.py whatsapp:+5511999999999 2
+"""
+import argparse
+import hashlib
+import time
+
+import psycopg2
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import (get_db_connection, init_db, locate_user_shard, ring_shard_for, SHARD_DATABASE_URLS,
+                      SHARD_OVERRIDE_REFRESH_SECONDS)
+from resilience import REQUEST_BUDGET_SECONDS
+from partitions import PARTITIONED_TABLES, archived_before, ensure_partitions, lock_partition_maintenance
+
+# Tabelas com dados do usuário, na ordem de inserção (as de entradas antes dos resumos)
+USER_DATA_TABLES = ['food_entries', 'exercise_entries', 'weight_entries', 'goals', 'reminders',
+                    'daily_rollups', 'weight_trends', 'user_recent_foods', 'user_state']
+# Tabelas cujo 'id' vem de uma sequência local do shard e não é copiado
+TABLES_WITH_LOCAL_ID = {'food_entries', 'exercise_entries', 'weight_entries', 'goals', 'reminders'}
+
+
+def _table_columns(cursor, table):
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s ORDER BY ordinal_position",
+        (table,)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+
+def _set_override(whatsapp_number, shard_index, moving_to):
+    conn = get_db_connection('write')  # sem chave de shard: banco diretório
+    try:
+        cursor = conn.cursor()
+        if moving_to is None and shard_index == ring_shard_for(whatsapp_number):
+            cursor.execute("DELETE FROM shard_overrides WHERE whatsapp_number = %s", (whatsapp_number,))
+        else:
+            cursor.execute(
+                "INSERT INTO shard_overrides (whatsapp_number, shard_index, moving_to, updated_at) "
+                "VALUES (%s, %s, %s, NOW()) ON CONFLICT (whatsapp_number) DO UPDATE SET "
+                "shard_index = EXCLUDED.shard_index, moving_to = EXCLUDED.moving_to, updated_at = NOW()",
+                (whatsapp_number, shard_index, moving_to)
+            )
+        conn.commit()
+        cursor.close()
+    finally:
+        conn.close()
+
+
+def _table_checksums(cursor, user_id):
+    """{tabela: md5 das linhas do usuário}, independente da ordem em que o banco devolve as linhas."""
+    checksums = {}
+    for table in USER_DATA_TABLES:
+        cursor.execute(f"SELECT * FROM {table} WHERE user_id = %s", (user_id,))
+        digest = hashlib.md5()
+        for row_repr in sorted(repr(tuple(row)) for row in cursor.fetchall()):
+            digest.update(row_repr.encode('utf-8'))
+        checksums[table] = digest.hexdigest()
+    return checksums
+
+
+def read_user_data(shard, whatsapp_number):
+    """
+    Snapshot consistente de todas as linhas do usuário no shard, com o hash de cada tabela tirado no mesmo
+    snapshot. Retorna None se ele não existir lá.
+    """
+    conn = get_db_connection('write', shard=shard)
+    try:
+        conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_REPEATABLE_READ, readonly=True)
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, last_interaction_date FROM users WHERE whatsapp_number = %s", (whatsapp_number,))
+        user = cursor.fetchone()
+        if user is None:
+            return None
+        data = {'last_interaction_date': user[1], 'tables': {}}
+        for table in USER_DATA_TABLES:
+            columns = [col for col in _table_columns(cursor, table)
+                       if col != 'user_id' and not (col == 'id' and table in TABLES_WITH_LOCAL_ID)]
+            cursor.execute(f"SELECT {', '.join(columns)} FROM {table} WHERE user_id = %s", (user[0],))
+            data['tables'][table] = (columns, cursor.fetchall())
+        data['checksums'] = _table_checksums(cursor, user[0])
+        cursor.close()
+        return data
+    finally:
+        conn.rollback()
+        conn.set_session(isolation_level=psycopg2.extensions.ISOLATION_LEVEL_DEFAULT, readonly=False)
+        conn.close()
+
+
+def _delete_user(cursor, user_id):
+    for table in reversed(USER_DATA_TABLES):
+        cursor.execute(f"DELETE FROM {table} WHERE user_id = %s", (user_id,))
+    cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+
+
+class ArchivedMonthConflict(Exception):
+    """O usuário tem entradas de meses que o shard de destino já arquivou; a migração não é feita."""
+
+
+def write_user_data(shard, whatsapp_number, data):
+    """Grava o snapshot no shard de destino (substituindo restos de uma migração anterior). Uma transação."""
+    conn = get_db_connection('write', shard=shard)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id FROM users WHERE whatsapp_number = %s", (whatsapp_number,))
+        leftover = cursor.fetchone()
+        if leftover:
+            _delete_user(cursor, leftover[0])
+        cursor.execute(
+            "INSERT INTO users (whatsapp_number, last_interaction_date) VALUES (%s, %s) RETURNING id",
+            (whatsapp_number, data['last_interaction_date'])
+        )
+        user_id = cursor.fetchone()[0]
+        copied = 0
+        for table in USER_DATA_TABLES:
+            columns, rows = data['tables'][table]
+            if not rows:
+                continue
+            if table in PARTITIONED_TABLES:
+                lock_partition_maintenance(cursor)  # não cria partição ao mesmo tempo que o init_db/manutenção
+                oldest = min(row[columns.index('entry_date')] for row in rows)
+                floor_date = archived_before(cursor)
+                if floor_date and oldest < floor_date:
+                    # Recriar a partição de um mês arquivado faria o próximo arquivamento colidir com o arquivo antigo
+                    raise ArchivedMonthConflict(
+                        f"{table} tem linhas de {oldest}, mas o shard {shard} já arquivou os meses antes de {floor_date}."
+                    )
+                ensure_partitions(cursor, table, start=oldest)
+            execute_values(
+                cursor,
+                f"INSERT INTO {table} (user_id, {', '.join(columns)}) VALUES %s",
+                [(user_id,) + tuple(row) for row in rows],
+                page_size=1000,
+            )
+            copied += len(rows)
+        conn.commit()
+        return copied
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+class LateWriteDetected(Exception):
+    """O shard de origem recebeu gravações depois do snapshot copiado; os dados de lá não foram apagados."""
+
+
+def delete_user_data(shard, whatsapp_number, expected_checksums=None, before_delete=None):
+    """
+    Apaga o usuário do shard. Com expected_checksums (os de read_user_data), confere antes que nada mudou desde o
+    snapshot: o FOR UPDATE na linha de users espera as transações que ainda gravam entradas dele (as chaves
+    estrangeiras seguram um KEY SHARE nessa linha) e bloqueia novas até o fim. before_delete roda depois da
+    conferência, ainda com a trava.
+    """
+    conn = get_db_connection('write', shard=shard)
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT id FROM users WHERE whatsapp_number = %s FOR UPDATE", (whatsapp_number,))
+        user = cursor.fetchone()
+        if user and expected_checksums is not None:
+            found = _table_checksums(cursor, user[0])
+            changed = [table for table in USER_DATA_TABLES if found[table] != expected_checksums[table]]
+            if changed:
+                raise LateWriteDetected(f"tabelas alteradas: {', '.join(changed)}")
+        if before_delete:
+            before_delete()
+        if user:
+            _delete_user(cursor, user[0])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def move_user(whatsapp_number, target_shard, settle_seconds=None):
+    if not 0 <= target_shard < len(SHARD_DATABASE_URLS):
+        raise ValueError(f"Shard {target_shard} não existe (há {len(SHARD_DATABASE_URLS)} configurados).")
+    source_shard, moving_to = locate_user_shard(whatsapp_number)
+    if moving_to is not None:
+        raise RuntimeError(f"{whatsapp_number} já está em migração para o shard {moving_to}.")
+    if source_shard == target_shard:
+        print(f"{whatsapp_number} já está no shard {target_shard}. Nada a fazer.")
+        return 0
+
+    if settle_seconds is None:
+        # Recarga dos overrides + a requisição mais longa que pode ter resolvido o shard antigo antes da marcação
+        settle_seconds = SHARD_OVERRIDE_REFRESH_SECONDS + REQUEST_BUDGET_SECONDS + 1
+    _set_override(whatsapp_number, source_shard, target_shard)
+    print(f"{whatsapp_number} marcado em migração ({source_shard} -> {target_shard}); aguardando {settle_seconds:.0f}s...")
+    time.sleep(settle_seconds)
+    try:
+        data = read_user_data(source_shard, whatsapp_number)
+        copied = write_user_data(target_shard, whatsapp_number, data) if data else 0
+    except Exception:
+        _set_override(whatsapp_number, source_shard, None)
+        raise
+    switch_to_target = lambda: _set_override(whatsapp_number, target_shard, None)
+    if not data:
+        switch_to_target()
+    else:
+        try:
+            delete_user_data(source_shard, whatsapp_number, data['checksums'], before_delete=switch_to_target)
+        except LateWriteDetected as e:
+            delete_user_data(target_shard, whatsapp_number)
+            _set_override(whatsapp_number, source_shard, None)
+            print(f"ERRO: o shard {source_shard} recebeu gravações de {whatsapp_number} depois da cópia ({e}). "
+                  f"Migração desfeita; o usuário continua no shard {source_shard}. Tente de novo.")
+            raise
+    print(f"{whatsapp_number} movido para o shard {target_shard}: {copied} registros copiados.")
+    return copied
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move um usuário para outro shard.")
+    parser.add_argument('number', help="Número do WhatsApp (ex.: whatsapp:+5511999999999).")
+    parser.add_argument('target_shard', type=int, help="Índice do shard de destino (posição em SHARD_DATABASE_URLS).")
+    parser.add_argument('--settle-seconds', type=float, help="Espera após marcar a migração (padrão: refresh dos overrides + orçamento da requisição + 1s).")
+    args = parser.parse_args()
+
+    init_db()
+    move_user(args.number, args.target_shard, args.settle_seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,267 @@
+# outbound_sender.py
+"""
+Envio de mensagens com limite de taxa, agrupamento por destinatário e filas de prioridade.
+
+- Token bucket COMPARTILHADO entre workers: guardado no PostgreSQL (tabela outbound_rate_limit)
+  ou, localmente, num arquivo protegido por fcntl.flock.
+- Mensagens para o mesmo destinatário dentro de uma janela curta viram UMA mensagem só.
+- Duas filas: respostas interativas (PRIORITY_INTERACTIVE) sempre passam na frente do tráfego em massa
+  de lembretes/broadcasts (PRIORITY_BULK).
+
+Configuração (variáveis de ambiente):
+    OUTBOUND_RATE_PER_SECOND   mensagens por segundo por número remetente (padrão 20)
+    OUTBOUND_BURST             capacidade do bucket (padrão = taxa)
+    OUTBOUND_COALESCE_MS       janela de agrupamento por destinatário, em ms (padrão 400)
+    OUTBOUND_RATE_BACKEND      'postgres' ou 'file' (padrão: postgres se DATABASE_URL existir)
+    OUTBOUND_RATE_FILE         arquivo do bucket local (padrão /tmp/outbound_rate_limit.json)
+"""
+import fcntl
+import json
+import os
+import threading
+import time
+
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BULK = 1
+
+MAX_BODY_LENGTH = 1600  # Limite de caracteres do corpo de mensagem na Twilio
+COALESCE_SEPARATOR = "\n\n"
+
+RATE_PER_SECOND = float(os.getenv('OUTBOUND_RATE_PER_SECOND', '20'))
+BURST = float(os.getenv('OUTBOUND_BURST', str(RATE_PER_SECOND)))
+COALESCE_WINDOW = float(os.getenv('OUTBOUND_COALESCE_MS', '400')) / 1000.0
+RATE_FILE = os.getenv('OUTBOUND_RATE_FILE', '/tmp/outbound_rate_limit.json')
+
+
+class PostgresTokenBucket:
+    """
+    Token bucket numa linha do PostgreSQL, travada com SELECT ... FOR UPDATE a cada retirada.
+    Cada thread que retira tokens (na prática só a do OutboundScheduler) fica com uma conexão do pool para si,
+    em vez de pegar e devolver uma a cada mensagem; se ela cair, a próxima retirada pega outra.
+    """
+
+    def __init__(self, bucket_name, rate, capacity):
+        self.bucket_name = bucket_name
+        self.rate = rate
+        self.capacity = capacity
+        self._local = threading.local()
+
+    def _connection(self):
+        from database import get_db_connection
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or conn.closed:
+            conn = self._local.conn = get_db_connection()
+        return conn
+
+    def _discard_connection(self):
+        conn, self._local.conn = getattr(self._local, 'conn', None), None
+        if conn is not None:
+            try:
+                conn.close()
+            except Exception:
+                pass
+
+    def try_acquire(self):
+        """Tenta retirar um token. Retorna 0 se conseguiu, senão quantos segundos esperar."""
+        conn = self._connection()
+        try:
+            cursor = conn.cursor()
+            try:
+                cursor.execute(
+                    "INSERT INTO outbound_rate_limit (bucket_name, tokens, updated_at) VALUES (%s, %s, clock_timestamp()) "
+                    "ON CONFLICT (bucket_name) DO NOTHING",
+                    (self.bucket_name, self.capacity)
+                )
+                cursor.execute(
+                    "SELECT tokens, EXTRACT(EPOCH FROM clock_timestamp() - updated_at) FROM outbound_rate_limit "
+                    "WHERE bucket_name = %s FOR UPDATE",
+                    (self.bucket_name,)
+                )
+                tokens, elapsed = cursor.fetchone()
+                tokens = min(self.capacity, tokens + max(0.0, float(elapsed)) * self.rate)
+                wait = 0.0
+                if tokens >= 1.0:
+                    tokens -= 1.0
+                else:
+                    wait = (1.0 - tokens) / self.rate
+                cursor.execute(
+                    "UPDATE outbound_rate_limit SET tokens = %s, updated_at = clock_timestamp() WHERE bucket_name = %s",
+                    (tokens, self.bucket_name)
+                )
+                conn.commit()
+                return wait
+            finally:
+                cursor.close()
+        except Exception:
+            # Devolve ao pool (que desfaz a transação ou descarta a conexão quebrada) e recomeça na próxima
+            self._discard_connection()
+            raise
+
+    def close(self):
+        self._discard_connection()
+
+
+class FileTokenBucket:
+    """Token bucket num arquivo local, compartilhado entre processos da mesma máquina via flock."""
+
+    def __init__(self, bucket_name, rate, capacity, path=RATE_FILE):
+        self.bucket_name = bucket_name
+        self.rate = rate
+        self.capacity = capacity
+        self.path = path
+
+    def try_acquire(self):
+        with open(self.path, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                raw = f.read()
+                state = json.loads(raw) if raw.strip() else {}
+                now = time.time()
+                bucket = state.get(self.bucket_name, {'tokens': self.capacity, 'updated_at': now})
+                tokens = min(self.capacity, bucket['tokens'] + max(0.0, now - bucket['updated_at']) * self.rate)
+                wait = 0.0
+                if tokens >= 1.0:
+                    tokens -= 1.0
+                else:
+                    wait = (1.0 - tokens) / self.rate
+                state[self.bucket_name] = {'tokens': tokens, 'updated_at': now}
+                f.seek(0)
+                f.truncate()
+                f.write(json.dumps(state))
+                f.flush()
+                return wait
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def make_token_bucket(bucket_name):
+    database_url = os.getenv('DATABASE_URL') or ''
+    backend = os.getenv('OUTBOUND_RATE_BACKEND') or ('postgres' if database_url else 'file')
+    # Com SQLite (um nó só) o arquivo com flock já é compartilhado por todos os processos
+    if backend == 'postgres' and not database_url.startswith('sqlite:'):
+        return PostgresTokenBucket(bucket_name, RATE_PER_SECOND, BURST)
+    return FileTokenBucket(bucket_name, RATE_PER_SECOND, BURST)
+
+
+class _PendingMessage:
+    __slots__ = ('to_number', 'parts', 'priority', 'ready_at', 'seq')
+
+    def __init__(self, to_number, body, priority, ready_at, seq):
+        self.to_number = to_number
+        self.parts = [body]
+        self.priority = priority
+        self.ready_at = ready_at
+        self.seq = seq
+
+    @property
+    def body(self):
+        return COALESCE_SEPARATOR.join(self.parts)
+
+    def can_absorb(self, body):
+        return len(self.body) + len(COALESCE_SEPARATOR) + len(body) <= MAX_BODY_LENGTH
+
+
+class OutboundScheduler:
+    """
+    Fila de saída com uma thread de envio por processo.
+    enqueue() nunca bloqueia; a thread escolhe a próxima mensagem pronta pela prioridade e respeita o token bucket.
+    """
+
+    def __init__(self, deliver_fn, token_bucket, coalesce_window=COALESCE_WINDOW):
+        self.deliver_fn = deliver_fn
+        self.token_bucket = token_bucket
+        self.coalesce_window = coalesce_window
+        self._pending = {}  # destinatário -> lista de _PendingMessage, em ordem de chegada
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='outbound-sender', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, to_number, body, priority=PRIORITY_INTERACTIVE):
+        with self._cond:
+            queue = self._pending.setdefault(to_number, [])
+            last = queue[-1] if queue else None
+            if last is not None and last.can_absorb(body):
+                # Agrupa com a mensagem ainda não enviada; uma resposta interativa "promove" a mensagem toda
+                last.parts.append(body)
+                if priority < last.priority:
+                    last.priority = priority
+            else:
+                self._seq += 1
+                queue.append(_PendingMessage(to_number, body, priority, time.monotonic() + self.coalesce_window, self._seq))
+            self._cond.notify()
+
+    def _next_ready(self, now):
+        """Escolhe a primeira mensagem de cada destinatário (preserva a ordem) com menor (prioridade, chegada)."""
+        best = None
+        next_ready_at = None
+        for queue in self._pending.values():
+            head = queue[0]
+            if head.ready_at <= now:
+                if best is None or (head.priority, head.seq) < (best.priority, best.seq):
+                    best = head
+            elif next_ready_at is None or head.ready_at < next_ready_at:
+                next_ready_at = head.ready_at
+        return best, next_ready_at
+
+    def _pop(self, message):
+        queue = self._pending[message.to_number]
+        queue.pop(0)
+        if not queue:
+            del self._pending[message.to_number]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.monotonic()
+                    message, next_ready_at = self._next_ready(now)
+                    if message is not None:
+                        self._pop(message)
+                        break
+                    if self._stopping and not self._pending:
+                        # A conexão do bucket é da thread de envio, então é ela quem a devolve
+                        close_bucket = getattr(self.token_bucket, 'close', None)
+                        if close_bucket is not None:
+                            close_bucket()
+                        return
+                    timeout = None if next_ready_at is None else max(0.0, next_ready_at - now)
+                    if self._stopping:
+                        timeout = 0.0 if timeout is None else min(timeout, 0.05)
+                    self._cond.wait(timeout)
+
+            self._wait_for_token()
+            try:
+                self.deliver_fn(message.to_number, message.body)
+            except Exception as e:
+                print(f"ERRO CRÍTICO AO ENVIAR MENSAGEM para {message.to_number}: {e}")
+
+    def _wait_for_token(self):
+        while True:
+            try:
+                wait = self.token_bucket.try_acquire()
+            except Exception as e:
+                # Se o bucket compartilhado estiver indisponível, não trava o envio: segue sem limite
+                print(f"ERRO no token bucket de envio, enviando sem limite: {e}")
+                return
+            if wait <= 0:
+                return
+            time.sleep(wait)
+
+    def stop(self, timeout=10.0):
+        """Envia tudo o que estiver pendente (sem esperar a janela de agrupamento) e encerra a thread."""
+        with self._cond:
+            self._stopping = True
+            for queue in self._pending.values():
+                for message in queue:
+                    message.ready_at = 0.0
+            self._cond.notify()
+        if self._thread is not None:
+            self._thread.join(timeout)
@@ -0,0 +1,294 @@
+# partitions.py
+"""
+Particionamento mensal (RANGE em entry_date) de food_entries, exercise_entries e weight_entries.
+
+- init_db() usa prepare_legacy_table/finish_legacy_migration para converter tabelas antigas (heap) em
+  tabelas particionadas, e ensure_partitions para manter partições dos próximos meses já criadas.
+- archive_old_partitions() exporta partições antigas para arquivos .csv.gz, faz DETACH e remove a partição.
+  Cada mês arquivado fica registrado em archived_partitions; o histórico agregado continua disponível em
+  daily_rollups, porque o backfill (backfill_daily_rollups.py) nunca recalcula dias de meses arquivados.
+- Migração, criação e arquivamento de partições seguram o mesmo advisory lock (lock_partition_maintenance),
+  então vários workers subindo juntos ou o job rodando durante um deploy não disputam o mesmo DDL.
+
+As partições dos próximos meses precisam ser criadas antes de o mês começar, senão as linhas novas caem na
+partição DEFAULT. Em produção rode o processo 'clock' do Procfile (python partitions.py schedule), que executa o
+maintain ao subir e depois todo dia às PARTITION_MAINTENANCE_HOUR horas.
+
+Uso:
+    python partitions.py maintain                       # cria as partições dos próximos meses
+    python partitions.py schedule                       # maintain agora e depois uma vez por dia
+    python partitions.py archive --keep-months 24 --dir archive/
+"""
+import argparse
+import gzip
+import os
+import re
+from datetime import date
+
+PARTITIONED_TABLES = ('food_entries', 'exercise_entries', 'weight_entries')
+MONTHS_AHEAD = 3
+PARTITION_MAINTENANCE_HOUR = int(os.getenv('PARTITION_MAINTENANCE_HOUR', '3'))
+# Chave do pg_advisory_xact_lock que serializa o DDL das partições (e o init do schema) entre processos
+PARTITION_LOCK_KEY = 7340291
+PARTITION_NAME_RE = re.compile(r'_y(\d{4})m(\d{2})$')
+
+
+def _add_months(month_start, months):
+    total = month_start.year * 12 + (month_start.month - 1) + months
+    return date(total // 12, total % 12 + 1, 1)
+
+
+def _partition_name(table, month_start):
+    return f"{table}_y{month_start.year:04d}m{month_start.month:02d}"
+
+
+def lock_partition_maintenance(cursor):
+    """Segura, até o fim da transação atual, o lock que serializa migração/criação/arquivamento de partições."""
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (PARTITION_LOCK_KEY,))
+
+
+def archived_before(cursor):
+    """Primeiro dia depois do mês arquivado mais recente (None se nada foi arquivado)."""
+    cursor.execute("SELECT MAX(month_start) FROM archived_partitions")
+    latest = cursor.fetchone()[0]
+    return _add_months(latest, 1) if latest else None
+
+
+def _relkind(cursor, relname):
+    cursor.execute(
+        "SELECT c.relkind FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace "
+        "WHERE c.relname = %s AND n.nspname = current_schema()",
+        (relname,)
+    )
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def prepare_legacy_table(cursor, table):
+    """
+    Se 'table' ainda é uma tabela comum (não particionada), renomeia para '<table>_legacy' para que
+    o CREATE TABLE particionado possa ser executado em seguida. Retorna True se houve renomeação.
+    """
+    if _relkind(cursor, table) != 'r':
+        return False
+    print(f"DEBUG PARTITIONS: convertendo '{table}' para tabela particionada por mês.")
+    # A sequência do SERIAL antigo é reaproveitada pela tabela nova; desvincula para não sumir no DROP
+    cursor.execute(f"ALTER SEQUENCE IF EXISTS {table}_id_seq OWNED BY NONE")
+    cursor.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+    cursor.execute(f"ALTER TABLE {table}_legacy RENAME CONSTRAINT {table}_pkey TO {table}_legacy_pkey")
+    return True
+
+
+def finish_legacy_migration(cursor, table):
+    """Copia as linhas de '<table>_legacy' para a tabela particionada recém-criada e remove a antiga."""
+    legacy = f"{table}_legacy"
+    if _relkind(cursor, legacy) is None:
+        return 0
+
+    cursor.execute(f"SELECT MIN(entry_date) FROM {legacy}")
+    oldest = cursor.fetchone()[0]
+    ensure_partitions(cursor, table, start=oldest)
+
+    # Copia só as colunas que existem nas duas tabelas (a nova pode ter colunas extras com DEFAULT)
+    cursor.execute(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = %s "
+        "AND column_name IN (SELECT column_name FROM information_schema.columns "
+        "                    WHERE table_schema = current_schema() AND table_name = %s) "
+        "ORDER BY ordinal_position",
+        (table, legacy)
+    )
+    columns = [row[0] for row in cursor.fetchall()]
+    select_list = ", ".join("COALESCE(entry_date, CURRENT_DATE)" if col == 'entry_date' else col for col in columns)
+    cursor.execute(f"INSERT INTO {table} ({', '.join(columns)}) SELECT {select_list} FROM {legacy}")
+    copied = cursor.rowcount
+    cursor.execute(f"DROP TABLE {legacy}")
+    cursor.execute(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id")
+    print(f"DEBUG PARTITIONS: {copied} linhas migradas de '{legacy}' para '{table}'.")
+    return copied
+
+
+def ensure_partitions(cursor, table, months_ahead=MONTHS_AHEAD, start=None):
+    """
+    Garante uma partição por mês desde 'start' (padrão: mês atual) até 'months_ahead' meses à frente,
+    além da partição DEFAULT que recebe qualquer data fora das faixas criadas.
+    """
+    this_month = date.today().replace(day=1)
+    first_month = (start or this_month).replace(day=1)
+    if first_month > this_month:
+        first_month = this_month
+    last_month = _add_months(this_month, months_ahead)
+
+    cursor.execute(f"CREATE TABLE IF NOT EXISTS {table}_default PARTITION OF {table} DEFAULT")
+
+    created = 0
+    month_start = first_month
+    while month_start <= last_month:
+        name = _partition_name(table, month_start)
+        if _relkind(cursor, name) is None:
+            _create_month_partition(cursor, table, name, month_start, _add_months(month_start, 1))
+            created += 1
+        month_start = _add_months(month_start, 1)
+    return created
+
+
+def _create_month_partition(cursor, table, name, lower, upper):
+    default = f"{table}_default"
+    cursor.execute(
+        f"SELECT EXISTS (SELECT 1 FROM {default} WHERE entry_date >= %s AND entry_date < %s)",
+        (lower, upper)
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute(
+            f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+            (lower, upper)
+        )
+        return
+
+    # Linhas dessa faixa caíram na DEFAULT (o job atrasou): move-as para a partição nova
+    print(f"DEBUG PARTITIONS: movendo linhas de '{default}' para a nova partição '{name}'.")
+    cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {default}")
+    cursor.execute(
+        f"CREATE TABLE {name} PARTITION OF {table} FOR VALUES FROM (%s) TO (%s)",
+        (lower, upper)
+    )
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {default} WHERE entry_date >= %s AND entry_date < %s RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved",
+        (lower, upper)
+    )
+    cursor.execute(f"ALTER TABLE {table} ATTACH PARTITION {default} DEFAULT")
+
+
+def list_month_partitions(cursor, table):
+    """Retorna [(nome_da_partição, primeiro_dia_do_mês)] das partições mensais de 'table', em ordem."""
+    cursor.execute(
+        "SELECT c.relname FROM pg_inherits i "
+        "JOIN pg_class c ON c.oid = i.inhrelid JOIN pg_class p ON p.oid = i.inhparent "
+        "WHERE p.relname = %s",
+        (table,)
+    )
+    partitions = []
+    for (name,) in cursor.fetchall():
+        match = PARTITION_NAME_RE.search(name)
+        if match:
+            partitions.append((name, date(int(match.group(1)), int(match.group(2)), 1)))
+    return sorted(partitions, key=lambda item: item[1])
+
+
+def archive_old_partitions(conn, keep_months, archive_dir):
+    """
+    Exporta para '<archive_dir>/<partição>.csv.gz' toda partição mensal mais antiga que 'keep_months',
+    depois faz DETACH e DROP. Cada partição é arquivada, registrada em archived_partitions e removida na sua
+    própria transação. Um mês que já tem arquivo ou registro em archived_partitions nunca é sobrescrito: a
+    partição fica onde está e o mês precisa ser reconciliado à mão.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    cutoff = _add_months(date.today().replace(day=1), -keep_months)
+    archived = []
+    cursor = conn.cursor()
+    for table in PARTITIONED_TABLES:
+        for name, month_start in list_month_partitions(cursor, table):
+            if month_start >= cutoff:
+                continue
+            lock_partition_maintenance(cursor)
+            path = os.path.join(archive_dir, f"{name}.csv.gz")
+            cursor.execute(
+                "SELECT archive_path FROM archived_partitions WHERE table_name = %s AND month_start = %s",
+                (table, month_start)
+            )
+            previous = cursor.fetchone()
+            if previous or os.path.exists(path):
+                conn.rollback()
+                print(f"ERRO: '{name}' já foi arquivada antes ({previous[0] if previous else path}); "
+                      f"partição mantida para não sobrescrever o arquivo existente.")
+                continue
+            tmp_path = path + ".tmp"
+            with gzip.open(tmp_path, 'wt', encoding='utf-8') as archive_file:
+                cursor.copy_expert(f"COPY {name} TO STDOUT WITH (FORMAT csv, HEADER true)", archive_file)
+            os.replace(tmp_path, path)
+            cursor.execute(f"ALTER TABLE {table} DETACH PARTITION {name}")
+            cursor.execute(f"DROP TABLE {name}")
+            cursor.execute(
+                "INSERT INTO archived_partitions (table_name, month_start, archive_path) VALUES (%s, %s, %s)",
+                (table, month_start, path)
+            )
+            conn.commit()
+            archived.append(path)
+            print(f"Partição '{name}' arquivada em '{path}'.")
+    cursor.close()
+    return archived
+
+
+def maintain_partitions(conn, months_ahead=MONTHS_AHEAD):
+    cursor = conn.cursor()
+    lock_partition_maintenance(cursor)
+    created = sum(ensure_partitions(cursor, table, months_ahead) for table in PARTITIONED_TABLES)
+    conn.commit()
+    cursor.close()
+    return created
+
+
+def maintain_all_shards():
+    from database import get_db_connection, shard_indices
+
+    for shard in shard_indices():
+        conn = get_db_connection('write', shard=shard)
+        try:
+            print(f"DEBUG PARTITIONS: shard {shard}: {maintain_partitions(conn)} partições criadas.")
+        except Exception as e:
+            print(f"ERRO na manutenção das partições do shard {shard}: {e}")
+        finally:
+            conn.close()
+
+
+def run_maintenance_schedule():
+    """Processo de longa duração: maintain ao subir e depois todo dia às PARTITION_MAINTENANCE_HOUR horas."""
+    from apscheduler.schedulers.blocking import BlockingScheduler
+
+    maintain_all_shards()
+    scheduler = BlockingScheduler()
+    scheduler.add_job(maintain_all_shards, 'cron', hour=PARTITION_MAINTENANCE_HOUR, minute=0,
+                      id='maintain_partitions', coalesce=True, misfire_grace_time=3600)
+    print(f"Manutenção de partições agendada para todo dia às {PARTITION_MAINTENANCE_HOUR:02d}:00.")
+    scheduler.start()
+
+
+def main():
+    from dotenv import load_dotenv
+    load_dotenv()
+    from database import get_db_connection, init_db, shard_indices, is_sqlite
+
+    parser = argparse.ArgumentParser(description="Manutenção das partições mensais das tabelas de entradas.")
+    sub = parser.add_subparsers(dest='command', required=True)
+    maintain = sub.add_parser('maintain', help="Cria as partições dos próximos meses.")
+    maintain.add_argument('--months-ahead', type=int, default=MONTHS_AHEAD)
+    sub.add_parser('schedule', help="Roda o maintain agora e depois todo dia (processo 'clock' do Procfile).")
+    archive = sub.add_parser('archive', help="Arquiva e remove partições antigas.")
+    archive.add_argument('--keep-months', type=int, required=True)
+    archive.add_argument('--dir', default='archive')
+    args = parser.parse_args()
+
+    if is_sqlite():
+        print("Backend SQLite: as tabelas de entradas não são particionadas, nada a fazer.")
+        return
+    init_db()
+    if args.command == 'schedule':
+        run_maintenance_schedule()
+        return
+    shards = shard_indices()
+    for shard in shards:
+        conn = get_db_connection('write', shard=shard)
+        try:
+            if args.command == 'maintain':
+                print(f"Shard {shard}: {maintain_partitions(conn, args.months_ahead)} partições criadas.")
+            else:
+                archive_dir = args.dir if len(shards) == 1 else os.path.join(args.dir, f"shard_{shard}")
+                archived = archive_old_partitions(conn, args.keep_months, archive_dir)
+                print(f"Shard {shard}: {len(archived)} partições arquivadas.")
+        finally:
+            conn.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -18,19 +18,19 @@ else:
 
 TACO_CSV_FILE = 'taco_data.csv' 
 
-def get_pg_connection():
+def get_pg_connection(dsn=None):
     print("DEBUG: Tentando conectar ao PostgreSQL...")
     try:
-        conn = psycopg2.connect(DATABASE_URL + "?sslmode=require")
+        conn = psycopg2.connect((dsn or DATABASE_URL) + "?sslmode=require")
         print("DEBUG: Conexão com PostgreSQL estabelecida.")
         return conn
     except Exception as e:
         print(f"ERRO CRÍTICO: Falha ao conectar ao PostgreSQL: {e}")
         raise 
 
-def populate_pg_taco_data():
+def populate_pg_taco_data(dsn=None):
     """Importa dados do CSV da TACO para a tabela taco_foods no PostgreSQL."""
-    conn = get_pg_connection()
+    conn = get_pg_connection(dsn)
     cursor = conn.cursor()
     
     try:
@@ -73,9 +73,9 @@ def populate_pg_taco_data():
             conn.close()
             return
 
-        insert_query = sql.SQL("INSERT INTO taco_foods (alimento, energia_kcal, proteina_g, lipidios_g, carboidrato_g) VALUES ({}, {}, {}, {}, {})").format(
+        insert_query = sql.SQL("INSERT INTO taco_foods (alimento, energia_kcal, proteina_g, lipidios_g, carboidrato_g, taco_number) VALUES ({}, {}, {}, {}, {}, {})").format(
             sql.Placeholder('alimento'), sql.Placeholder('energia_kcal'), sql.Placeholder('proteina_g'),
-            sql.Placeholder('lipidios_g'), sql.Placeholder('carboidrato_g')
+            sql.Placeholder('lipidios_g'), sql.Placeholder('carboidrato_g'), sql.Placeholder('taco_number')
         )
 
         for row_num, row in enumerate(csv_reader): 
@@ -97,6 +97,8 @@ def populate_pg_taco_data():
                 proteina_g = safe_float_convert(row.get('Proteína..g.', '0'))
                 lipidios_g = safe_float_convert(row.get('Lipídeos..g.', '0'))
                 carboidrato_g = safe_float_convert(row.get('Carboidrato..g.', '0'))
+                taco_number_raw = row.get('Número do Alimento', '').strip()
+                taco_number = int(taco_number_raw) if taco_number_raw.isdigit() else None
                 
             except Exception as e: 
                 print(f"Aviso na linha {row_num + 2} (no CSV): Erro ao processar valores: {row}. Erro: {e}. Pulando linha.")
@@ -113,7 +115,8 @@ def populate_pg_taco_data():
                         'energia_kcal': energia_kcal,
                         'proteina_g': proteina_g,
                         'lipidios_g': lipidios_g,
-                        'carboidrato_g': carboidrato_g
+                        'carboidrato_g': carboidrato_g,
+                        'taco_number': taco_number
                     })
                     imported_count_this_file += 1
                 except psycopg2.IntegrityError as e: 
@@ -145,5 +148,41 @@ def populate_pg_taco_data():
     if skipped_count_this_file > 0:
         print(f"Aviso Geral: {skipped_count_this_file} linhas foram puladas devido a erros ou duplicatas.")
 
+def populate_sqlite_taco_data():
+    """Mesma importação para o backend SQLite (DATABASE_URL=sqlite:///...), numa transação só."""
+    from database import get_db_connection, init_db
+    from taco_nutrients import _parse_value
+
+    init_db()
+    rows = []
+    with open(os.path.join(os.getcwd(), TACO_CSV_FILE), mode='r', encoding='utf-8') as file:
+        for row in csv.DictReader(file):
+            alimento = row.get('Descrição dos alimentos', '').strip()
+            if not alimento:
+                continue
+            taco_number_raw = row.get('Número do Alimento', '').strip()
+            rows.append((alimento, _parse_value(row.get('Energia..kcal.')), _parse_value(row.get('Proteína..g.')),
+                         _parse_value(row.get('Lipídeos..g.')), _parse_value(row.get('Carboidrato..g.')),
+                         int(taco_number_raw) if taco_number_raw.isdigit() else None))
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("DELETE FROM taco_foods")
+    cursor.executemany(
+        "INSERT OR IGNORE INTO taco_foods (alimento, energia_kcal, proteina_g, lipidios_g, carboidrato_g, taco_number) "
+        "VALUES (%s, %s, %s, %s, %s, %s)",
+        rows
+    )
+    conn.commit()
+    cursor.execute("SELECT COUNT(*) FROM taco_foods")
+    print(f"População de dados da TACO no SQLite concluída: {cursor.fetchone()[0]} alimentos.")
+    cursor.close()
+    conn.close()
+
 if __name__ == '__main__':
-    populate_pg_taco_data()
\ No newline at end of file
+    from database import schema_database_urls, is_sqlite
+    if is_sqlite():
+        populate_sqlite_taco_data()
+    else:
+        # A TACO é replicada em todos os bancos (diretório e cada shard), para as buscas nunca cruzarem shards
+        for target_dsn in schema_database_urls():
+            populate_pg_taco_data(target_dsn)
\ No newline at end of file
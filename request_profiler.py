@@ -0,0 +1,166 @@
+# request_profiler.py
+"""
+Profiling amostrado das requisições do webhook, para descobrir o que está quente quando o p99 sobe em produção.
+
+Uma requisição é perfilada (cProfile) quando:
+  * cai na amostra de PROFILE_SAMPLE_RATE (ex.: 0.01 = 1% das requisições; 0 = desligado, o padrão), ou
+  * traz o cabeçalho X-Profile-Signature assinado com PROFILE_ADMIN_TOKEN (gere com
+    `python request_profiler.py sign`; vale por PROFILE_SIGNATURE_MAX_AGE segundos).
+
+Só uma requisição é perfilada por vez em cada processo: as outras seguem sem profiler, o que também limita o
+custo. Desligado, o custo por requisição é uma comparação e a leitura de um cabeçalho.
+
+Cada perfil vira um arquivo .pstats em PROFILE_DIR com intenção, estado e duração no nome
+(ex.: 20261019T101500_123456--registrar_refeicao--none--842ms.pstats); só os PROFILE_MAX_FILES mais recentes
+ficam. Os arquivos abrem com pstats/snakeviz e viram flamegraph com flameprof ou gprof2dot.
+GET /admin/profiles (Authorization: Bearer PROFILE_ADMIN_TOKEN) agrega os arquivos e devolve as funções mais caras.
+
+Uso:
+    python request_profiler.py sign          # imprime o valor do cabeçalho X-Profile-Signature
+"""
+import cProfile
+import glob
+import hashlib
+import hmac
+import io
+import os
+import pstats
+import random
+import re
+import threading
+import time
+from datetime import datetime
+
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_ADMIN_TOKEN = os.getenv('PROFILE_ADMIN_TOKEN')
+PROFILE_DIR = os.getenv('PROFILE_DIR', '/tmp/webhook_profiles')
+PROFILE_MAX_FILES = int(os.getenv('PROFILE_MAX_FILES', '200'))
+PROFILE_SIGNATURE_MAX_AGE = 300
+PROFILE_HEADER = 'X-Profile-Signature'
+PROFILED_PATHS = {'/webhook'}
+
+SORT_KEYS = {'cumulative', 'tottime', 'ncalls'}
+
+_active_lock = threading.Lock()
+_state = threading.local()
+
+
+def sign_profile_header(token, timestamp=None):
+    """Valor do cabeçalho X-Profile-Signature: '<unix_ts>:<hmac-sha256(token, unix_ts)>'."""
+    timestamp = str(int(timestamp if timestamp is not None else time.time()))
+    digest = hmac.new(token.encode(), timestamp.encode(), hashlib.sha256).hexdigest()
+    return f"{timestamp}:{digest}"
+
+
+def _valid_signature(header_value):
+    if not PROFILE_ADMIN_TOKEN or not header_value or ':' not in header_value:
+        return False
+    timestamp, _ = header_value.split(':', 1)
+    if not timestamp.isdigit() or abs(time.time() - int(timestamp)) > PROFILE_SIGNATURE_MAX_AGE:
+        return False
+    return hmac.compare_digest(header_value.encode(), sign_profile_header(PROFILE_ADMIN_TOKEN, int(timestamp)).encode())
+
+
+def start_profiling(path, headers):
+    """Chamado no início da requisição. Retorna True se esta requisição passou a ser perfilada."""
+    header_value = headers.get(PROFILE_HEADER) if PROFILE_ADMIN_TOKEN else None
+    if path not in PROFILED_PATHS or (PROFILE_SAMPLE_RATE <= 0 and not header_value):
+        return False
+    if not (header_value and _valid_signature(header_value)) and random.random() >= PROFILE_SAMPLE_RATE:
+        return False
+    if not _active_lock.acquire(blocking=False):
+        return False  # outra requisição deste processo já está sendo perfilada
+    profiler = cProfile.Profile()
+    _state.profiler = profiler
+    _state.tags = {}
+    _state.started = time.perf_counter()
+    profiler.enable()
+    return True
+
+
+def tag_profile(**tags):
+    """Anota a requisição perfilada (ex.: intent, state). Sem profiling ativo, não faz nada."""
+    if getattr(_state, 'profiler', None) is not None:
+        _state.tags.update(tags)
+
+
+def _slug(value):
+    return re.sub(r'[^a-z0-9]+', '_', str(value).lower()).strip('_')[:40] or 'none'
+
+
+def finish_profiling():
+    """Chamado no fim da requisição: para o profiler, grava o .pstats e apaga os arquivos mais antigos."""
+    profiler = getattr(_state, 'profiler', None)
+    if profiler is None:
+        return None
+    profiler.disable()
+    elapsed_ms = (time.perf_counter() - _state.started) * 1000.0
+    tags = _state.tags
+    _state.profiler = None
+    _active_lock.release()
+
+    try:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        # '--' separa os campos (os slugs só têm letras, números e '_')
+        filename = (f"{datetime.now().strftime('%Y%m%dT%H%M%S_%f')}--{_slug(tags.get('intent'))}--"
+                    f"{_slug(tags.get('state'))}--{elapsed_ms:.0f}ms.pstats")
+        path = os.path.join(PROFILE_DIR, filename)
+        profiler.dump_stats(path)
+        for old_file in sorted(glob.glob(os.path.join(PROFILE_DIR, '*.pstats')))[:-PROFILE_MAX_FILES]:
+            os.remove(old_file)
+        print(f"DEBUG PROFILE: requisição perfilada em {elapsed_ms:.0f}ms, gravada em {path}")
+        return path
+    except OSError as e:
+        print(f"ERRO ao gravar o perfil da requisição: {e}")
+        return None
+
+
+def aggregate_profiles(intent=None, state=None, limit=30, sort='cumulative', max_files=None):
+    """
+    Soma os .pstats de PROFILE_DIR (opcionalmente só de uma intenção/estado) e retorna as 'limit' funções mais
+    caras: {'files': n, 'functions': [{'function', 'ncalls', 'tottime_ms', 'cumtime_ms'}, ...]}.
+    """
+    sort = sort if sort in SORT_KEYS else 'cumulative'
+    selected = []
+    for path in sorted(glob.glob(os.path.join(PROFILE_DIR, '*.pstats'))):
+        fields = os.path.basename(path)[:-len('.pstats')].split('--')
+        if len(fields) != 4:
+            continue
+        if (intent and fields[1] != _slug(intent)) or (state and fields[2] != _slug(state)):
+            continue
+        selected.append(path)
+    if max_files:
+        selected = selected[-max_files:]
+    if not selected:
+        return {'files': 0, 'functions': []}
+
+    stats = pstats.Stats(stream=io.StringIO())
+    loaded = 0
+    for path in selected:
+        try:
+            stats.add(path)
+            loaded += 1
+        except (OSError, EOFError, ValueError):
+            continue  # apagado pela rotação enquanto líamos, ou gravação incompleta
+    if not loaded:
+        return {'files': 0, 'functions': []}
+    sort_index = {'cumulative': 3, 'tottime': 2, 'ncalls': 1}[sort]
+    rows = sorted(stats.stats.items(), key=lambda item: item[1][sort_index], reverse=True)[:limit]
+    functions = []
+    for (filename, line, func_name), (_, ncalls, tottime, cumtime, _) in rows:
+        functions.append({
+            'function': f"{os.path.basename(filename)}:{line}({func_name})",
+            'ncalls': ncalls,
+            'tottime_ms': round(tottime * 1000.0, 3),
+            'cumtime_ms': round(cumtime * 1000.0, 3),
+        })
+    return {'files': loaded, 'functions': functions}
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) < 2 or sys.argv[1] != 'sign' or not PROFILE_ADMIN_TOKEN:
+        print("Uso: PROFILE_ADMIN_TOKEN=... python request_profiler.py sign")
+        sys.exit(1)
+    print(f"{PROFILE_HEADER}: {sign_profile_header(PROFILE_ADMIN_TOKEN)}")
@@ -0,0 +1,138 @@
+# resilience.py
+"""
+Orçamento de tempo por requisição e circuit breakers para as dependências externas (Wit.ai e bancos).
+
+- Deadline: o webhook abre um orçamento (REQUEST_BUDGET_SECONDS, abaixo do timeout de 15s da Twilio).
+  Cada chamada externa usa no máximo o tempo que ainda resta (time_remaining()).
+- CircuitBreaker: depois de BREAKER_FAILURE_THRESHOLD falhas seguidas a dependência fica "aberta" por
+  BREAKER_RECOVERY_SECONDS e as chamadas falham na hora, sem esperar timeout. Passado esse tempo uma chamada
+  de teste é liberada (meio-aberto): sucesso fecha o breaker, falha abre de novo.
+- render_metrics(): estado dos breakers e contadores do modo degradado no formato texto do Prometheus.
+"""
+import contextvars
+import os
+import threading
+import time
+
+REQUEST_BUDGET_SECONDS = float(os.getenv('REQUEST_BUDGET_SECONDS', '10'))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv('BREAKER_FAILURE_THRESHOLD', '5'))
+BREAKER_RECOVERY_SECONDS = float(os.getenv('BREAKER_RECOVERY_SECONDS', '30'))
+
+STATE_CLOSED = 'closed'
+STATE_HALF_OPEN = 'half_open'
+STATE_OPEN = 'open'
+_STATE_VALUES = {STATE_CLOSED: 0, STATE_HALF_OPEN: 1, STATE_OPEN: 2}
+
+_deadline = contextvars.ContextVar('request_deadline', default=None)
+
+
+class CircuitOpen(Exception):
+    """A dependência está com o breaker aberto; a chamada nem foi tentada."""
+
+
+def begin_deadline(seconds=REQUEST_BUDGET_SECONDS):
+    """Abre o orçamento de tempo da requisição atual. Retorna o token para end_deadline()."""
+    return _deadline.set(time.monotonic() + seconds)
+
+
+def end_deadline(token):
+    _deadline.reset(token)
+
+
+def time_remaining(default=None):
+    """Segundos que ainda restam no orçamento da requisição (default fora de uma requisição)."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return default
+    return max(0.0, deadline - time.monotonic())
+
+
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=BREAKER_FAILURE_THRESHOLD, recovery_seconds=BREAKER_RECOVERY_SECONDS):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.recovery_seconds = recovery_seconds
+        self.state = STATE_CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.stats = {'successes': 0, 'failures': 0, 'short_circuits': 0, 'opened': 0}
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """True se a chamada pode ser feita agora. No estado meio-aberto só uma chamada de teste passa por vez."""
+        with self._lock:
+            if self.state == STATE_OPEN and time.monotonic() - self.opened_at >= self.recovery_seconds:
+                self.state = STATE_HALF_OPEN
+                self._trial_in_flight = False
+            if self.state == STATE_CLOSED:
+                return True
+            if self.state == STATE_HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self.stats['short_circuits'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.stats['successes'] += 1
+            self.consecutive_failures = 0
+            self._trial_in_flight = False
+            if self.state != STATE_CLOSED:
+                print(f"DEBUG BREAKER: '{self.name}' fechado de novo.")
+            self.state = STATE_CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.stats['failures'] += 1
+            self.consecutive_failures += 1
+            self._trial_in_flight = False
+            if self.state == STATE_HALF_OPEN or (self.state == STATE_CLOSED and
+                                                 self.consecutive_failures >= self.failure_threshold):
+                self.state = STATE_OPEN
+                self.opened_at = time.monotonic()
+                self.stats['opened'] += 1
+                print(f"AVISO: circuit breaker '{self.name}' aberto por {self.recovery_seconds:.0f}s "
+                      f"após {self.consecutive_failures} falha(s).")
+
+
+_breakers = {}
+_breakers_lock = threading.Lock()
+_counters = {}
+_counters_lock = threading.Lock()
+
+
+def get_breaker(name):
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.setdefault(name, CircuitBreaker(name))
+    return breaker
+
+
+def increment(counter_name, amount=1):
+    """Contadores do modo degradado (ex.: nlu_local_fallback, db_load_shed), expostos em /metrics."""
+    with _counters_lock:
+        _counters[counter_name] = _counters.get(counter_name, 0) + amount
+
+
+def render_metrics():
+    """Estado dos breakers e contadores no formato texto do Prometheus."""
+    lines = [
+        "# HELP circuit_breaker_state 0=fechado, 1=meio-aberto, 2=aberto",
+        "# TYPE circuit_breaker_state gauge",
+    ]
+    with _breakers_lock:
+        breakers = sorted(_breakers.values(), key=lambda b: b.name)
+    for breaker in breakers:
+        lines.append(f'circuit_breaker_state{{name="{breaker.name}"}} {_STATE_VALUES[breaker.state]}')
+    for stat in ('successes', 'failures', 'short_circuits', 'opened'):
+        lines.append(f"# TYPE circuit_breaker_{stat}_total counter")
+        for breaker in breakers:
+            lines.append(f'circuit_breaker_{stat}_total{{name="{breaker.name}"}} {breaker.stats[stat]}')
+    with _counters_lock:
+        counters = sorted(_counters.items())
+    for counter_name, value in counters:
+        lines.append(f"# TYPE {counter_name}_total counter")
+        lines.append(f"{counter_name}_total {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,279 @@
+# sqlite_backend.py
+"""
+Backend SQLite embutido, para instalações de um nó só e para testes sem servidor.
+
+Ativado com DATABASE_URL=sqlite:///caminho/do/arquivo.db (ou sqlite:///:memory: para um banco em memória
+compartilhado pelas threads do processo). Usa WAL e uma conexão por thread, reaproveitada entre chamadas.
+
+As funções do database.py continuam escrevendo SQL no dialeto do PostgreSQL: a conexão devolvida aqui
+imita a interface do psycopg2 (cursor(), commit(), rollback(), close()) e traduz cada comando
+(%s -> ?, ILIKE, CURRENT_DATE/CURRENT_TIME/NOW() no horário local, casts ::tipo, FOR UPDATE).
+Particionamento, COPY, PREPARE, réplicas e shards não existem aqui; os pontos do código que dependem
+deles checam database.is_sqlite().
+"""
+import functools
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, time, datetime
+
+SQLITE_BUSY_TIMEOUT = float(os.getenv('SQLITE_BUSY_TIMEOUT', '5'))
+MEMORY_URI = 'file:whatsapp_health_bot?mode=memory&cache=shared'
+
+# Mesmo schema do PostgreSQL (init_db), sem partições nem sequências próprias
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        whatsapp_number TEXT UNIQUE NOT NULL,
+        last_interaction_date DATE DEFAULT CURRENT_DATE
+    )''',
+    '''CREATE TABLE IF NOT EXISTS food_entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        foods_description TEXT NOT NULL,
+        calories REAL NOT NULL,
+        carbohydrates REAL DEFAULT 0,
+        proteins REAL DEFAULT 0,
+        fats REAL DEFAULT 0,
+        entry_date DATE NOT NULL DEFAULT CURRENT_DATE,
+        entry_time TIME DEFAULT CURRENT_TIME,
+        taco_food_id INTEGER,
+        grams REAL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS weight_entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        weight REAL NOT NULL,
+        entry_date DATE NOT NULL DEFAULT CURRENT_DATE,
+        entry_time TIME DEFAULT CURRENT_TIME
+    )''',
+    '''CREATE TABLE IF NOT EXISTS exercise_entries (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        activity_name TEXT NOT NULL,
+        duration_minutes INTEGER NOT NULL,
+        calories_burned REAL NOT NULL,
+        entry_date DATE NOT NULL DEFAULT CURRENT_DATE,
+        entry_time TIME DEFAULT CURRENT_TIME
+    )''',
+    "CREATE INDEX IF NOT EXISTS food_entries_user_date_idx ON food_entries (user_id, entry_date)",
+    "CREATE INDEX IF NOT EXISTS food_entries_user_date_id_idx ON food_entries (user_id, entry_date, id)",
+    "CREATE INDEX IF NOT EXISTS weight_entries_user_date_idx ON weight_entries (user_id, entry_date)",
+    "CREATE INDEX IF NOT EXISTS exercise_entries_user_date_idx ON exercise_entries (user_id, entry_date)",
+    '''CREATE TABLE IF NOT EXISTS goals (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        goal_type TEXT NOT NULL,
+        target_value REAL NOT NULL,
+        start_date DATE DEFAULT CURRENT_DATE,
+        end_date DATE,
+        UNIQUE (user_id, goal_type)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS reminders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        reminder_text TEXT NOT NULL,
+        reminder_time TEXT NOT NULL,
+        is_active BOOLEAN DEFAULT TRUE,
+        last_sent_on DATE
+    )''',
+    '''CREATE TABLE IF NOT EXISTS taco_foods (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        alimento TEXT UNIQUE NOT NULL,
+        energia_kcal REAL,
+        proteina_g REAL,
+        lipidios_g REAL,
+        carboidrato_g REAL,
+        taco_number INTEGER
+    )''',
+    '''CREATE TABLE IF NOT EXISTS daily_rollups (
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        rollup_date DATE NOT NULL,
+        kcal_in REAL NOT NULL DEFAULT 0,
+        kcal_burned REAL NOT NULL DEFAULT 0,
+        carbohydrates REAL NOT NULL DEFAULT 0,
+        proteins REAL NOT NULL DEFAULT 0,
+        fats REAL NOT NULL DEFAULT 0,
+        food_entries_count INTEGER NOT NULL DEFAULT 0,
+        exercise_entries_count INTEGER NOT NULL DEFAULT 0,
+        last_weight REAL,
+        PRIMARY KEY (user_id, rollup_date)
+    )''',
+    '''CREATE TABLE IF NOT EXISTS weight_trends (
+        user_id INTEGER PRIMARY KEY REFERENCES users(id),
+        samples INTEGER NOT NULL DEFAULT 0,
+        latest_weight REAL,
+        smoothed_weight REAL,
+        avg_7d REAL,
+        weekly_change_kg REAL,
+        projected_goal_date DATE,
+        computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )''',
+    '''CREATE TABLE IF NOT EXISTS outbound_rate_limit (
+        bucket_name TEXT PRIMARY KEY,
+        tokens REAL NOT NULL,
+        updated_at TIMESTAMP NOT NULL
+    )''',
+    '''CREATE TABLE IF NOT EXISTS user_state (
+        user_id INTEGER PRIMARY KEY REFERENCES users(id),
+        state TEXT NOT NULL,
+        context_data TEXT
+    )''',
+    '''CREATE TABLE IF NOT EXISTS user_recent_foods (
+        user_id INTEGER NOT NULL REFERENCES users(id),
+        foods_description TEXT NOT NULL,
+        taco_food_id INTEGER,
+        grams REAL,
+        calories REAL NOT NULL,
+        carbohydrates REAL DEFAULT 0,
+        proteins REAL DEFAULT 0,
+        fats REAL DEFAULT 0,
+        times_logged INTEGER NOT NULL DEFAULT 0,
+        last_logged_on DATE NOT NULL DEFAULT CURRENT_DATE,
+        PRIMARY KEY (user_id, foods_description)
+    )''',
+]
+
+# Datas e horas trafegam como texto ISO; as colunas DATE/TIME/TIMESTAMP voltam como objetos Python, igual ao psycopg2
+sqlite3.register_adapter(date, lambda value: value.isoformat())
+sqlite3.register_adapter(time, lambda value: value.isoformat())
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(sep=' '))
+sqlite3.register_converter('DATE', lambda raw: date.fromisoformat(raw.decode()[:10]))
+sqlite3.register_converter('TIME', lambda raw: time.fromisoformat(raw.decode()))
+sqlite3.register_converter('TIMESTAMP', lambda raw: datetime.fromisoformat(raw.decode()))
+
+_SQL_REWRITES = [
+    (re.compile(r'%([s%])'), lambda match: '?' if match.group(1) == 's' else '%'),
+    (re.compile(r'\bILIKE\b', re.IGNORECASE), 'LIKE'),
+    (re.compile(r'::\w+'), ''),
+    (re.compile(r'\bCURRENT_DATE\b'), "date('now', 'localtime')"),
+    (re.compile(r'\bCURRENT_TIME\b'), "time('now', 'localtime')"),
+    (re.compile(r'\b(?:NOW|clock_timestamp)\(\)', re.IGNORECASE), "datetime('now', 'localtime')"),
+    (re.compile(r'\s+FOR UPDATE\b'), ''),
+]
+
+
+@functools.lru_cache(maxsize=512)
+def translate_sql(query):
+    """Converte um comando escrito para o psycopg2/PostgreSQL no equivalente do SQLite."""
+    for pattern, replacement in _SQL_REWRITES:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+def _sql_for_schema(statement):
+    # DEFAULT CURRENT_DATE do SQLite usa UTC; o bot trabalha no horário local, como o PostgreSQL
+    return (statement.replace("DEFAULT CURRENT_TIMESTAMP", "DEFAULT (datetime('now', 'localtime'))")
+                     .replace("DEFAULT CURRENT_DATE", "DEFAULT (date('now', 'localtime'))")
+                     .replace("DEFAULT CURRENT_TIME", "DEFAULT (time('now', 'localtime'))"))
+
+
+class SQLiteCursor:
+    """Cursor com a mesma cara do psycopg2 (aceita name= e itersize, que aqui não fazem diferença)."""
+
+    def __init__(self, connection, raw_cursor):
+        self.connection = connection
+        self._cursor = raw_cursor
+        self.itersize = 2000
+
+    def execute(self, query, params=None):
+        self._cursor.execute(translate_sql(query), tuple(params) if params is not None else ())
+        return self
+
+    def executemany(self, query, seq_of_params):
+        self._cursor.executemany(translate_sql(query), [tuple(params) for params in seq_of_params])
+        return self
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self.itersize)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """
+    Conexão da thread atual. close() só encerra a transação em aberto: a conexão sqlite3 de verdade fica
+    guardada na thread para a próxima chamada (o equivalente ao pool do PostgreSQL).
+    """
+
+    def __init__(self, raw):
+        self._raw = raw
+        self.closed = 0
+
+    def cursor(self, name=None, **kwargs):
+        return SQLiteCursor(self, self._raw.cursor())
+
+    def commit(self):
+        self._raw.commit()
+
+    def rollback(self):
+        self._raw.rollback()
+
+    def close(self):
+        if not self.closed:
+            self._raw.rollback()
+            self.closed = 1
+
+
+_local = threading.local()
+
+
+def _open(path):
+    if path == ':memory:':
+        raw = sqlite3.connect(MEMORY_URI, uri=True, timeout=SQLITE_BUSY_TIMEOUT,
+                              detect_types=sqlite3.PARSE_DECLTYPES)
+    else:
+        raw = sqlite3.connect(path, timeout=SQLITE_BUSY_TIMEOUT, detect_types=sqlite3.PARSE_DECLTYPES)
+        raw.execute("PRAGMA journal_mode=WAL")
+        raw.execute("PRAGMA synchronous=NORMAL")
+    raw.execute("PRAGMA foreign_keys=ON")
+    return raw
+
+
+def connect(path):
+    """Conexão SQLite da thread atual para 'path' (abre na primeira vez; reabre depois de um fork)."""
+    connections = getattr(_local, 'connections', None)
+    if connections is None or _local.pid != os.getpid():
+        connections = _local.connections = {}
+        _local.pid = os.getpid()
+    raw = connections.get(path)
+    if raw is None:
+        raw = connections[path] = _open(path)
+    return SQLiteConnection(raw)
+
+
+# Colunas criadas depois da tabela: bancos antigos ganham a coluna no init (SQLite não tem ADD COLUMN IF NOT EXISTS)
+ADDED_COLUMNS = [
+    ('reminders', 'last_sent_on', 'DATE'),
+]
+
+
+def init_schema(conn):
+    cursor = conn.cursor()
+    for statement in SCHEMA:
+        cursor.execute(_sql_for_schema(statement))
+    for table, column, column_type in ADDED_COLUMNS:
+        cursor.execute(f"PRAGMA table_info({table})")
+        if column not in {row[1] for row in cursor.fetchall()}:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+    conn.commit()
+    cursor.close()
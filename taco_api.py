@@ -4,68 +4,89 @@ import re
 import os
 
 # Importa a função de conexão do outro arquivo
-from database import get_db_connection
+from database import get_db_connection, db_read
+from taco_snapshot import get_snapshot
 
+def parse_food_query(query):
+    """
+    Separa a quantidade (em gramas) e o nome do alimento de uma consulta como "150g de arroz".
+    Retorna uma tupla (alimento_base, quantidade_g); a quantidade padrão é 100g.
+    """
+    alimento_base = query.strip()
+    quantidade_g = 100.0
+
+    # Tenta extrair a quantidade e o nome do alimento de forma mais robusta
+    # Padrão: (número) (unidade) de (nome do alimento)
+    match_quantity = re.search(r'(\d+)\s*(g|gramas|gr|ml|l)?\s*(?:de\s)?(.+)', query, re.IGNORECASE)
+
+    if match_quantity:
+        value = float(match_quantity.group(1))
+        unit_raw = match_quantity.group(2)
+        unit = unit_raw.lower() if unit_raw else 'g'
+        alimento_base = match_quantity.group(3).strip()
+
+        if unit in ['g', 'gramas', 'gr']:
+            quantidade_g = value
+        elif unit in ['ml', 'l']:
+            quantidade_g = value * 1000 if unit == 'l' else value
+        # Adicionar outras conversões se necessário
+
+    return alimento_base, quantidade_g
+
+def build_food_option(found_food, quantidade_g):
+    """Monta o dicionário de uma opção a partir de uma linha de taco_foods (já como dicionário)."""
+    # Calcula a proporção baseada na quantidade informada (padrão é 100g)
+    proportion = quantidade_g / 100.0
+
+    return {
+        'calories': (found_food.get('energia_kcal') or 0) * proportion,
+        'carbohydrates': (found_food.get('carboidrato_g') or 0) * proportion,
+        'proteins': (found_food.get('proteina_g') or 0) * proportion,
+        'fats': (found_food.get('lipidios_g') or 0) * proportion,
+        'foods_listed': f"{quantidade_g:.0f}g de {found_food['alimento']}" if quantidade_g != 100.0 else found_food['alimento'],
+        'original_alimento': found_food['alimento'],
+        'taco_food_id': found_food.get('taco_number'),
+        'grams': quantidade_g
+    }
+
+@db_read
 def search_taco_options(query):
     """
-    Busca até 5 opções de alimentos na tabela TACO (PostgreSQL).
+    Busca até 5 opções de alimentos na TACO: no snapshot mmap (taco_snapshot.py) quando ele existe, sem ir ao
+    banco; senão na tabela taco_foods (PostgreSQL).
     Retorna uma LISTA de dicionários, cada um contendo os dados de um alimento.
     """
     conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        alimento_base, quantidade_g = parse_food_query(query)
 
-        alimento_base = query.strip()
-        quantidade_g = 100.0
-
-        # Tenta extrair a quantidade e o nome do alimento de forma mais robusta
-        # Padrão: (número) (unidade) de (nome do alimento)
-        match_quantity = re.search(r'(\d+)\s*(g|gramas|gr|ml|l)?\s*(?:de\s)?(.+)', query, re.IGNORECASE)
-        
-        if match_quantity:
-            value = float(match_quantity.group(1))
-            unit_raw = match_quantity.group(2)
-            unit = unit_raw.lower() if unit_raw else 'g'
-            alimento_base = match_quantity.group(3).strip()
-
-            if unit in ['g', 'gramas', 'gr']:
-                quantidade_g = value
-            elif unit in ['ml', 'l']:
-                quantidade_g = value * 1000 if unit == 'l' else value
-            # Adicionar outras conversões se necessário
-        
         if not alimento_base:
             return [] # Retorna uma lista vazia se não houver nome de alimento
 
-        found_options = []
+        snapshot = get_snapshot()
+        if snapshot is not None:
+            rows = snapshot.search(alimento_base, limit=5)
+            print(f"DEBUG: Busca por '{alimento_base}' encontrou {len(rows)} resultados no snapshot v{snapshot.version}.")
+            return [build_food_option(found_food, quantidade_g) for found_food in rows]
+
+        conn = get_db_connection()
+        cursor = conn.cursor()
+
         # O termo de busca usa '%' para buscas parciais (contém)
         search_term = f'%{alimento_base}%'
         
-        # AQUI A MUDANÇA PRINCIPAL: Buscamos até 5 opções, ordenando pela mais curta
+        # Buscamos até 5 opções, ordenando pela mais curta
         cursor.execute("SELECT * FROM taco_foods WHERE alimento ILIKE %s ORDER BY LENGTH(alimento) LIMIT 5", (search_term,))
         rows = cursor.fetchall() # Usamos fetchall() para pegar todas as linhas
         
         print(f"DEBUG: Busca por '{search_term}' encontrou {len(rows)} resultados no DB.")
 
         desc = cursor.description
+        found_options = []
         for row in rows:
             # Converte a linha do banco de dados em um dicionário de fácil uso
             found_food = {col[0]: row[idx] for idx, col in enumerate(desc)}
-            
-            # Calcula a proporção baseada na quantidade informada (padrão é 100g)
-            proportion = quantidade_g / 100.0
-            
-            # Monta o dicionário de dados para esta opção
-            option_data = {
-                'calories': found_food.get('energia_kcal', 0) * proportion,
-                'carbohydrates': found_food.get('carboidrato_g', 0) * proportion,
-                'proteins': found_food.get('proteina_g', 0) * proportion,
-                'fats': found_food.get('lipidios_g', 0) * proportion,
-                'foods_listed': f"{quantidade_g:.0f}g de {found_food['alimento']}" if quantidade_g != 100.0 else found_food['alimento'],
-                'original_alimento': found_food['alimento']
-            }
-            found_options.append(option_data)
+            found_options.append(build_food_option(found_food, quantidade_g))
 
         return found_options
 
@@ -77,4 +98,3 @@ def search_taco_options(query):
         if conn:
             cursor.close()
             conn.close()
-
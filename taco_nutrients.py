@@ -0,0 +1,162 @@
+# taco_nutrients.py
+"""
+Matriz de nutrientes da TACO em memória (alimentos × nutrientes, float32, valores por 100g).
+
+Vem do snapshot binário mapeado em memória (taco_snapshot.py) quando ele existe; senão é carregada UMA vez por
+worker a partir do taco_data.csv. O consumo de um dia é um vetor de gramas por alimento
+(identificado pelo "Número do Alimento" da TACO, guardado em food_entries.taco_food_id), e os totais de todos
+os nutrientes saem de um único produto vetor × matriz.
+"""
+import csv
+import os
+import threading
+
+import numpy as np
+
+TACO_CSV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'taco_data.csv')
+
+# (coluna do CSV, chave, rótulo para o usuário, unidade)
+NUTRIENTS = [
+    ('Energia..kcal.', 'energia_kcal', 'Energia', 'kcal'),
+    ('Proteína..g.', 'proteina_g', 'Proteína', 'g'),
+    ('Lipídeos..g.', 'lipidios_g', 'Gorduras', 'g'),
+    ('Carboidrato..g.', 'carboidrato_g', 'Carboidratos', 'g'),
+    ('Fibra.Alimentar..g.', 'fibra_g', 'Fibras', 'g'),
+    ('Colesterol..mg.', 'colesterol_mg', 'Colesterol', 'mg'),
+    ('Cálcio..mg.', 'calcio_mg', 'Cálcio', 'mg'),
+    ('Magnésio..mg.', 'magnesio_mg', 'Magnésio', 'mg'),
+    ('Manganês..mg.', 'manganes_mg', 'Manganês', 'mg'),
+    ('Fósforo..mg.', 'fosforo_mg', 'Fósforo', 'mg'),
+    ('Ferro..mg.', 'ferro_mg', 'Ferro', 'mg'),
+    ('Sódio..mg.', 'sodio_mg', 'Sódio', 'mg'),
+    ('Potássio..mg.', 'potassio_mg', 'Potássio', 'mg'),
+    ('Cobre..mg.', 'cobre_mg', 'Cobre', 'mg'),
+    ('Zinco..mg.', 'zinco_mg', 'Zinco', 'mg'),
+    ('Retinol..mcg.', 'retinol_mcg', 'Retinol', 'mcg'),
+    ('RE..mcg.', 're_mcg', 'Vitamina A (RE)', 'mcg'),
+    ('RAE..mcg.', 'rae_mcg', 'Vitamina A (RAE)', 'mcg'),
+    ('Tiamina..mg.', 'tiamina_mg', 'Tiamina (B1)', 'mg'),
+    ('Riboflavina..mg.', 'riboflavina_mg', 'Riboflavina (B2)', 'mg'),
+    ('Piridoxina..mg.', 'piridoxina_mg', 'Piridoxina (B6)', 'mg'),
+    ('Niacina..mg.', 'niacina_mg', 'Niacina (B3)', 'mg'),
+    ('Vitamina.C..mg.', 'vitamina_c_mg', 'Vitamina C', 'mg'),
+]
+NUTRIENT_KEYS = [key for _, key, _, _ in NUTRIENTS]
+
+# Nutrientes mostrados no resumo "micronutrientes de hoje", na ordem da resposta
+MICRONUTRIENT_SUMMARY_KEYS = ['fibra_g', 'sodio_mg', 'calcio_mg', 'ferro_mg', 'potassio_mg', 'magnesio_mg',
+                              'zinco_mg', 'vitamina_c_mg', 'rae_mcg', 'tiamina_mg', 'riboflavina_mg',
+                              'niacina_mg', 'piridoxina_mg']
+
+
+def _parse_value(value_str):
+    if not value_str:
+        return 0.0
+    value_str = value_str.strip().replace(',', '.')
+    if value_str.lower() in ('na', 'nd', 'tr', '*'):
+        return 0.0
+    try:
+        return float(value_str)
+    except ValueError:
+        return 0.0
+
+
+class NutrientMatrix:
+    """Matriz densa float32 com uma linha por alimento da TACO e uma coluna por nutriente (por 100g)."""
+
+    def __init__(self, food_ids, names, values):
+        self.food_ids = np.asarray(food_ids, dtype=np.int32)
+        self.names = names  # lista, ou a coluna de nomes do snapshot mmap (taco_snapshot.py)
+        self.values = np.ascontiguousarray(values, dtype=np.float32)
+        self.column = {key: idx for idx, key in enumerate(NUTRIENT_KEYS)}
+        # Mapeamento "Número do Alimento" -> linha da matriz, como array para indexação vetorizada
+        self._row_of_id = np.full(int(self.food_ids.max()) + 1 if len(self.food_ids) else 1, -1, dtype=np.int32)
+        self._row_of_id[self.food_ids] = np.arange(len(self.food_ids), dtype=np.int32)
+
+    @classmethod
+    def from_csv(cls, csv_path=TACO_CSV_FILE):
+        food_ids, names, rows = [], [], []
+        with open(csv_path, mode='r', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                alimento = row.get('Descrição dos alimentos', '').strip()
+                number = row.get('Número do Alimento', '').strip()
+                if not alimento or not number.isdigit():
+                    continue
+                food_ids.append(int(number))
+                names.append(alimento)
+                rows.append([_parse_value(row.get(csv_column)) for csv_column, _, _, _ in NUTRIENTS])
+        return cls(food_ids, names, np.array(rows, dtype=np.float32).reshape(len(rows), len(NUTRIENTS)))
+
+    def rows_for(self, food_ids):
+        """Converte números TACO em linhas da matriz (-1 para ids desconhecidos)."""
+        ids = np.asarray(food_ids, dtype=np.int64)
+        rows = np.full(len(ids), -1, dtype=np.int32)
+        known = (ids >= 0) & (ids < len(self._row_of_id))
+        rows[known] = self._row_of_id[ids[known]]
+        return rows
+
+    def intake_vector(self, food_ids, grams):
+        """Monta o vetor de gramas consumidas por alimento (uma posição por linha da matriz)."""
+        rows = self.rows_for(food_ids)
+        grams = np.asarray(grams, dtype=np.float32)
+        valid = rows >= 0
+        vector = np.zeros(len(self.food_ids), dtype=np.float32)
+        np.add.at(vector, rows[valid], grams[valid])
+        return vector
+
+    def totals(self, food_ids, grams):
+        """Totais de todos os nutrientes para as porções informadas: um único produto vetor × matriz."""
+        totals = self.intake_vector(food_ids, grams) @ self.values / np.float32(100.0)
+        return {key: float(totals[idx]) for key, idx in self.column.items()}
+
+
+_matrix = None
+_matrix_lock = threading.Lock()
+_categories = None
+
+
+def load_taco_categories(csv_path=TACO_CSV_FILE):
+    """{"Número do Alimento": "Categoria do alimento"} da TACO (a matriz/snapshot só guarda nomes e nutrientes)."""
+    global _categories
+    if _categories is None:
+        categories = {}
+        with open(csv_path, mode='r', encoding='utf-8') as file:
+            for row in csv.DictReader(file):
+                number = row.get('Número do Alimento', '').strip()
+                if number.isdigit():
+                    categories[int(number)] = row.get('Categoria do alimento', '').strip()
+        _categories = categories
+    return _categories
+
+
+def get_nutrient_matrix():
+    """
+    Retorna a matriz do snapshot mmap da TACO (compartilhada entre workers, acompanha versões novas) ou, sem
+    snapshot completo, a matriz do processo carregada do CSV na primeira chamada.
+    """
+    from taco_snapshot import get_snapshot
+
+    snapshot = get_snapshot()
+    if snapshot is not None and snapshot.has_all_nutrients():
+        return snapshot.nutrient_matrix()
+    global _matrix
+    if _matrix is None:
+        with _matrix_lock:
+            if _matrix is None:
+                _matrix = NutrientMatrix.from_csv()
+                print(f"DEBUG TACO: matriz de nutrientes carregada ({_matrix.values.shape[0]} alimentos × {_matrix.values.shape[1]} nutrientes).")
+    return _matrix
+
+
+def format_micronutrient_summary(totals, portions_count, unlinked_count=0):
+    """Texto da resposta "micronutrientes de hoje"."""
+    labels = {key: (label, unit) for _, key, label, unit in NUTRIENTS}
+    lines = ["🥦 *Micronutrientes de hoje*", ""]
+    for key in MICRONUTRIENT_SUMMARY_KEYS:
+        label, unit = labels[key]
+        value = totals.get(key, 0.0)
+        lines.append(f"*{label}:* {value:.1f} {unit}" if value < 100 else f"*{label}:* {value:.0f} {unit}")
+    lines.append(f"\n_Baseado em {portions_count} registro(s) de alimentos da TACO._")
+    if unlinked_count:
+        lines.append(f"_{unlinked_count} registro(s) sem alimento TACO associado não entraram na conta._")
+    return "\n".join(lines)
@@ -0,0 +1,354 @@
+# taco_snapshot.py
+"""
+Snapshot binário pré-compilado da TACO, aberto com mmap e compartilhado por todos os workers.
+
+Em vez de cada worker consultar taco_foods / ler o CSV e montar as próprias estruturas Python, um passo de build
+gera um arquivo com tudo pronto: colunas de nutrientes em largura fixa (float32), números TACO, nomes originais
+e normalizados (sem acento, minúsculos) e um índice invertido de tokens para a busca. Os workers só mapeiam o
+arquivo: as páginas ficam no page cache do SO e são as mesmas para todos os processos (e para os filhos de um
+fork), e abrir o snapshot custa só a leitura do cabeçalho.
+
+Formato (little-endian):
+  cabeçalho fixo: magic 'TACOSNAP', versão do formato (u32), tamanho do diretório (u32), versão do snapshot (u64)
+  diretório JSON: origem, chaves dos nutrientes e (offset, dtype, quantidade) de cada seção
+  seções alinhadas em 64 bytes: food_ids, values, name_lengths, name_offsets/name_blob, norm_offsets/norm_blob,
+  token_offsets/token_blob (tokens em ordem) e postings_offsets/postings (linhas de cada token).
+
+A versão do snapshot é o instante do build em milissegundos. O arquivo novo é publicado com os.replace(), então
+quem já mapeou o antigo continua lendo o antigo; os workers conferem o arquivo a cada
+TACO_SNAPSHOT_CHECK_SECONDS e trocam para a versão nova sozinhos.
+
+O arquivo fica fora do código (TACO_SNAPSHOT_PATH, padrão no diretório temporário do sistema) e é gerado no
+deploy com `python taco_snapshot.py build`. Os workers web não geram o snapshot por conta própria, a não ser com
+TACO_SNAPSHOT_AUTOBUILD=1; sem arquivo (ou se o build falhar) eles seguem pelo banco / CSV e só tentam de novo
+depois de TACO_SNAPSHOT_CHECK_SECONDS.
+
+Uso:
+    python taco_snapshot.py build                 # a partir do taco_data.csv
+    python taco_snapshot.py build --source db     # a partir da tabela taco_foods (só os macronutrientes)
+    python taco_snapshot.py info
+"""
+import argparse
+import bisect
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import unicodedata
+
+import numpy as np
+
+from taco_nutrients import NUTRIENT_KEYS, TACO_CSV_FILE, NutrientMatrix
+
+TACO_SNAPSHOT_PATH = os.getenv('TACO_SNAPSHOT_PATH', os.path.join(tempfile.gettempdir(), 'taco_snapshot.bin'))
+TACO_SNAPSHOT_CHECK_SECONDS = float(os.getenv('TACO_SNAPSHOT_CHECK_SECONDS', '30'))
+# Com 1, sem snapshot no disco o primeiro worker que precisar gera um a partir do CSV (os demais só mapeiam)
+TACO_SNAPSHOT_AUTOBUILD = os.getenv('TACO_SNAPSHOT_AUTOBUILD', '0') == '1'
+
+MAGIC = b'TACOSNAP'
+FORMAT_VERSION = 1
+_HEADER = struct.Struct('<8sIIQ')
+_ALIGN = 64
+
+# Palavras que não ajudam a achar o alimento ("arroz com feijão", "suco de laranja")
+STOPWORDS = {'de', 'da', 'do', 'das', 'dos', 'com', 'e', 'a', 'o', 'em', 'um', 'uma'}
+
+
+class SnapshotError(Exception):
+    """Arquivo de snapshot ausente, corrompido ou de outro formato."""
+
+
+def normalize_text(text):
+    """Minúsculas, sem acentos e só letras/números separados por um espaço ("Pão, francês" -> "pao frances")."""
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    without_accents = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return ' '.join(re.findall(r'[a-z0-9]+', without_accents))
+
+
+def query_tokens(text):
+    return [token for token in normalize_text(text).split() if token not in STOPWORDS]
+
+
+# --- BUILD ---
+
+def load_rows_from_csv(csv_path=TACO_CSV_FILE):
+    """[(numero_taco, alimento, [valores na ordem de NUTRIENT_KEYS])] a partir do CSV da TACO."""
+    matrix = NutrientMatrix.from_csv(csv_path)
+    rows = [(int(food_id), name, values.tolist())
+            for food_id, name, values in zip(matrix.food_ids, matrix.names, matrix.values)]
+    return rows, NUTRIENT_KEYS
+
+
+def load_rows_from_db():
+    """Mesmo formato, a partir de taco_foods. A tabela só tem os macronutrientes; o resto fica zerado."""
+    from database import get_db_connection
+
+    db_keys = ['energia_kcal', 'proteina_g', 'lipidios_g', 'carboidrato_g']
+    conn = get_db_connection('read')
+    try:
+        cursor = conn.cursor()
+        cursor.execute(f"SELECT taco_number, alimento, {', '.join(db_keys)} FROM taco_foods "
+                       "WHERE taco_number IS NOT NULL ORDER BY taco_number")
+        rows = []
+        for record in cursor.fetchall():
+            values = dict(zip(db_keys, record[2:]))
+            rows.append((record[0], record[1], [float(values.get(key) or 0.0) for key in NUTRIENT_KEYS]))
+        cursor.close()
+    finally:
+        conn.close()
+    return rows, db_keys
+
+
+def _string_section(strings):
+    blobs = [s.encode('utf-8') for s in strings]
+    offsets = np.zeros(len(blobs) + 1, dtype=np.int32)
+    offsets[1:] = np.cumsum([len(b) for b in blobs], dtype=np.int64)
+    return offsets, np.frombuffer(b''.join(blobs), dtype=np.uint8)
+
+
+def build_snapshot(rows, nutrient_keys, path=TACO_SNAPSHOT_PATH, source='csv'):
+    """Compila as linhas num snapshot e publica atomicamente em 'path'. Retorna a versão gerada."""
+    food_ids = np.array([r[0] for r in rows], dtype=np.int32)
+    names = [r[1] for r in rows]
+    values = np.array([r[2] for r in rows], dtype=np.float32).reshape(len(rows), len(NUTRIENT_KEYS))
+    normalized = [normalize_text(name) for name in names]
+
+    postings_by_token = {}
+    for row_idx, norm_name in enumerate(normalized):
+        for token in set(norm_name.split()):
+            postings_by_token.setdefault(token, []).append(row_idx)
+    tokens = sorted(postings_by_token)
+    postings_offsets = np.zeros(len(tokens) + 1, dtype=np.int32)
+    postings_offsets[1:] = np.cumsum([len(postings_by_token[t]) for t in tokens], dtype=np.int64)
+    postings = np.array([row for t in tokens for row in postings_by_token[t]], dtype=np.int32)
+
+    name_offsets, name_blob = _string_section(names)
+    norm_offsets, norm_blob = _string_section(normalized)
+    token_offsets, token_blob = _string_section(tokens)
+    sections = {
+        'food_ids': food_ids,
+        'values': values,
+        'name_lengths': np.array([len(name) for name in names], dtype=np.int32),
+        'name_offsets': name_offsets, 'name_blob': name_blob,
+        'norm_offsets': norm_offsets, 'norm_blob': norm_blob,
+        'token_offsets': token_offsets, 'token_blob': token_blob,
+        'postings_offsets': postings_offsets, 'postings': postings,
+    }
+
+    version = int(time.time() * 1000)
+    directory = {'source': source, 'foods': len(rows), 'nutrient_keys': list(nutrient_keys),
+                 'all_nutrient_keys': NUTRIENT_KEYS, 'sections': {}}
+    # O diretório guarda offsets absolutos; o tamanho dele depende dos offsets, então reserva espaço fixo
+    directory_size = 4096
+    offset = _align(_HEADER.size + directory_size)
+    for name, array in sections.items():
+        directory['sections'][name] = [offset, array.dtype.str, int(array.size), list(array.shape)]
+        offset = _align(offset + array.nbytes)
+    directory_json = json.dumps(directory).encode('utf-8')
+    if len(directory_json) > directory_size:
+        raise SnapshotError("Diretório do snapshot maior que o espaço reservado.")
+
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, 'wb') as file:
+        file.write(_HEADER.pack(MAGIC, FORMAT_VERSION, len(directory_json), version))
+        file.write(directory_json)
+        for name, array in sections.items():
+            file.seek(directory['sections'][name][0])
+            file.write(np.ascontiguousarray(array).tobytes())
+        file.truncate(offset)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
+    print(f"DEBUG TACO: snapshot v{version} gerado em {path} ({len(rows)} alimentos, {len(tokens)} tokens, origem {source}).")
+    return version
+
+
+def _align(offset):
+    return (offset + _ALIGN - 1) // _ALIGN * _ALIGN
+
+
+# --- LEITURA ---
+
+class _StringColumn:
+    """Sequência de strings lida direto do mmap (decodifica só o item pedido); serve para bisect."""
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return self._blob[self._offsets[idx]:self._offsets[idx + 1]].tobytes().decode('utf-8')
+
+
+class TacoSnapshot:
+    """Snapshot mapeado em memória. Todos os arrays são views do mmap (nenhuma cópia por processo)."""
+
+    def __init__(self, path=TACO_SNAPSHOT_PATH):
+        self.path = path
+        with open(path, 'rb') as file:
+            stat = os.fstat(file.fileno())
+            self.file_id = (stat.st_ino, stat.st_mtime_ns)
+            self._mmap = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap.size() < _HEADER.size:
+            raise SnapshotError(f"Snapshot {path} truncado.")
+        magic, format_version, directory_len, self.version = _HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise SnapshotError(f"{path} não é um snapshot TACO no formato {FORMAT_VERSION}.")
+        directory = json.loads(self._mmap[_HEADER.size:_HEADER.size + directory_len].decode('utf-8'))
+        if directory['all_nutrient_keys'] != NUTRIENT_KEYS:
+            raise SnapshotError(f"Snapshot {path} tem outras colunas de nutrientes; gere de novo.")
+        self.source = directory['source']
+        self.nutrient_keys = directory['nutrient_keys']
+        arrays = {}
+        for name, (offset, dtype, count, shape) in directory['sections'].items():
+            arrays[name] = np.frombuffer(self._mmap, dtype=np.dtype(dtype), count=count, offset=offset).reshape(shape)
+        self.food_ids = arrays['food_ids']
+        self.values = arrays['values']
+        self.name_lengths = arrays['name_lengths']
+        self.names = _StringColumn(arrays['name_offsets'], arrays['name_blob'])
+        self.normalized_names = _StringColumn(arrays['norm_offsets'], arrays['norm_blob'])
+        self.tokens = _StringColumn(arrays['token_offsets'], arrays['token_blob'])
+        self._postings_offsets = arrays['postings_offsets']
+        self._postings = arrays['postings']
+        self._column = {key: idx for idx, key in enumerate(NUTRIENT_KEYS)}
+        self._matrix = None
+
+    def _rows_with_prefix(self, prefix):
+        """Linhas cujo nome tem algum token começando com 'prefix' (faixa contígua na lista ordenada de tokens)."""
+        start = bisect.bisect_left(self.tokens, prefix)
+        end = bisect.bisect_left(self.tokens, prefix + '\uffff', lo=start)
+        if start == end:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(self._postings[self._postings_offsets[start]:self._postings_offsets[end]])
+
+    def search(self, term, limit=5):
+        """
+        Alimentos que contêm todos os tokens da consulta (por prefixo, sem acento). Ordem: nome com a frase
+        inteira primeiro, depois nome que começa pelo primeiro token, depois o nome mais curto (como antes).
+        """
+        tokens = query_tokens(term)
+        if not tokens:
+            return []
+        candidates = None
+        for token in tokens:
+            rows = self._rows_with_prefix(token)
+            candidates = rows if candidates is None else np.intersect1d(candidates, rows, assume_unique=True)
+            if not len(candidates):
+                return []
+        phrase = ' '.join(tokens)
+
+        def rank(row):
+            norm_name = self.normalized_names[row]
+            return (phrase not in ' '.join(t for t in norm_name.split() if t not in STOPWORDS),
+                    not norm_name.startswith(tokens[0]), int(self.name_lengths[row]), int(row))
+
+        return [self.food_row(int(row)) for row in sorted(candidates.tolist(), key=rank)[:limit]]
+
+    def food_row(self, row):
+        """Linha no mesmo formato de um SELECT * FROM taco_foods (para build_food_option)."""
+        food = {'alimento': self.names[row], 'taco_number': int(self.food_ids[row])}
+        for key in ('energia_kcal', 'proteina_g', 'lipidios_g', 'carboidrato_g'):
+            food[key] = float(self.values[row, self._column[key]])
+        return food
+
+    def has_all_nutrients(self):
+        return self.nutrient_keys == NUTRIENT_KEYS
+
+    def nutrient_matrix(self):
+        """NutrientMatrix sobre os mesmos arrays do mmap (sem copiar os valores)."""
+        if self._matrix is None:
+            self._matrix = NutrientMatrix(self.food_ids, self.names, self.values)
+        return self._matrix
+
+
+_snapshot = None
+_checked_at = float('-inf')
+_snapshot_lock = threading.Lock()
+
+
+def get_snapshot():
+    """
+    Snapshot atual do processo, ou None se não houver (quem chama cai no caminho antigo: banco / CSV).
+    A cada TACO_SNAPSHOT_CHECK_SECONDS confere se o arquivo mudou e troca para a versão nova.
+    """
+    global _snapshot, _checked_at
+    now = time.monotonic()
+    # Vale também sem snapshot: arquivo ausente ou build com falha só são conferidos de novo depois do intervalo
+    if now - _checked_at < TACO_SNAPSHOT_CHECK_SECONDS:
+        return _snapshot
+    with _snapshot_lock:
+        if now - _checked_at < TACO_SNAPSHOT_CHECK_SECONDS:
+            return _snapshot
+        _checked_at = now
+        try:
+            stat = os.stat(TACO_SNAPSHOT_PATH)
+        except FileNotFoundError:
+            if _snapshot is not None or not TACO_SNAPSHOT_AUTOBUILD:
+                return _snapshot
+            try:
+                rows, nutrient_keys = load_rows_from_csv()
+                build_snapshot(rows, nutrient_keys)
+                stat = os.stat(TACO_SNAPSHOT_PATH)
+            except Exception as e:
+                print(f"AVISO: não foi possível gerar o snapshot da TACO ({e}); usando o caminho sem snapshot.")
+                return None
+        if _snapshot is not None and _snapshot.file_id == (stat.st_ino, stat.st_mtime_ns):
+            return _snapshot
+        try:
+            snapshot = TacoSnapshot(TACO_SNAPSHOT_PATH)
+        except (OSError, ValueError, SnapshotError) as e:
+            print(f"ERRO ao abrir o snapshot da TACO ({e}); mantendo a versão atual.")
+            return _snapshot
+        if _snapshot is None or snapshot.version != _snapshot.version:
+            print(f"DEBUG TACO: snapshot v{snapshot.version} mapeado ({len(snapshot.food_ids)} alimentos, origem {snapshot.source}).")
+        # A versão antiga não é fechada: arrays dela ainda podem estar em uso; o mmap some com a última referência
+        _snapshot = snapshot
+        return _snapshot
+
+
+def ensure_snapshot():
+    """Snapshot atual, gerando-o a partir do CSV se ainda não existir (CLIs e benchmark, não os workers web)."""
+    global _checked_at
+    if not os.path.exists(TACO_SNAPSHOT_PATH):
+        rows, nutrient_keys = load_rows_from_csv()
+        build_snapshot(rows, nutrient_keys)
+    with _snapshot_lock:
+        _checked_at = float('-inf')
+    return get_snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera ou inspeciona o snapshot binário da TACO.")
+    parser.add_argument('command', choices=['build', 'info'])
+    parser.add_argument('--source', choices=['csv', 'db'], default='csv',
+                        help="De onde ler os alimentos (padrão: taco_data.csv).")
+    parser.add_argument('--path', default=TACO_SNAPSHOT_PATH, help="Arquivo do snapshot.")
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        if args.source == 'db':
+            from dotenv import load_dotenv
+            load_dotenv()
+            rows, nutrient_keys = load_rows_from_db()
+        else:
+            rows, nutrient_keys = load_rows_from_csv()
+        build_snapshot(rows, nutrient_keys, args.path, source=args.source)
+    else:
+        snapshot = TacoSnapshot(args.path)
+        print(f"Versão: {snapshot.version} | origem: {snapshot.source} | alimentos: {len(snapshot.food_ids)} | "
+              f"tokens: {len(snapshot.tokens)} | nutrientes: {len(snapshot.nutrient_keys)}/{len(NUTRIENT_KEYS)}")
+
+
+if __name__ == '__main__':
+    main()
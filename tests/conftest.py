@@ -0,0 +1,10 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+# Os módulos do bot ficam na raiz do repositório
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# Os testes rodam sem servidor: database.py lê DATABASE_URL na importação, então o SQLite precisa vir antes dela
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='bot-tests-'), 'bot.db')
+os.environ.pop('SHARD_DATABASE_URLS', None)
@@ -0,0 +1,55 @@
+# tests/test_food_recommender.py
+import pytest
+
+from food_recommender import FoodRecommender, remaining_targets
+from taco_nutrients import NutrientMatrix
+
+# Nada disso pode aparecer numa sugestão de "o que ainda posso comer"
+NEVER_SUGGESTED = {
+    'Cana, aguardente 1',
+    'Cerveja, pilsen 2',
+    'Carne, bovina, almôndegas, cruas',
+    'Porco, orelha, salgada, crua',
+    'Leite, de vaca, integral, pó',
+    'Grão-de-bico, cru',
+    'Arroz, tipo 1, cru',
+    'Óleo, de soja',
+    'Sal, grosso',
+    'Açúcar, refinado',
+}
+
+
+@pytest.fixture(scope='module')
+def recommender():
+    return FoodRecommender(NutrientMatrix.from_csv())
+
+
+def test_excluded_foods_are_not_eligible(recommender):
+    eligible = {recommender.matrix.names[row] for row in recommender.rows}
+    assert not NEVER_SUGGESTED & eligible
+
+
+@pytest.mark.parametrize('calorie_goal', [1200, 1500, 2000, 2500, 3000])
+@pytest.mark.parametrize('consumed_share', [0.0, 0.3, 0.6, 0.9])
+def test_typical_budgets(recommender, calorie_goal, consumed_share):
+    consumed = calorie_goal * consumed_share
+    foods_today = [{'calories': consumed, 'carbohydrates': consumed * 0.5 / 4,
+                    'proteins': consumed * 0.2 / 4, 'fats': consumed * 0.3 / 9}]
+    remaining = remaining_targets(calorie_goal, foods_today)
+    suggestions = recommender.recommend(remaining)
+
+    assert suggestions
+    for suggestion in suggestions:
+        assert suggestion['calories'] <= remaining['calories'] * 1.05
+        assert not {item['alimento'] for item in suggestion['items']} & NEVER_SUGGESTED
+
+
+def test_small_budget_never_overshoots(recommender):
+    # 85 kcal caíam na faixa de 100 kcal e a sugestão passava do que restava
+    remaining = {'calories': 85, 'carbohydrates': 10, 'proteins': 4, 'fats': 3}
+    for suggestion in recommender.recommend(remaining):
+        assert suggestion['calories'] <= 85 * 1.05
+
+
+def test_nothing_left_returns_no_suggestions(recommender):
+    assert recommender.recommend({'calories': 40, 'carbohydrates': 0, 'proteins': 0, 'fats': 0}) == []
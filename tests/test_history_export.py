@@ -0,0 +1,92 @@
+# tests/test_history_export.py
+import csv
+import io
+import json
+import os
+
+import pytest
+
+import database
+import history_export
+from history_export import EXPORT_COLUMNS, encode_records, stream_user_export
+
+NUMBER = 'whatsapp:+5511900000201'
+
+
+def _records(n):
+    return [{'whatsapp_number': NUMBER, 'record_type': 'weight_entries', 'entry_date': '2024-01-0%d' % (i % 9 + 1),
+             'weight': 70 + i} for i in range(n)]
+
+
+def test_encode_csv_writes_header_once_and_all_rows():
+    text = ''.join(encode_records(_records(3), 'csv'))
+    rows = list(csv.DictReader(io.StringIO(text)))
+    assert text.splitlines()[0] == ','.join(EXPORT_COLUMNS)
+    assert [row['weight'] for row in rows] == ['70', '71', '72']
+    assert rows[0]['calories'] == ''
+
+
+def test_encode_ndjson_one_object_per_line():
+    lines = ''.join(encode_records(_records(2) + [{'record_type': 'food_entries', 'foods_description': 'pão de açúcar'}],
+                                   'ndjson')).splitlines()
+    assert len(lines) == 3
+    assert json.loads(lines[1])['weight'] == 71
+    assert 'pão de açúcar' in lines[2]
+
+
+def test_encode_flushes_in_chunks(monkeypatch):
+    monkeypatch.setattr(history_export, 'FLUSH_EVERY_ROWS', 2)
+    chunks = list(encode_records(_records(5), 'ndjson'))
+    assert [chunk.count("\n") for chunk in chunks] == [2, 2, 1]
+
+
+def test_encode_empty_input():
+    assert list(encode_records([], 'ndjson')) == []
+    assert ''.join(encode_records([], 'csv')).strip() == ','.join(EXPORT_COLUMNS)
+
+
+def test_encode_invalid_format():
+    with pytest.raises(ValueError):
+        list(encode_records(_records(1), 'xml'))
+
+
+def test_stream_user_export_reads_given_shard():
+    database.init_db()
+    database.get_or_create_user(NUMBER)
+    database.add_weight_entry(NUMBER, 81.5)
+    lines = ''.join(stream_user_export(NUMBER, 'ndjson', shard=0)).splitlines()
+    assert [json.loads(line)['weight'] for line in lines] == [81.5]
+    assert list(stream_user_export('whatsapp:+5511900000299', 'ndjson', shard=0)) == []
+
+
+@pytest.fixture
+def client(monkeypatch):
+    os.environ.setdefault('EXPORT_API_TOKEN', 'test-export-token')
+    import app
+    monkeypatch.setattr(app, 'EXPORT_API_TOKEN', 'test-export-token')
+    return app, app.app.test_client()
+
+
+def test_export_refuses_user_moving_before_streaming(client, monkeypatch):
+    app, http = client
+
+    def moving(number):
+        raise database.UserShardMoving(f"{number} em migração")
+
+    monkeypatch.setattr(app, 'shard_for_number', moving)
+    response = http.get('/export', query_string={'number': NUMBER},
+                        headers={'Authorization': 'Bearer test-export-token'})
+    assert response.status_code == 503
+    assert response.headers['Retry-After'] == '30'
+
+
+def test_export_streams_history(client):
+    app, http = client
+    database.init_db()
+    database.get_or_create_user(NUMBER)
+    database.add_weight_entry(NUMBER, 80.0)
+    response = http.get('/export', query_string={'number': NUMBER, 'format': 'csv'},
+                        headers={'Authorization': 'Bearer test-export-token'})
+    assert response.status_code == 200
+    rows = list(csv.DictReader(io.StringIO(response.get_data(as_text=True))))
+    assert any(row['record_type'] == 'weight_entries' for row in rows)
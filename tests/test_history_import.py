@@ -0,0 +1,60 @@
+# tests/test_history_import.py
+from datetime import date, time, timedelta
+
+import pytest
+
+from history_import import ImportRowError, normalize_record
+
+NUMBER = 'whatsapp:+5511900000301'
+
+
+def test_food_row_from_export_format():
+    record_type, row = normalize_record({
+        'whatsapp_number': NUMBER, 'record_type': 'food_entries', 'entry_date': '2024-03-05',
+        'entry_time': '12:30:00', 'foods_description': 'arroz', 'calories': '128', 'carbohydrates': '28.1',
+        'proteins': '2.5', 'fats': '0.2', 'taco_food_id': '3', 'grams': '100'})
+    assert record_type == 'food_entries'
+    assert row == (NUMBER, date(2024, 3, 5), time(12, 30), 'arroz', 128.0, 28.1, 2.5, 0.2, 3, 100.0)
+
+
+def test_aliases_comma_decimals_and_br_dates():
+    record_type, row = normalize_record({' Data ': '05/03/2024', 'Hora': '08:15', 'Alimento': ' pão ',
+                                         'kcal': '150,5', 'Proteínas': ''}, default_number=NUMBER)
+    assert record_type == 'food_entries'
+    assert row == (NUMBER, date(2024, 3, 5), time(8, 15), 'pão', 150.5, 0.0, 0.0, 0.0, None, None)
+
+
+def test_weight_row_is_inferred_without_record_type():
+    assert normalize_record({'data': '2024-03-05', 'peso': '72,4'}, default_number=NUMBER) == \
+        ('weight_entries', (NUMBER, date(2024, 3, 5), None, 72.4))
+
+
+def test_default_number_wins_over_column():
+    _, row = normalize_record({'numero': 'whatsapp:+5500000000000', 'data': '2024-03-05', 'peso': '70'},
+                              default_number=NUMBER)
+    assert row[0] == NUMBER
+
+
+def test_unsupported_record_types_are_skipped():
+    assert normalize_record({'record_type': 'goals', 'goal_type': 'calories'}, default_number=NUMBER) is None
+
+
+def test_long_description_is_truncated():
+    _, row = normalize_record({'data': '2024-03-05', 'alimento': 'x' * 600, 'kcal': '10'}, default_number=NUMBER)
+    assert len(row[3]) == 500
+
+
+@pytest.mark.parametrize('raw, message', [
+    ({'data': '2024-03-05', 'peso': '70'}, 'número do WhatsApp ausente'),
+    ({'numero': NUMBER, 'peso': '70'}, "campo 'entry_date' ausente"),
+    ({'numero': NUMBER, 'data': '2024-02-30', 'peso': '70'}, 'data inválida'),
+    ({'numero': NUMBER, 'data': (date.today() + timedelta(days=1)).isoformat(), 'peso': '70'}, 'data no futuro'),
+    ({'numero': NUMBER, 'data': '2024-03-05', 'hora': '25:00', 'peso': '70'}, 'hora inválida'),
+    ({'numero': NUMBER, 'data': '2024-03-05', 'peso': '7'}, 'fora da faixa'),
+    ({'numero': NUMBER, 'data': '2024-03-05', 'peso': 'setenta'}, 'valor inválido'),
+    ({'numero': NUMBER, 'data': '2024-03-05', 'kcal': '100'}, "campo 'foods_description' ausente"),
+    ({'numero': NUMBER, 'data': '2024-03-05', 'alimento': 'arroz'}, "campo 'calories' ausente"),
+])
+def test_invalid_rows_raise(raw, message):
+    with pytest.raises(ImportRowError, match=message):
+        normalize_record(raw)
@@ -0,0 +1,82 @@
+# tests/test_interaction_touches.py
+from datetime import date, timedelta
+
+import pytest
+
+import interaction_touches
+from interaction_touches import InteractionTouchTracker
+
+
+class FakeDate(date):
+    current = date(2026, 1, 10)
+
+    @classmethod
+    def today(cls):
+        return cls.current
+
+
+@pytest.fixture
+def tracker(monkeypatch):
+    monkeypatch.setattr(interaction_touches, 'date', FakeDate)
+    FakeDate.current = date(2026, 1, 10)
+    flushed = []
+    # Intervalo longo: o teste chama flush() na mão
+    tracker = InteractionTouchTracker(flush_fn=lambda touches: flushed.append(sorted(touches)), interval=3600)
+    tracker.flushed = flushed
+    yield tracker
+    tracker.stop()
+
+
+def test_touches_collapse_into_one_write_per_user_per_day(tracker):
+    for _ in range(5):
+        tracker.touch((0, 1), alias='whatsapp:+1')
+    assert tracker.touch((0, 2)) is True
+    assert tracker.touch((0, 2)) is False
+    assert tracker.pending_date((0, 1)) == date(2026, 1, 10)
+
+    assert tracker.flush() == 2
+    assert tracker.flushed == [[((0, 1), date(2026, 1, 10)), ((0, 2), date(2026, 1, 10))]]
+    assert tracker.pending_date((0, 1)) is None
+
+    # Já gravado hoje: novos toques não voltam para a fila
+    tracker.touch((0, 1))
+    assert tracker.flush() == 0
+
+
+def test_new_day_touches_again_and_forgets_aliases(tracker):
+    tracker.touch((0, 1), alias='whatsapp:+1')
+    tracker.flush()
+    assert tracker.key_for_today('whatsapp:+1') == (0, 1)
+
+    FakeDate.current += timedelta(days=1)
+    assert tracker.key_for_today('whatsapp:+1') is None
+    assert tracker.touch((0, 1), alias='whatsapp:+1') is True
+    tracker.flush()
+    assert tracker.flushed[-1] == [((0, 1), date(2026, 1, 11))]
+
+
+def test_failed_flush_is_retried(tracker):
+    calls = []
+
+    def failing_then_ok(touches):
+        calls.append(touches)
+        if len(calls) == 1:
+            raise RuntimeError("banco fora")
+
+    tracker.flush_fn = failing_then_ok
+    tracker.touch((1, 7))
+    assert tracker.flush() == 0
+    assert tracker.pending_date((1, 7)) == date(2026, 1, 10)
+    assert tracker.flush() == 1
+    assert calls[1] == [((1, 7), date(2026, 1, 10))]
+
+
+def test_flush_touches_only_moves_the_date_forward():
+    import database
+
+    database.init_db()
+    user_id = database.get_or_create_user('whatsapp:+5511900000036')
+    today = date.today()
+    interaction_touches.flush_touches([((0, user_id), today)])
+    interaction_touches.flush_touches([((0, user_id), today - timedelta(days=3))])
+    assert database.get_last_interaction_date('whatsapp:+5511900000036') == today
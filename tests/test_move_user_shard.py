@@ -0,0 +1,53 @@
+# tests/test_move_user_shard.py
+import pytest
+
+import database
+import move_user_shard
+from move_user_shard import LateWriteDetected, delete_user_data
+
+NUMBER = 'whatsapp:+5511900000037'
+
+
+@pytest.fixture(autouse=True)
+def user():
+    database.init_db()
+    database.set_goal(NUMBER, 'calorie_intake', 2000)
+    database.set_user_state(NUMBER, 'none')
+    database.add_food_entry(NUMBER, 'Banana, prata, crua (100g)', 98, 26, 1.3, 0.1)
+    yield
+    delete_user_data(0, NUMBER)
+
+
+def _snapshot_checksums():
+    # O que read_user_data guarda no momento da cópia
+    conn = database.get_db_connection('write', shard=0)
+    cursor = conn.cursor()
+    try:
+        return move_user_shard._table_checksums(cursor, database.get_or_create_user(NUMBER))
+    finally:
+        cursor.close()
+        conn.close()
+
+
+@pytest.mark.parametrize('late_write', [
+    lambda: database.set_goal(NUMBER, 'calorie_intake', 1800),
+    lambda: database.set_user_state(NUMBER, 'awaiting_meal_confirmation', {'best_guess': None}),
+    lambda: database.add_food_entry(NUMBER, 'Maçã, Fuji, com casca, crua (100g)', 56, 15, 0.3, 0),
+], ids=['goal_upsert', 'state_upsert', 'new_entry'])
+def test_write_during_copy_keeps_source(late_write):
+    checksums = _snapshot_checksums()
+    late_write()
+    switched = []
+    with pytest.raises(LateWriteDetected):
+        delete_user_data(0, NUMBER, checksums, before_delete=lambda: switched.append(True))
+    assert not switched
+    assert database.get_goal(NUMBER, 'calorie_intake') is not None
+    assert database.get_daily_summary(NUMBER)['foods']
+
+
+def test_unchanged_source_is_deleted():
+    checksums = _snapshot_checksums()
+    switched = []
+    delete_user_data(0, NUMBER, checksums, before_delete=lambda: switched.append(True))
+    assert switched
+    assert database.get_daily_summary(NUMBER)['foods'] == []
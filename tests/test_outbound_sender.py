@@ -0,0 +1,57 @@
+# tests/test_outbound_sender.py
+from outbound_sender import COALESCE_SEPARATOR, OutboundScheduler, PRIORITY_BULK, PRIORITY_INTERACTIVE
+
+
+class FreeBucket:
+    """Token bucket sem limite, para os testes olharem só a ordem e o agrupamento."""
+
+    def try_acquire(self):
+        return 0.0
+
+
+def _run(enqueue, coalesce_window=0.05):
+    # stop() libera tudo de uma vez, então a ordem de entrega depende só da prioridade e da chegada
+    delivered = []
+
+    def deliver(to_number, body):
+        delivered.append((to_number, body))
+
+    scheduler = OutboundScheduler(deliver, FreeBucket(), coalesce_window=coalesce_window)
+    enqueue(scheduler)
+    scheduler.start()
+    scheduler.stop()
+    return delivered
+
+
+def test_interactive_reply_overtakes_queued_bulk():
+    def enqueue(scheduler):
+        for i in range(5):
+            scheduler.enqueue(f'whatsapp:+55110000000{i}', f"lembrete {i}", PRIORITY_BULK)
+        scheduler.enqueue('whatsapp:+5511999999999', "resposta", PRIORITY_INTERACTIVE)
+
+    delivered = _run(enqueue)
+    assert delivered[0] == ('whatsapp:+5511999999999', "resposta")
+    assert [body for _, body in delivered[1:]] == [f"lembrete {i}" for i in range(5)]
+
+
+def test_sends_to_same_number_coalesce():
+    def enqueue(scheduler):
+        scheduler.enqueue('whatsapp:+5511999999999', "primeira")
+        scheduler.enqueue('whatsapp:+5511999999999', "segunda")
+        scheduler.enqueue('whatsapp:+5511888888888', "outra pessoa")
+
+    delivered = _run(enqueue)
+    assert sorted(delivered) == [
+        ('whatsapp:+5511888888888', "outra pessoa"),
+        ('whatsapp:+5511999999999', "primeira" + COALESCE_SEPARATOR + "segunda"),
+    ]
+
+
+def test_interactive_message_promotes_coalesced_bulk():
+    def enqueue(scheduler):
+        scheduler.enqueue('whatsapp:+5511000000001', "lembrete", PRIORITY_BULK)
+        scheduler.enqueue('whatsapp:+5511000000002', "lembrete", PRIORITY_BULK)
+        scheduler.enqueue('whatsapp:+5511000000002', "resposta", PRIORITY_INTERACTIVE)
+
+    delivered = _run(enqueue)
+    assert delivered[0] == ('whatsapp:+5511000000002', "lembrete" + COALESCE_SEPARATOR + "resposta")
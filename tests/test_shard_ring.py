@@ -0,0 +1,32 @@
+# tests/test_shard_ring.py
+from collections import Counter
+
+from database import ShardRing
+
+NUMBERS = [f"whatsapp:+55119{i:08d}" for i in range(5000)]
+
+
+def test_placement_is_deterministic():
+    first, second = ShardRing(3), ShardRing(3)
+    assert [first.shard_for(n) for n in NUMBERS] == [second.shard_for(n) for n in NUMBERS]
+
+
+def test_single_shard_gets_everything():
+    ring = ShardRing(1)
+    assert {ring.shard_for(n) for n in NUMBERS[:200]} == {0}
+
+
+def test_adding_a_shard_only_moves_users_to_the_new_shard():
+    before, after = ShardRing(3), ShardRing(4)
+    moved = [n for n in NUMBERS if before.shard_for(n) != after.shard_for(n)]
+    # Quem muda de lugar vai para o shard novo; ninguém troca entre os shards antigos
+    assert {after.shard_for(n) for n in moved} == {3}
+    # ~1/4 dos usuários deveria mudar, longe do remapeamento quase total de um hash % N
+    assert 0.15 < len(moved) / len(NUMBERS) < 0.35
+
+
+def test_keys_spread_over_all_shards():
+    ring = ShardRing(4)
+    counts = Counter(ring.shard_for(n) for n in NUMBERS)
+    assert set(counts) == {0, 1, 2, 3}
+    assert min(counts.values()) > len(NUMBERS) / 4 * 0.6
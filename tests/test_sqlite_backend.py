@@ -0,0 +1,167 @@
+# tests/test_sqlite_backend.py
+from datetime import date, datetime, timedelta
+
+import pytest
+
+import database
+from sqlite_backend import translate_sql
+
+NUMBER = 'whatsapp:+5511900000001'
+OTHER_NUMBER = 'whatsapp:+5511900000002'
+
+
+@pytest.fixture(scope='module', autouse=True)
+def schema():
+    assert database.is_sqlite()
+    database.init_db()
+
+
+@pytest.mark.parametrize('query, expected', [
+    ("SELECT id FROM users WHERE whatsapp_number = %s", "SELECT id FROM users WHERE whatsapp_number = ?"),
+    ("SELECT 1 WHERE nome ILIKE %s", "SELECT 1 WHERE nome LIKE ?"),
+    ("SELECT 1 WHERE nome LIKE 'a%%'", "SELECT 1 WHERE nome LIKE 'a%'"),
+    ("SELECT COALESCE(%s::date, CURRENT_DATE)", "SELECT COALESCE(?, date('now', 'localtime'))"),
+    ("SELECT CURRENT_TIME, NOW()", "SELECT time('now', 'localtime'), datetime('now', 'localtime')"),
+    ("SELECT id FROM users WHERE id = %s FOR UPDATE", "SELECT id FROM users WHERE id = ?"),
+])
+def test_translate_sql(query, expected):
+    assert translate_sql(query) == expected
+
+
+@pytest.mark.parametrize('name', sorted(database._STATEMENTS))
+def test_registered_statements_compile_on_sqlite(name):
+    # EXPLAIN compila o comando traduzido contra o schema do SQLite sem executá-lo
+    sql_text, _, n_params = database._STATEMENTS[name]
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("EXPLAIN " + sql_text, [None] * n_params)
+    finally:
+        cursor.close()
+        conn.close()
+
+
+def test_food_entries_summary_and_rollups():
+    database.add_food_entry(NUMBER, 'Arroz, tipo 1, cozido (100g)', 128, 28.1, 2.5, 0.2, taco_food_id=3, grams=100)
+    database.add_food_entries(NUMBER, [
+        {'foods_description': 'Feijão, carioca, cozido (80g)', 'calories': 61, 'carbohydrates': 10.9,
+         'proteins': 3.8, 'fats': 0.4, 'taco_food_id': 561, 'grams': 80},
+    ])
+    database.add_exercise_entry(NUMBER, 'corrida', 30, 300)
+    database.add_weight_entry(NUMBER, 80.5)
+
+    summary = database.get_daily_summary(NUMBER)
+    assert sorted(food['calories'] for food in summary['foods']) == [61, 128]
+    assert summary['exercises'][0]['calories_burned'] == 300
+    assert summary['last_weight'] == 80.5
+
+    portions = database.get_daily_food_portions(NUMBER)
+    assert sorted(portions['taco_food_ids']) == [3, 561]
+
+    rollup = database.get_daily_rollups(NUMBER, date.today())[0]
+    assert rollup['kcal_in'] == pytest.approx(189)
+    assert rollup['kcal_burned'] == pytest.approx(300)
+    assert rollup['food_entries_count'] == 2
+
+
+def test_recent_foods_and_history_delete():
+    recent = database.get_recent_foods(NUMBER)
+    assert {food['foods_description'] for food in recent} >= {'Arroz, tipo 1, cozido (100g)'}
+
+    page = database.get_food_entries_page(NUMBER, limit=1)
+    assert len(page['entries']) == 1 and page['next_cursor'] is not None
+    older = database.get_food_entries_page(NUMBER, before=page['next_cursor'], limit=1)
+    assert older['entries'][0]['id'] < page['entries'][0]['id']
+
+    # Ids de outro usuário são ignorados
+    assert not database.delete_food_entries_by_ids(OTHER_NUMBER, [page['entries'][0]['id']])
+    assert database.delete_food_entries_by_ids(NUMBER, [page['entries'][0]['id']]) == 1
+    rollup = database.get_daily_rollups(NUMBER, date.today())[0]
+    assert rollup['food_entries_count'] == 1
+
+
+def test_history_pages_through_entries_of_the_same_day():
+    number = 'whatsapp:+5511900000011'
+    total = database.HISTORY_PAGE_SIZE * 2 + 3
+    for i in range(total):
+        database.add_food_entry(number, f'Item {i}', 10, 1, 1, 1)
+
+    seen, before, pages = [], None, 0
+    while True:
+        page = database.get_food_entries_page(number, before=before)
+        seen.extend(entry['id'] for entry in page['entries'])
+        pages += 1
+        if page['next_cursor'] is None:
+            break
+        # Todas as entradas são de hoje: o desempate do cursor é só o id
+        assert page['next_cursor'][1] == page['entries'][-1]['id']
+        before = page['next_cursor']
+    assert pages == 3
+    assert len(seen) == total and len(set(seen)) == total
+    assert seen == sorted(seen, reverse=True)
+
+
+def test_history_delete_skips_other_users_ids_and_updates_rollups():
+    number, other = 'whatsapp:+5511900000012', 'whatsapp:+5511900000013'
+    for calories in (100, 200, 300):
+        database.add_food_entry(number, f'Prato {calories}', calories, 10, 5, 2)
+    database.add_food_entry(other, 'Prato alheio', 400, 40, 20, 8)
+    own_ids = [entry['id'] for entry in database.get_food_entries_page(number)['entries']]
+    other_id = database.get_food_entries_page(other)['entries'][0]['id']
+
+    assert database.delete_food_entries_by_ids(number, [own_ids[0], own_ids[1], other_id]) == 2
+
+    assert [entry['id'] for entry in database.get_food_entries_page(number)['entries']] == [own_ids[2]]
+    assert [entry['id'] for entry in database.get_food_entries_page(other)['entries']] == [other_id]
+    rollup = database.get_daily_rollups(number, date.today())[0]
+    assert rollup['kcal_in'] == pytest.approx(100)
+    assert rollup['proteins'] == pytest.approx(5)
+    assert rollup['food_entries_count'] == 1
+    other_rollup = database.get_daily_rollups(other, date.today())[0]
+    assert other_rollup['kcal_in'] == pytest.approx(400)
+    assert other_rollup['food_entries_count'] == 1
+
+
+def test_goals_state_and_reminders():
+    database.set_goal(NUMBER, 'calorie_intake', 2000)
+    database.set_goal(NUMBER, 'calorie_intake', 1800)
+    assert database.get_goal(NUMBER, 'calorie_intake')['target_value'] == 1800
+
+    database.set_user_state(NUMBER, 'awaiting_meal_confirmation', {'best_guess': None})
+    assert database.get_user_state(NUMBER) == {'state': 'awaiting_meal_confirmation',
+                                               'context_data': {'best_guess': None}}
+
+    database.add_reminder(NUMBER, 'beber água', '15:30')
+    assert [r['reminder_text'] for r in database.get_user_reminders(NUMBER)] == ['beber água']
+    database.deactivate_reminder(NUMBER, 'beber água', '15:30')
+    assert database.get_user_reminders(NUMBER) == []
+
+
+def test_due_reminders_are_claimed_once_per_day():
+    now = datetime.now().replace(hour=12, minute=0)
+    database.add_reminder(OTHER_NUMBER, 'tomar remédio', '08:00')
+    database.add_reminder(OTHER_NUMBER, 'caminhar', '18:00')
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("UPDATE reminders SET last_sent_on = NULL")  # como se tivessem sido criados ontem
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    assert database.claim_due_reminders(now) == [{'whatsapp_number': OTHER_NUMBER, 'reminder_text': 'tomar remédio'}]
+    assert database.claim_due_reminders(now) == []
+    assert [r['reminder_text'] for r in database.claim_due_reminders(now.replace(hour=18, minute=30))] == ['caminhar']
+    tomorrow = now + timedelta(days=1)
+    assert len(database.claim_due_reminders(tomorrow.replace(hour=19))) == 2
+
+
+def test_backfills_rebuild_from_entries():
+    database.backfill_daily_rollups(date.today())
+    database.backfill_recent_foods()
+    rollup = database.get_daily_rollups(NUMBER, date.today())[0]
+    assert rollup['food_entries_count'] == 1
+    # A entrada apagada no histórico sai também dos recentes
+    assert [food['foods_description'] for food in database.get_recent_foods(NUMBER)] == ['Arroz, tipo 1, cozido (100g)']
+
+    database.delete_all_food_entries_for_day(NUMBER)
+    assert database.get_daily_summary(NUMBER)['foods'] == []
@@ -0,0 +1,43 @@
+# tests/test_taco_nutrients.py
+import numpy as np
+import pytest
+
+from taco_nutrients import NUTRIENT_KEYS, NutrientMatrix, format_micronutrient_summary
+
+
+@pytest.fixture
+def matrix():
+    # Dois alimentos fictícios (por 100g): só energia, proteína e ferro preenchidos
+    values = np.zeros((2, len(NUTRIENT_KEYS)), dtype=np.float32)
+    column = {key: idx for idx, key in enumerate(NUTRIENT_KEYS)}
+    values[0, [column['energia_kcal'], column['proteina_g'], column['ferro_mg']]] = [100, 10, 2]
+    values[1, [column['energia_kcal'], column['proteina_g'], column['ferro_mg']]] = [50, 1, 0.5]
+    return NutrientMatrix([7, 3], ['Alimento A', 'Alimento B'], values)
+
+
+def test_totals_scale_portions_per_100g(matrix):
+    totals = matrix.totals([7, 3], [150, 200])
+    assert totals['energia_kcal'] == pytest.approx(150 + 100)
+    assert totals['proteina_g'] == pytest.approx(15 + 2)
+    assert totals['ferro_mg'] == pytest.approx(3 + 1)
+    assert totals['vitamina_c_mg'] == 0
+
+
+def test_repeated_foods_add_up_and_unknown_ids_are_ignored(matrix):
+    totals = matrix.totals([7, 7, 999, -1], [50, 50, 300, 100])
+    assert totals['energia_kcal'] == pytest.approx(100)
+    assert matrix.totals([], [])['energia_kcal'] == 0
+
+
+def test_totals_from_the_real_table():
+    real = NutrientMatrix.from_csv()
+    # "Arroz, integral, cozido" (TACO 1): 124 kcal e 2,6 g de proteína em 100 g
+    totals = real.totals([1], [200])
+    assert totals['energia_kcal'] == pytest.approx(248)
+    assert totals['proteina_g'] == pytest.approx(5.2)
+
+
+def test_summary_mentions_unlinked_entries(matrix):
+    text = format_micronutrient_summary(matrix.totals([7], [100]), 1, unlinked_count=2)
+    assert "*Ferro:* 2.0 mg" in text
+    assert "2 registro(s) sem alimento TACO" in text
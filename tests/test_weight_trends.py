@@ -0,0 +1,76 @@
+# tests/test_weight_trends.py
+import math
+
+import numpy as np
+import pytest
+
+from weight_trends import compute_trends, EMA_HALF_LIFE
+
+
+def _series():
+    # Usuário 1: perde 0,5 kg por dia nos últimos 4 dias. Usuário 2: uma pesagem só, 10 dias atrás.
+    user_ids = np.array([1, 1, 1, 1, 2], dtype=np.int64)
+    day_offsets = np.array([-3, -2, -1, 0, -10], dtype=np.float64)
+    weights = np.array([80.0, 79.5, 79.0, 78.5, 90.0])
+    return user_ids, day_offsets, weights
+
+
+def test_smoothing_average_and_weekly_change():
+    trends = compute_trends(*_series())
+    assert list(trends['user_id']) == [1, 2]
+    assert list(trends['samples']) == [4, 1]
+    assert list(trends['latest_weight']) == [78.5, 90.0]
+
+    # Média exponencial: a k-ésima pesagem contando do fim pesa 0,5^(k/meia-vida)
+    decay = 0.5 ** (1 / EMA_HALF_LIFE)
+    ema_weights = [decay ** 3, decay ** 2, decay, 1.0]
+    expected = sum(w * x for w, x in zip(ema_weights, [80.0, 79.5, 79.0, 78.5])) / sum(ema_weights)
+    assert trends['smoothed_weight'][0] == pytest.approx(expected)
+    assert trends['smoothed_weight'][1] == pytest.approx(90.0)
+
+    assert trends['avg_7d'][0] == pytest.approx(79.25)
+    assert math.isnan(trends['avg_7d'][1])  # sem pesagem nos últimos 7 dias
+
+    assert trends['weekly_change_kg'][0] == pytest.approx(-3.5)
+    assert math.isnan(trends['weekly_change_kg'][1])  # uma pesagem não tem inclinação
+
+
+def test_goal_projection():
+    goal_users = np.array([2, 1], dtype=np.int64)
+    goal_targets = np.array([80.0, 75.0])
+    trends = compute_trends(*_series(), goal_users, goal_targets)
+    expected_days = math.ceil((75.0 - trends['smoothed_weight'][0]) / -0.5)
+    assert trends['days_to_goal'][0] == expected_days
+    assert math.isnan(trends['days_to_goal'][1])
+
+
+def test_goal_in_the_opposite_direction_is_not_projected():
+    trends = compute_trends(*_series(), np.array([1], dtype=np.int64), np.array([85.0]))
+    assert math.isnan(trends['days_to_goal'][0])
+
+
+def test_empty_input():
+    empty = np.empty(0, np.int64), np.empty(0), np.empty(0)
+    assert len(compute_trends(*empty)['user_id']) == 0
+
+
+def test_job_writes_projection_and_prunes_stale_rows():
+    import database
+    from weight_trends import run_weight_trends_job
+
+    database.init_db()
+    active, inactive = 'whatsapp:+5511900000028', 'whatsapp:+5511900000029'
+    database.add_weight_entry(active, 80.0)
+    database.set_goal(active, 'weight', 70.0)
+    inactive_id = database.get_or_create_user(inactive)
+    conn = database.get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("INSERT INTO weight_trends (user_id, samples, computed_at) VALUES (%s, 3, '2020-01-01 00:00:00')",
+                   (inactive_id,))
+    conn.commit()
+    cursor.close()
+    conn.close()
+
+    run_weight_trends_job()
+    assert database.get_weight_trend(active)['latest_weight'] == 80.0
+    assert database.get_weight_trend(inactive) is None
@@ -0,0 +1,64 @@
+# tests/test_wit_nlp.py
+import pytest
+
+from wit_nlp import parse_history_command, parse_local_message, parse_relog_command
+
+
+@pytest.mark.parametrize('message, intent, entities', [
+    ("Oi", 'saudacao', {}),
+    ("bom dia!", 'saudacao', {}),
+    ("comi 100g de arroz", 'registrar_refeicao', {'food_item': ['100g de arroz']}),
+    ("Eu almocei uma feijoada", 'registrar_refeicao', {'food_item': ['feijoada']}),
+    ("registrar peso 80", 'registrar_peso', {'weight': ['80']}),
+    ("anota peso 79,5", 'registrar_peso', {'weight': ['79.5']}),
+    ("pesei 81.2 hoje", 'registrar_peso', {'weight': ['81.2']}),
+    ("registrar meta 1800", 'definir_meta', {'goal_value': ['1800']}),
+    ("Definir meta 2000", 'definir_meta', {'goal_value': ['2000']}),
+    ("minha tendência de peso", 'obter_tendencia_peso', {}),
+    ("o que ainda posso comer?", 'recomendar_alimento', {}),
+    ("vitaminas de hoje", 'obter_micronutrientes', {}),
+    ("resumo", 'obter_resumo_diario', {}),
+    ("resumo da semana", 'obter_resumo_semanal', {}),
+    ("relatório do mês", 'obter_resumo_mensal', {}),
+    ("qualquer outra coisa", 'none', {}),
+    ("", 'none', {}),
+])
+def test_parse_local_message(message, intent, entities):
+    assert parse_local_message(message) == {'intent': intent, 'entities': entities}
+
+
+@pytest.mark.parametrize('message, expected', [
+    ("o de sempre", {'command': 'usual'}),
+    ("A de sempre!", {'command': 'usual'}),
+    ("recentes", {'command': 'list'}),
+    ("Meus  favoritos", {'command': 'list'}),
+    ("repetir almoço de ontem", {'command': 'repeat_meal', 'meal': 'almoco', 'days_ago': 1}),
+    ("repete o jantar", {'command': 'repeat_meal', 'meal': 'jantar', 'days_ago': 1}),
+    ("mesma janta de anteontem", {'command': 'repeat_meal', 'meal': 'jantar', 'days_ago': 2}),
+    ("repetir café da manhã de hoje", {'command': 'repeat_meal', 'meal': 'cafe_da_manha', 'days_ago': 0}),
+    ("repita o cafe do dia de ontem", {'command': 'repeat_meal', 'meal': 'cafe_da_manha', 'days_ago': 1}),
+    ("o mesmo lanche", {'command': 'repeat_meal', 'meal': 'lanche', 'days_ago': 1}),
+    ("repetir almoço de semana passada", None),
+    ("comi o de sempre", None),
+    ("", None),
+])
+def test_parse_relog_command(message, expected):
+    assert parse_relog_command(message) == expected
+
+
+@pytest.mark.parametrize('message, expected', [
+    ("histórico", {'command': 'list'}),
+    ("Meu historico", {'command': 'list'}),
+    ("mais", {'command': 'more'}),
+    ("Próxima página", {'command': 'more'}),
+    ("apagar", {'command': 'delete', 'choices': []}),
+    ("apagar 2", {'command': 'delete', 'choices': ['2']}),
+    ("apaga os itens 2, 5 e 7", {'command': 'delete', 'choices': ['2', '5', '7']}),
+    ("excluir registro 3", {'command': 'delete', 'choices': ['3']}),
+    ("remova 1 4", {'command': 'delete', 'choices': ['1', '4']}),
+    ("apagar tudo", None),
+    ("apagar o almoço", None),
+    ("mais arroz", None),
+])
+def test_parse_history_command(message, expected):
+    assert parse_history_command(message) == expected
@@ -0,0 +1,244 @@
+# weight_trends.py
+"""
+Job em lote que calcula a tendência de peso de TODOS os usuários de uma vez.
+
+Lê weight_entries numa única consulta com cursor no servidor (streaming), monta arrays NumPy
+ordenados por (usuário, dia) e calcula, sem laço por usuário:
+  * peso suavizado (média exponencial normalizada) e média simples dos últimos 7 dias;
+  * variação semanal (inclinação por mínimos quadrados nos últimos 28 dias, em kg/semana);
+  * data projetada para atingir a meta de peso (goals.goal_type = 'weight', definida no bot com "meta de peso 70"),
+    quando a tendência aponta para ela.
+
+O resultado vai para a tabela weight_trends (uma linha por usuário), que o bot lê com get_weight_trend(). Linhas de
+usuários que ficaram sem pesagens na janela são apagadas, para o bot não mostrar uma tendência velha.
+Uso: python weight_trends.py
+"""
+import time
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from database import get_db_connection, init_db, shard_indices, is_sqlite
+
+LOOKBACK_DAYS = 90          # Janela de histórico carregada por usuário
+SLOPE_WINDOW_DAYS = 28      # Janela da regressão linear usada na variação semanal
+AVG_WINDOW_DAYS = 7         # Janela da média simples
+EMA_HALF_LIFE = 5.0         # Meia-vida (em número de pesagens) do peso suavizado
+MIN_SLOPE_KG_PER_DAY = 0.005  # Abaixo disso consideramos o peso estável e não projetamos data
+MAX_PROJECTION_DAYS = 730
+FETCH_BATCH_SIZE = 50000
+WRITE_PAGE_SIZE = 2000
+
+
+def load_weight_series(conn, lookback_days=LOOKBACK_DAYS):
+    """
+    Carrega (user_id, dia relativo a hoje, peso) de todos os usuários num único cursor nomeado.
+    Os dados chegam em lotes, então a memória do Python fica limitada a FETCH_BATCH_SIZE tuplas por vez.
+    """
+    cursor = conn.cursor(name='weight_trends_stream')
+    cursor.itersize = FETCH_BATCH_SIZE
+    if is_sqlite():
+        # SQLite não subtrai datas: usa o dia juliano
+        cursor.execute(
+            "SELECT user_id, CAST(julianday(entry_date) - julianday(CURRENT_DATE) AS INTEGER) AS day_offset, weight "
+            "FROM weight_entries WHERE julianday(entry_date) > julianday(CURRENT_DATE) - %s "
+            "ORDER BY user_id, entry_date, entry_time",
+            (lookback_days,)
+        )
+    else:
+        cursor.execute(
+            "SELECT user_id, (entry_date - CURRENT_DATE) AS day_offset, weight "
+            "FROM weight_entries WHERE entry_date > CURRENT_DATE - %s "
+            "ORDER BY user_id, entry_date, entry_time",
+            (lookback_days,)
+        )
+    user_chunks, day_chunks, weight_chunks = [], [], []
+    while True:
+        rows = cursor.fetchmany(FETCH_BATCH_SIZE)
+        if not rows:
+            break
+        chunk = np.array(rows, dtype=np.float64)
+        user_chunks.append(chunk[:, 0].astype(np.int64))
+        day_chunks.append(chunk[:, 1])
+        weight_chunks.append(chunk[:, 2])
+    cursor.close()
+
+    if not user_chunks:
+        return np.empty(0, np.int64), np.empty(0), np.empty(0)
+    return np.concatenate(user_chunks), np.concatenate(day_chunks), np.concatenate(weight_chunks)
+
+
+def load_weight_goals(conn):
+    cursor = conn.cursor()
+    cursor.execute("SELECT user_id, target_value FROM goals WHERE goal_type = 'weight'")
+    rows = cursor.fetchall()
+    cursor.close()
+    if not rows:
+        return np.empty(0, np.int64), np.empty(0)
+    arr = np.array(rows, dtype=np.float64)
+    return arr[:, 0].astype(np.int64), arr[:, 1]
+
+
+def compute_trends(user_ids, day_offsets, weights, goal_user_ids=None, goal_targets=None):
+    """
+    Calcula as tendências de todos os usuários de forma vetorizada.
+    Espera os arrays ordenados por (user_id, dia). Retorna um dicionário de arrays alinhados a 'user_id'.
+    """
+    n = len(user_ids)
+    if n == 0:
+        return {'user_id': np.empty(0, np.int64)}
+
+    # Fronteiras de cada usuário no array ordenado; 'group' é o índice do usuário para cada pesagem
+    is_start = np.empty(n, dtype=bool)
+    is_start[0] = True
+    np.not_equal(user_ids[1:], user_ids[:-1], out=is_start[1:])
+    starts = np.flatnonzero(is_start)
+    ends = np.r_[starts[1:], n] - 1
+    group = np.cumsum(is_start) - 1
+    n_users = len(starts)
+    samples = np.bincount(group, minlength=n_users)
+
+    latest_weight = weights[ends]
+
+    # Média exponencial normalizada: peso (1-alpha)^k para a k-ésima pesagem contando do fim
+    alpha = 1.0 - 0.5 ** (1.0 / EMA_HALF_LIFE)
+    rank_from_end = ends[group] - np.arange(n)
+    ema_w = (1.0 - alpha) ** rank_from_end
+    smoothed = np.bincount(group, ema_w * weights, n_users) / np.bincount(group, ema_w, n_users)
+
+    # Média simples dos últimos AVG_WINDOW_DAYS (NaN para quem não pesou nesse período)
+    recent = day_offsets > -AVG_WINDOW_DAYS
+    recent_count = np.bincount(group, recent.astype(np.float64), n_users)
+    recent_sum = np.bincount(group, np.where(recent, weights, 0.0), n_users)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        avg_7d = np.where(recent_count > 0, recent_sum / recent_count, np.nan)
+
+    # Inclinação por mínimos quadrados nos últimos SLOPE_WINDOW_DAYS, via somas agrupadas
+    in_window = (day_offsets > -SLOPE_WINDOW_DAYS).astype(np.float64)
+    t = day_offsets * in_window
+    x = weights * in_window
+    s_n = np.bincount(group, in_window, n_users)
+    s_t = np.bincount(group, t, n_users)
+    s_x = np.bincount(group, x, n_users)
+    s_tt = np.bincount(group, t * day_offsets, n_users)
+    s_tx = np.bincount(group, t * weights, n_users)
+    denom = s_n * s_tt - s_t * s_t
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope_per_day = np.where((s_n >= 2) & (denom > 0), (s_n * s_tx - s_t * s_x) / denom, np.nan)
+    weekly_change = slope_per_day * 7.0
+
+    # Projeção da meta: só quando a inclinação aponta para o alvo e não é desprezível
+    target = np.full(n_users, np.nan)
+    unique_users = user_ids[starts]
+    if goal_user_ids is not None and len(goal_user_ids):
+        order = np.argsort(goal_user_ids)
+        sorted_goal_users = goal_user_ids[order]
+        pos = np.searchsorted(sorted_goal_users, unique_users)
+        pos_clipped = np.minimum(pos, len(sorted_goal_users) - 1)
+        has_goal = sorted_goal_users[pos_clipped] == unique_users
+        target = np.where(has_goal, goal_targets[order][pos_clipped], np.nan)
+
+    remaining = target - smoothed
+    with np.errstate(invalid='ignore', divide='ignore'):
+        days_to_goal = remaining / slope_per_day
+    projectable = (
+        np.isfinite(days_to_goal)
+        & (np.abs(slope_per_day) >= MIN_SLOPE_KG_PER_DAY)
+        & (days_to_goal >= 0)
+        & (days_to_goal <= MAX_PROJECTION_DAYS)
+    )
+    days_to_goal = np.where(projectable, np.ceil(days_to_goal), np.nan)
+
+    return {
+        'user_id': unique_users,
+        'samples': samples,
+        'latest_weight': latest_weight,
+        'smoothed_weight': smoothed,
+        'avg_7d': avg_7d,
+        'weekly_change_kg': weekly_change,
+        'days_to_goal': days_to_goal,
+    }
+
+
+def _none_if_nan(value):
+    return None if np.isnan(value) else round(float(value), 3)
+
+
+def write_trends(conn, trends, today=None):
+    """
+    Grava as tendências em weight_trends com upserts em páginas (execute_values) e, na mesma transação, apaga as
+    linhas que esta execução não recalculou.
+    """
+    today = today or date.today()
+    # Mesmo carimbo em todas as linhas da execução: o que ficar com computed_at anterior é de usuário sem pesagens
+    computed_at = datetime.now().replace(microsecond=0)
+    rows = []
+    for i in range(len(trends['user_id'])):
+        days_to_goal = trends['days_to_goal'][i]
+        projected = None if np.isnan(days_to_goal) else today + timedelta(days=int(days_to_goal))
+        rows.append((
+            int(trends['user_id'][i]),
+            int(trends['samples'][i]),
+            _none_if_nan(trends['latest_weight'][i]),
+            _none_if_nan(trends['smoothed_weight'][i]),
+            _none_if_nan(trends['avg_7d'][i]),
+            _none_if_nan(trends['weekly_change_kg'][i]),
+            projected,
+            computed_at,
+        ))
+
+    upsert = (
+        "INSERT INTO weight_trends (user_id, samples, latest_weight, smoothed_weight, avg_7d, "
+        "weekly_change_kg, projected_goal_date, computed_at) VALUES %s "
+        "ON CONFLICT (user_id) DO UPDATE SET samples = EXCLUDED.samples, latest_weight = EXCLUDED.latest_weight, "
+        "smoothed_weight = EXCLUDED.smoothed_weight, avg_7d = EXCLUDED.avg_7d, "
+        "weekly_change_kg = EXCLUDED.weekly_change_kg, projected_goal_date = EXCLUDED.projected_goal_date, "
+        "computed_at = EXCLUDED.computed_at"
+    )
+    template = "(%s, %s, %s, %s, %s, %s, %s, %s)"
+    cursor = conn.cursor()
+    if is_sqlite():
+        cursor.executemany(upsert % template, rows)
+    else:
+        execute_values(cursor, upsert, rows, template=template, page_size=WRITE_PAGE_SIZE)
+    cursor.execute("DELETE FROM weight_trends WHERE computed_at IS NULL OR computed_at < %s", (computed_at,))
+    pruned = cursor.rowcount
+    conn.commit()
+    if pruned:
+        print(f"DEBUG TRENDS: {pruned} tendências sem pesagens recentes removidas.")
+    cursor.close()
+    return len(rows)
+
+
+def run_weight_trends_job():
+    # user_id só é único dentro de um shard, então cada shard é calculado e gravado separadamente
+    return sum(run_weight_trends_shard(shard) for shard in shard_indices())
+
+
+def run_weight_trends_shard(shard):
+    started = time.perf_counter()
+    conn = get_db_connection('write', shard=shard)
+    try:
+        user_ids, day_offsets, weights = load_weight_series(conn)
+        goal_user_ids, goal_targets = load_weight_goals(conn)
+        loaded = time.perf_counter()
+        print(f"DEBUG TRENDS: {len(weights)} pesagens carregadas em {loaded - started:.1f}s.")
+
+        trends = compute_trends(user_ids, day_offsets, weights, goal_user_ids, goal_targets)
+        computed = time.perf_counter()
+        print(f"DEBUG TRENDS: tendências de {len(trends['user_id'])} usuários calculadas em {computed - loaded:.2f}s.")
+
+        written = write_trends(conn, trends)
+        print(f"Job de tendência de peso concluído no shard {shard}: {written} usuários atualizados em {time.perf_counter() - started:.1f}s.")
+        return written
+    finally:
+        conn.close()
+
+
+if __name__ == '__main__':
+    init_db()
+    run_weight_trends_job()
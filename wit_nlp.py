@@ -4,11 +4,16 @@ import os
 from dotenv import load_dotenv
 import re 
 from datetime import datetime 
+from resilience import get_breaker, time_remaining
 
 load_dotenv()
 
 WIT_AI_SERVER_ACCESS_TOKEN = os.getenv('WIT_AI_SERVER_ACCESS_TOKEN')
 WIT_AI_API_URL = "https://api.wit.ai/message"
+# Teto por chamada; dentro do webhook vale o que sobrar do orçamento da requisição, se for menor
+WIT_AI_TIMEOUT_SECONDS = float(os.getenv('WIT_AI_TIMEOUT_SECONDS', '3'))
+# Abaixo disso nem vale tentar: a resposta não chegaria a tempo
+WIT_AI_MIN_TIMEOUT_SECONDS = 0.5
 
 def get_wit_ai_response(text_message):
     headers = {
@@ -20,24 +25,34 @@ def get_wit_ai_response(text_message):
         "v": "20240501" 
     }
 
+    # None = Wit.ai indisponível (erro, timeout ou breaker aberto); quem chama usa parse_local_message()
+    timeout = min(WIT_AI_TIMEOUT_SECONDS, time_remaining(WIT_AI_TIMEOUT_SECONDS))
+    if timeout < WIT_AI_MIN_TIMEOUT_SECONDS:
+        print("AVISO: orçamento da requisição quase no fim, pulando o Wit.ai.")
+        return None
+    breaker = get_breaker('wit_ai')
+    if not breaker.allow():
+        return None
+
     try:
-        response = requests.get(WIT_AI_API_URL, headers=headers, params=params)
+        response = requests.get(WIT_AI_API_URL, headers=headers, params=params, timeout=timeout)
         response.raise_for_status() 
-        return response.json()
+        result = response.json()
     except requests.exceptions.RequestException as e:
         print(f"Erro ao conectar com Wit.ai: {e}")
+        breaker.record_failure()
         return None
     except Exception as e:
         print(f"Erro inesperado ao processar resposta do Wit.ai: {e}")
+        breaker.record_failure()
         return None
+    breaker.record_success()
+    return result
 
 def parse_wit_ai_response(wit_response):
-    if not wit_response or 'intents' not in wit_response or not wit_response['intents']:
-        if not wit_response['intents'] or wit_response['intents'][0]['confidence'] < 0.7:
-            return {'intent': 'none', 'entities': {}}
-        main_intent = wit_response['intents'][0]['name']
-    else:
-        main_intent = wit_response['intents'][0]['name'] 
+    if not wit_response or not wit_response.get('intents'):
+        return {'intent': 'none', 'entities': {}}
+    main_intent = wit_response['intents'][0]['name'] 
 
     entities = {}
     entities['food_item'] = [] 
@@ -102,6 +117,130 @@ def parse_wit_ai_response(wit_response):
 
     return {'intent': main_intent, 'entities': entities}
 
+# --- FALLBACK LOCAL (sem Wit.ai) ---
+# Regras simples para os comandos principais, no mesmo formato de parse_wit_ai_response().
+# Só entra em ação quando o Wit.ai está fora; não tenta competir com ele em frases livres.
+_LOCAL_FOOD_PATTERN = re.compile(
+    r'^(?:eu\s+)?(?:comi|almocei|jantei|lanchei|tomei|bebi|registrar?|anota[r]?)\s+(?:um[a]?\s+|o\s+|a\s+)?(.+)$')
+_LOCAL_GOAL_PATTERN = re.compile(r'\bmeta\b\D*(\d+(?:[.,]\d+)?)')
+_LOCAL_WEIGHT_PATTERN = re.compile(r'\b(?:peso|pesando|pesei)\b\D*(\d+(?:[.,]\d+)?)')
+_LOCAL_GREETINGS = {'oi', 'ola', 'olá', 'bom dia', 'boa tarde', 'boa noite', 'e ai', 'e aí', 'opa'}
+
+def parse_local_message(text_message):
+    text = re.sub(r'\s+', ' ', (text_message or '').lower()).strip().rstrip('!?.')
+    if not text:
+        return {'intent': 'none', 'entities': {}}
+    if text in _LOCAL_GREETINGS:
+        return {'intent': 'saudacao', 'entities': {}}
+
+    # Meta e peso antes da refeição: "registrar peso 80" e "anota meta 2000" também começam com verbo de registro
+    goal_match = _LOCAL_GOAL_PATTERN.search(text)
+    if goal_match:
+        return {'intent': 'definir_meta', 'entities': {'goal_value': [goal_match.group(1).replace(',', '.')]}}
+
+    if 'tendência' in text or 'tendencia' in text:
+        return {'intent': 'obter_tendencia_peso', 'entities': {}}
+    weight_match = _LOCAL_WEIGHT_PATTERN.search(text)
+    if weight_match:
+        return {'intent': 'registrar_peso', 'entities': {'weight': [weight_match.group(1).replace(',', '.')]}}
+
+    food_match = _LOCAL_FOOD_PATTERN.match(text)
+    if food_match:
+        return {'intent': 'registrar_refeicao', 'entities': {'food_item': [food_match.group(1).strip()]}}
+    if is_recommendation_request(text):
+        return {'intent': 'recomendar_alimento', 'entities': {}}
+    if 'micronutriente' in text or 'vitamina' in text:
+        return {'intent': 'obter_micronutrientes', 'entities': {}}
+    if 'resumo' in text or 'relatório' in text or 'relatorio' in text:
+        if 'semana' in text:
+            return {'intent': 'obter_resumo_semanal', 'entities': {}}
+        if 'mês' in text or 'mes' in text.split() or 'mensal' in text:
+            return {'intent': 'obter_resumo_mensal', 'entities': {}}
+        return {'intent': 'obter_resumo_diario', 'entities': {}}
+    return {'intent': 'none', 'entities': {}}
+
+# --- ATALHOS DE RE-REGISTRO ---
+# Frases que re-registram refeições do histórico do usuário sem passar pelo Wit.ai nem pela busca na TACO
+_RELOG_USUAL_PATTERN = re.compile(r'^(?:o|a) de sempre$')
+_RELOG_LIST_WORDS = {'recentes', 'favoritos', 'meus recentes', 'meus favoritos', 'meus alimentos'}
+_RELOG_MEAL_PATTERN = re.compile(
+    r'^(?:repetir|repete|repita|mesmo|mesma|o mesmo|a mesma)\s+(?:o\s+|a\s+|do\s+|da\s+)?'
+    r'(caf[eé] da manh[aã]|caf[eé]|almo[cç]o|lanche|jantar|janta)'
+    r'(?:\s+(?:de|do dia de)\s+(hoje|ontem|anteontem))?$'
+)
+_MEAL_KEYS = {'cafe': 'cafe_da_manha', 'almoco': 'almoco', 'lanche': 'lanche', 'jantar': 'jantar', 'janta': 'jantar'}
+_DAYS_AGO = {'hoje': 0, 'ontem': 1, 'anteontem': 2}
+
+def parse_relog_command(text_message):
+    """
+    Reconhece "o de sempre", "recentes" e "repetir almoço de ontem".
+    Retorna {'command': 'usual'}, {'command': 'list'}, {'command': 'repeat_meal', 'meal': ..., 'days_ago': ...}
+    ou None.
+    """
+    text = re.sub(r'\s+', ' ', (text_message or '').lower()).strip().rstrip('!?.')
+    if text in _RELOG_LIST_WORDS:
+        return {'command': 'list'}
+    if _RELOG_USUAL_PATTERN.match(text):
+        return {'command': 'usual'}
+    meal_match = _RELOG_MEAL_PATTERN.match(text)
+    if meal_match:
+        meal_word = meal_match.group(1).replace('é', 'e').replace('ç', 'c').split()[0]
+        return {'command': 'repeat_meal', 'meal': _MEAL_KEYS[meal_word],
+                'days_ago': _DAYS_AGO[meal_match.group(2) or 'ontem']}
+    return None
+
+# --- SUGESTÕES ---
+# "O que ainda posso comer?": frases curtas e fixas, reconhecidas antes do Wit.ai (e no fallback local)
+_RECOMMENDATION_PATTERN = re.compile(
+    r'(?:o )?que (?:eu )?(?:ainda )?(?:posso|d[aá] pra|d[aá] para) comer(?: hoje| agora| ainda)?'
+    r'|(?:me )?(?:d[eê] |manda )?(?:uma |umas |alguma |algumas )?sugest(?:[aã]o|[oõ]es)(?: (?:de|do que|pra|para) comer)?'
+    r'|(?:me )?(?:sugira|sugere|recomende|recomenda) (?:algo|alguma coisa|o que comer)(?: (?:pra|para) comer)?'
+)
+
+def is_recommendation_request(text_message):
+    """True para "o que ainda posso comer?", "sugestões", "me recomenda algo" e variações (a frase inteira)."""
+    text = re.sub(r'\s+', ' ', (text_message or '').lower()).strip().rstrip('!?.')
+    return _RECOMMENDATION_PATTERN.fullmatch(text) is not None
+
+# --- META DE PESO ---
+# "Meta de peso 70": a meta que o weight_trends.py usa para projetar a data; reconhecida antes do Wit.ai, que só
+# conhece a meta de calorias
+_WEIGHT_GOAL_PATTERN = re.compile(
+    r'(?:definir |define |defina |minha )?meta de peso(?: (?:de|é|e|para|pra|em))?'
+    r' (\d+(?:[.,]\d+)?)(?: ?(?:kg|quilos|kilos))?'
+)
+
+def parse_weight_goal(text_message):
+    """Retorna o peso alvo (float) de "meta de peso 70", "minha meta de peso é 68,5 kg" e variações, ou None."""
+    text = re.sub(r'\s+', ' ', (text_message or '').lower()).strip().rstrip('!?.')
+    goal_match = _WEIGHT_GOAL_PATTERN.fullmatch(text)
+    return float(goal_match.group(1).replace(',', '.')) if goal_match else None
+
+# --- HISTÓRICO ---
+# "histórico" lista as entradas (paginado); "apagar" lista para escolher o que apagar; "apagar 2 5" apaga itens
+# da página que está aberta
+_HISTORY_WORDS = {'histórico', 'historico', 'meu histórico', 'meu historico', 'meus registros', 'registros'}
+_HISTORY_MORE_WORDS = {'mais', 'ver mais', 'mais antigos', 'próxima', 'proxima', 'próxima página', 'proxima pagina'}
+_HISTORY_DELETE_PATTERN = re.compile(
+    r'^(?:apagar|apaga|apague|excluir|exclui|exclua|remover|remove|remova)'
+    r'(?:\s+(?:o|os|a|as))?(?:\s+(?:item|itens|registro|registros))?((?:[\s,e]+\d+)*)$'
+)
+
+def parse_history_command(text_message):
+    """
+    Reconhece "histórico", "mais" e "apagar 2 5".
+    Retorna {'command': 'list'}, {'command': 'more'}, {'command': 'delete', 'choices': [...]} ou None.
+    """
+    text = re.sub(r'\s+', ' ', (text_message or '').lower()).strip().rstrip('!?.')
+    if text in _HISTORY_WORDS:
+        return {'command': 'list'}
+    if text in _HISTORY_MORE_WORDS:
+        return {'command': 'more'}
+    delete_match = _HISTORY_DELETE_PATTERN.match(text)
+    if delete_match:
+        return {'command': 'delete', 'choices': re.findall(r'\d+', delete_match.group(1))}
+    return None
+
 # Exemplo de uso (para testar localmente)
 if __name__ == '__main__':
     # Certifique-se que WIT_AI_SERVER_ACCESS_TOKEN está no seu .env